@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import stat
+import inspect
+import shutil
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+from array import array
+
+# 模拟网络使用的网段（不会真正发出报文）
+SIM_NETWORK = '10.0.0.0'
+# icmp/tcp引擎在本机回环网段上测试，所有地址都在线
+LOOPBACK_NETWORK = '127.0.0.0'
+# tcp引擎连接的端口，回环地址上一般没有监听，收到RST即判定在线
+BENCH_TCP_PORT = 9
+# 传递模拟参数给伪ping程序的环境变量
+SIM_ENV = 'IP_SCANNER_BENCH_SIM'
+# 伪ping记录每个地址已探测次数的目录，重试时不会重复上一次的丢包结果
+SIM_STATE_ENV = 'IP_SCANNER_BENCH_STATE'
+
+# 伪ping程序，放在临时目录中并加到PATH最前面。程序内嵌Simulation类的源码，
+# 只导入几个轻量模块，避免进程启动开销淹没被测的扫描流程
+FAKE_PING = """#!{python} -S
+import os, sys, json, time
+SIM_ENV = {sim_env!r}
+SIM_STATE_ENV = {sim_state_env!r}
+{simulation}
+sys.exit(Simulation.from_env().fake_ping(sys.argv[1:]))
+"""
+
+# 模拟网络
+class Simulation:
+    """按种子确定的模拟网络：每个地址是否在线、每次探测的延迟和是否丢包
+
+    所有结果都由(种子, 地址, 第几次探测)经哈希得到，不保存任何状态，
+    因此伪ping进程和进程内模拟引擎看到的是同一个网络，多次运行结果可以复现。
+    """
+
+    def __init__(self, seed=1, up_ratio=0.5, pattern='random', latency=5.0, jitter=2.0, loss=0.0):
+        """
+        Args:
+            seed: 随机种子
+            up_ratio: 在线主机比例
+            pattern: 在线主机分布，random随机，block每个/24前部连续在线，stride等间隔在线
+            latency: 平均往返时间（毫秒）
+            jitter: 往返时间的波动范围（毫秒）
+            loss: 每次探测的丢包率
+        """
+        self.seed = seed
+        self.up_ratio = up_ratio
+        self.pattern = pattern
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+
+    def to_dict(self):
+        return {'seed': self.seed, 'up_ratio': self.up_ratio, 'pattern': self.pattern,
+                'latency': self.latency, 'jitter': self.jitter, 'loss': self.loss}
+
+    @classmethod
+    def from_env(cls):
+        return cls(**json.loads(os.environ.get(SIM_ENV, '{}')))
+
+    def _uniform(self, address, salt=0):
+        # splitmix64，返回[0, 1)之间的伪随机数
+        x = (address * 0x9E3779B97F4A7C15 + self.seed * 0xBF58476D1CE4E5B9 + salt) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return (x ^ (x >> 31)) / 2.0 ** 64
+
+    def is_up(self, address):
+        """地址（整数）是否在线，即基准测试的真实结果"""
+        if self.pattern == 'block':
+            return address % 256 < self.up_ratio * 256
+        if self.pattern == 'stride':
+            return self.up_ratio > 0 and address % max(1, round(1 / self.up_ratio)) == 0
+        return self._uniform(address) < self.up_ratio
+
+    def reply(self, address, attempt=0):
+        """第attempt次探测的往返时间（秒），没有回复返回None"""
+        if not self.is_up(address) or self._uniform(address, attempt + 1) < self.loss:
+            return None
+        spread = self.jitter * (2 * self._uniform(address, -attempt - 1) - 1)
+        return max(0.0, self.latency + spread) / 1000
+
+    @staticmethod
+    def claim_attempts(address, count):
+        """在状态目录中登记address的count次探测，返回第一次探测的序号
+
+        每个伪ping是独立的进程，靠独占创建文件在进程之间分配序号；没有状态目录时从0开始
+        """
+        directory = os.environ.get(SIM_STATE_ENV)
+        if not directory:
+            return 0
+        first = 0
+        while True:
+            try:
+                os.close(os.open(os.path.join(directory, f"{address}.{first}"), os.O_CREAT | os.O_EXCL))
+                break
+            except FileExistsError:
+                first += count
+        return first
+
+    def fake_ping(self, argv):
+        """模拟系统ping命令的输出，参数格式与ping_ip()使用的一致
+
+        Returns:
+            int: 进程退出码，收到回复为0
+        """
+        count, wait, target = 1, 1.0, argv[-1]
+        for option, value in zip(argv, argv[1:]):
+            if option in ('-c', '-n'):
+                count = int(value)
+            elif option == '-W':
+                # ping_ip()把不足1秒的超时取整为0，这里按1秒处理
+                wait = float(value) or 1.0
+            elif option == '-w':
+                wait = int(value) / 1000
+        address = int.from_bytes(bytes(int(part) for part in target.split('.')), 'big')
+        first = self.claim_attempts(address, count)
+        replies = 0
+        start = time.monotonic()
+        for attempt in range(count):
+            # 与真实的ping一样每秒发送一个请求
+            time.sleep(max(0.0, start + attempt - time.monotonic()))
+            rtt = self.reply(address, first + attempt)
+            if rtt is not None and rtt <= wait:
+                time.sleep(rtt)
+                print(f"64 bytes from {target}: icmp_seq={attempt + 1} ttl=64 time={rtt * 1000:.3f} ms")
+                replies += 1
+        if not replies:
+            time.sleep(wait)
+        print(f"{count} packets transmitted, {replies} received")
+        return 0 if replies else 1
+
+# 进程内模拟探测引擎
+class SimulatedProber:
+    """与ICMPProber接口相同的模拟引擎，用asyncio.sleep代替真实的网络往返
+
+    按地址记录已经探测的次数，两阶段扫描的重试与-p的多次探测看到相同的丢包序列。
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self._attempts = {}
+
+    def open(self, loop):
+        pass
+
+    def close(self):
+        pass
+
+    async def probe_host(self, ip, count=1, timeout=500):
+        address = int(ip)
+        first = self._attempts.get(address, 0)
+        self._attempts[address] = first + count
+        for attempt in range(first, first + count):
+            rtt = self.simulation.reply(address, attempt)
+            if rtt is not None and rtt * 1000 <= timeout:
+                await asyncio.sleep(rtt)
+                return rtt, None
+            await asyncio.sleep(timeout / 1000)
+        return None, None
+
+def percentile(sorted_values, fraction):
+    """已排序序列的百分位数（最近秩法）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def peak_rss_kb():
+    """当前进程的峰值常驻内存（KB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS以字节为单位，Linux以KB为单位
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# 运行单个测试用例（在独立的子进程中执行，以便单独统计内存）
+def run_case(case):
+    """用ip_scanner的扫描流程扫描一个网段并与真实结果比较
+
+    Args:
+        case: 用例参数字典（engine、threads、prefix、count、retries、timeout、adaptive、simulation）
+
+    Returns:
+        dict: 吞吐量、完成时间百分位、峰值内存和准确率
+    """
+    import ip_scanner
+
+    engine = case['engine']
+    simulation = Simulation(**case['simulation'])
+    loopback = engine in ('icmp', 'tcp')
+    base = LOOPBACK_NETWORK if loopback else SIM_NETWORK
+    host_range = ip_scanner.parse_network(f"{base}/{case['prefix']}")
+    results = ip_scanner.ScanResults(host_range, track_rtt=True)
+    controller = ip_scanner.RateController(case['threads'], adaptive=case['adaptive'])
+
+    # 每个主机得到结果时距扫描开始的时间
+    finished = array('d')
+    start = time.perf_counter()
+
+    def on_result(slot, ip, is_reachable, rtt):
+        finished.append(time.perf_counter() - start)
+
+    prober = SimulatedProber(simulation) if engine == 'sim' else None
+    ip_scanner.run_scan(results, engine, controller, on_result, count=case['count'], timeout=case['timeout'],
+                        ports=(BENCH_TCP_PORT,), retries=case['retries'], prober=prober)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    # 与真实结果比较（回环网段所有地址都在线）
+    false_negatives = false_positives = 0
+    for slot in range(len(results)):
+        truth = loopback or simulation.is_up(int(results.address(slot)))
+        reachable = results.status[slot] == ip_scanner.STATUS_REACHABLE
+        if truth and not reachable:
+            false_negatives += 1
+        elif reachable and not truth:
+            false_positives += 1
+
+    hosts = len(results)
+    finished = sorted(finished)
+    return {
+        'hosts': hosts,
+        'seconds': round(elapsed, 4),
+        'ips_per_sec': round(hosts / elapsed, 1),
+        'p50_ms': round(percentile(finished, 0.50) * 1000, 2) if finished else None,
+        'p99_ms': round(percentile(finished, 0.99) * 1000, 2) if finished else None,
+        'peak_rss_kb': peak_rss_kb(),
+        'reachable': results.count(ip_scanner.STATUS_REACHABLE),
+        'recovered': results.recovered,
+        'false_negatives': false_negatives,
+        'false_positives': false_positives,
+        'accuracy': round(1 - (false_negatives + false_positives) / hosts, 6) if hosts else None,
+    }
+
+def write_fake_ping(directory):
+    """在directory中生成伪ping程序"""
+    path = os.path.join(directory, 'ping')
+    with open(path, 'w') as f:
+        f.write(FAKE_PING.format(python=sys.executable, sim_env=SIM_ENV, sim_state_env=SIM_STATE_ENV,
+                                  simulation=inspect.getsource(Simulation)))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def git_revision():
+    """当前代码的git提交号，用于区分不同版本的测试结果"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(args):
+    """按engines × threads × prefixes的组合逐个运行用例，结果写为JSON"""
+    simulation = Simulation(args.seed, args.up_ratio, args.pattern, args.latency, args.jitter, args.loss)
+    fake_dir = tempfile.mkdtemp(prefix='ip_scanner_bench_')
+    env = dict(os.environ)
+    env[SIM_ENV] = json.dumps(simulation.to_dict())
+    if sys.platform.startswith('win'):
+        print("[警告] Windows上不支持伪ping程序，ping引擎的用例会调用系统ping命令")
+    else:
+        write_fake_ping(fake_dir)
+        env['PATH'] = fake_dir + os.pathsep + env.get('PATH', '')
+
+    cases = []
+    try:
+        for engine in args.engines.split(','):
+            for threads in (int(value) for value in args.threads.split(',')):
+                for prefix in (int(value) for value in args.prefixes.split(',')):
+                    case = {
+                        'engine': engine,
+                        'threads': threads,
+                        'prefix': prefix,
+                        'count': args.packets,
+                        'retries': args.retries,
+                        'timeout': args.timeout,
+                        'adaptive': not args.no_adaptive,
+                        'simulation': simulation.to_dict(),
+                    }
+                    print(f"[测试] 引擎: {engine}, 并发: {threads}, 网段: /{prefix} ...", end=' ', flush=True)
+                    env[SIM_STATE_ENV] = tempfile.mkdtemp(dir=fake_dir)
+                    proc = subprocess.run([sys.executable, os.path.abspath(__file__), 'case', json.dumps(case)],
+                                          capture_output=True, text=True, env=env)
+                    if proc.returncode != 0:
+                        error = (proc.stderr.strip().splitlines() or ['未知错误'])[-1]
+                        print(f"失败: {error}")
+                        cases.append({**case, 'error': error})
+                        continue
+                    result = json.loads(proc.stdout)
+                    print(f"{result['ips_per_sec']:.1f} 个IP/秒, p50 {result['p50_ms']} 毫秒, "
+                          f"p99 {result['p99_ms']} 毫秒, 峰值内存 {result['peak_rss_kb']} KB, "
+                          f"准确率 {result['accuracy']:.4f}")
+                    cases.append({**case, **result})
+    finally:
+        shutil.rmtree(fake_dir, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': cases,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[完成] 结果已保存到 {args.output}")
+
+def case_key(case):
+    return case['engine'], case['threads'], case['prefix']
+
+def compare_reports(args):
+    """比较两次测试结果中相同用例的吞吐量和p99完成时间"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = {case_key(case): case for case in json.load(f)['cases'] if 'error' not in case}
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)['cases']
+    print(f"| {'引擎':<6} | {'并发':>6} | {'网段':>4} | {'吞吐量变化':>10} | {'p99变化':>10} | {'准确率':>8} |")
+    regressions = 0
+    for case in current:
+        old = baseline.get(case_key(case))
+        if old is None or 'error' in case:
+            continue
+        speed = (case['ips_per_sec'] / old['ips_per_sec'] - 1) * 100
+        p99 = (case['p99_ms'] / old['p99_ms'] - 1) * 100 if old['p99_ms'] else 0.0
+        if speed < -args.tolerance:
+            regressions += 1
+        print(f"| {case['engine']:<6} | {case['threads']:>6} | /{case['prefix']:<3} | {speed:>+9.1f}% | "
+              f"{p99:>+9.1f}% | {case['accuracy']:>8.4f} |")
+    if regressions:
+        print(f"[警告] {regressions} 个用例的吞吐量下降超过 {args.tolerance:g}%")
+    return 1 if regressions else 0
+
+# --no-graph启动时不允许加载的重量级模块
+STARTUP_FORBIDDEN = ('matplotlib', 'numpy')
+
+def run_process(command):
+    """运行命令并返回(耗时秒数, 峰值常驻内存KB或None, 标准错误输出)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    stderr = proc.stderr.read()
+    peak = None
+    if hasattr(os, 'wait4'):
+        # wait4可以取得这一个子进程的资源使用情况
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        peak = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    else:
+        proc.wait()
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"命令执行失败（{proc.returncode}）: {' '.join(command)}\n{stderr}")
+    return elapsed, peak, stderr
+
+def check_startup(args):
+    """检查--no-graph扫描的启动开销是否超出预算
+
+    用tcp方式扫描一个回环地址（不需要root权限），多次运行取中位数，
+    减去空解释器的启动时间后与预算比较，并确认没有加载matplotlib/numpy。
+
+    Returns:
+        int: 进程退出码，超出预算为1
+    """
+    scanner = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ip_scanner.py')
+    command = [sys.executable, scanner, '-n', '127.0.0.1', '--probe', f'tcp:{BENCH_TCP_PORT}', '--no-graph', '-q']
+    baseline = sorted(run_process([sys.executable, '-c', 'pass'])[0] for _ in range(args.repeat))
+    runs = sorted(run_process(command)[:2] for _ in range(args.repeat))
+    overhead_ms = (runs[len(runs) // 2][0] - baseline[len(baseline) // 2]) * 1000
+    peak_kb = max((peak for _, peak in runs if peak is not None), default=None)
+
+    # 用-X importtime找出实际导入的模块
+    _, _, imports = run_process([sys.executable, '-X', 'importtime'] + command[1:])
+    loaded = {line.rsplit('|', 1)[-1].strip().split('.')[0] for line in imports.splitlines()
+              if line.startswith('import time:')}
+    forbidden = [name for name in STARTUP_FORBIDDEN if name in loaded]
+
+    print(f"[启动] 启动开销: {overhead_ms:.1f} 毫秒（预算 {args.budget_ms:g} 毫秒）")
+    if peak_kb is not None:
+        print(f"[启动] 峰值内存: {peak_kb} KB（预算 {args.rss_budget_kb} KB）")
+    failures = []
+    if overhead_ms > args.budget_ms:
+        failures.append("启动开销超出预算")
+    if peak_kb is not None and peak_kb > args.rss_budget_kb:
+        failures.append("峰值内存超出预算")
+    if forbidden:
+        failures.append(f"加载了不需要的模块: {', '.join(forbidden)}")
+    for failure in failures:
+        print(f"[失败] {failure}")
+    if not failures:
+        print("[通过] 启动开销在预算之内")
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='ip_scanner扫描性能基准测试')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run = subparsers.add_parser('run', help='运行基准测试（默认）')
+    run.add_argument('--engines', default='sim,ping',
+                     help='逗号分隔的引擎：sim为进程内模拟网络，ping为伪ping程序，icmp/tcp扫描本机回环网段（默认：sim,ping）')
+    run.add_argument('--threads', default='100', help='逗号分隔的并发数（默认：100）')
+    run.add_argument('--prefixes', default='24', help='逗号分隔的网段前缀长度（默认：24）')
+    run.add_argument('-p', '--packets', type=int, default=1, help='每个IP的探测次数（默认：1）')
+    run.add_argument('-w', '--timeout', type=int, default=500, help='超时时间（毫秒，默认：500）')
+    run.add_argument('--retries', type=int, default=0, help='两阶段扫描的重试轮数（默认：0）')
+    run.add_argument('--no-adaptive', action='store_true', help='关闭自适应并发控制')
+    run.add_argument('--up-ratio', type=float, default=0.5, help='模拟网络中在线主机的比例（默认：0.5）')
+    run.add_argument('--pattern', choices=['random', 'block', 'stride'], default='random',
+                     help='在线主机的分布方式（默认：random）')
+    run.add_argument('--latency', type=float, default=5.0, help='模拟往返时间（毫秒，默认：5）')
+    run.add_argument('--jitter', type=float, default=2.0, help='往返时间的波动范围（毫秒，默认：2）')
+    run.add_argument('--loss', type=float, default=0.0, help='每次探测的丢包率（默认：0）')
+    run.add_argument('--seed', type=int, default=1, help='模拟网络的随机种子（默认：1）')
+    run.add_argument('-o', '--output', default='bench_results.json', help='结果文件（默认：bench_results.json）')
+
+    compare = subparsers.add_parser('compare', help='比较两次测试结果')
+    compare.add_argument('baseline', help='基准结果文件')
+    compare.add_argument('current', help='当前结果文件')
+    compare.add_argument('--tolerance', type=float, default=10.0,
+                         help='吞吐量下降超过该百分比时视为性能退化（默认：10）')
+
+    startup = subparsers.add_parser('startup', help='检查--no-graph扫描的启动开销是否超出预算')
+    startup.add_argument('--budget-ms', type=float, default=250.0,
+                         help='允许的启动开销（毫秒，不含空解释器启动时间，默认：250）')
+    startup.add_argument('--rss-budget-kb', type=int, default=40960, help='允许的峰值内存（KB，默认：40960）')
+    startup.add_argument('--repeat', type=int, default=5, help='运行次数，取中位数（默认：5）')
+
+    case = subparsers.add_parser('case', help='运行单个用例（由run在子进程中调用）')
+    case.add_argument('spec', help='JSON格式的用例参数')
+
+    # 未指定子命令时默认为run
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ('run', 'compare', 'startup', 'case', '-h', '--help'):
+        argv = ['run'] + argv
+    args = parser.parse_args(argv)
+    if args.command == 'case':
+        print(json.dumps(run_case(json.loads(args.spec))))
+    elif args.command == 'compare':
+        sys.exit(compare_reports(args))
+    elif args.command == 'startup':
+        sys.exit(check_startup(args))
+    else:
+        run_benchmarks(args)
+
+if __name__ == "__main__":
+    main()
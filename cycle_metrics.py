@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import bisect
+import threading
+import itertools
+from contextlib import contextmanager
+
+# 每次循环计时的阶段及其名称，按执行顺序排列
+PHASES = {
+    'power_off': '下电',
+    'power_on': '上电',
+    'boot': '启动就绪',
+    'console': '串口命令',
+    'parse': '解析',
+    'persist': '保存',
+    'cycle': '整个循环',
+}
+# 按节点计时的阶段
+NODE_PHASES = ('power_off', 'power_on')
+
+# 直方图的桶上限（秒）：按E12系列每个数量级12个桶，覆盖从解析的毫秒级到启动等待的数分钟，
+# 相邻桶上限之比约为1.2，分位数由桶内线性插值估算
+HISTOGRAM_BUCKETS = tuple(round(mantissa * 10 ** exponent, 6) for exponent in range(-3, 3)
+                          for mantissa in (1, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2)) + (1000,)
+
+# Prometheus指标名称
+PROM_PHASE_METRIC = 'power_cycle_phase_seconds'
+PROM_NODE_METRIC = 'power_cycle_node_phase_seconds'
+PROM_CYCLES_METRIC = 'power_cycle_cycles_total'
+
+class Histogram:
+    """累计直方图，只保存各桶的计数、总数、总和、最小值和最大值，内存占用与样本数无关"""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 各桶（不累计）的样本数，最后一项为超过最大上限的样本
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self):
+        """返回各桶上限对应的累计样本数（Prometheus的le桶），不包括+Inf"""
+        return list(itertools.accumulate(self.counts[:-1]))
+
+    def percentile(self, percent):
+        """按桶计数估算分位数（与Prometheus的histogram_quantile相同，在桶内线性插值），
+        结果不超出样本的最小值和最大值，没有样本时返回None
+        """
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.max
+                lower = max(self.buckets[index - 1] if index else 0.0, self.min)
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+def format_labels(labels):
+    """把{名称: 值}格式化为Prometheus标签"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+class CycleMetrics:
+    """按阶段和节点记录每次循环的耗时
+
+    耗时使用time.monotonic()计时。每次循环结束时调用end_cycle()：
+    追加一条JSONL记录，并重写Prometheus textfile（供node_exporter的textfile收集器读取）。
+    测试结束时summary()给出各阶段的p50/p95/max。
+    """
+
+    def __init__(self, jsonl_path=None, prom_path=None, labels=None):
+        """
+        Args:
+            jsonl_path: 每次循环一行的JSONL文件，为None时不写入
+            prom_path: Prometheus textfile路径（以.prom结尾），为None时不写入
+            labels: 附加到所有Prometheus指标上的标签，例如{'dut': 'dut1'}
+        """
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.labels = dict(labels or {})
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.nodes = {}      # (阶段, 节点) -> Histogram
+        self.cycles = 0
+        self._current = {}
+        self._current_nodes = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds, node=None):
+        """记录一个阶段的耗时，node不为None时记录到该节点，同一次循环中多次记录时累加"""
+        with self._lock:
+            if node is None:
+                self._current[phase] = self._current.get(phase, 0.0) + seconds
+            else:
+                key = (phase, node)
+                self._current_nodes[key] = self._current_nodes.get(key, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """计时一段代码，发生异常时也会记录"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, time.monotonic() - start)
+
+    def end_cycle(self, cycle):
+        """结束一次循环：计入直方图并写出JSONL记录和Prometheus textfile
+
+        Returns:
+            dict: 本次循环各阶段的耗时
+        """
+        with self._lock:
+            phases, self._current = self._current, {}
+            nodes, self._current_nodes = self._current_nodes, {}
+            for phase, seconds in phases.items():
+                self.phases.setdefault(phase, Histogram()).observe(seconds)
+            for key, seconds in nodes.items():
+                self.nodes.setdefault(key, Histogram()).observe(seconds)
+            self.cycles += 1
+
+        if self.jsonl_path:
+            by_node = {}
+            for (phase, node), seconds in sorted(nodes.items(), key=lambda item: str(item[0][1])):
+                by_node.setdefault(str(node), {})[phase] = round(seconds, 3)
+            record = {
+                'cycle': cycle,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                **self.labels,
+                'phases': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+                'nodes': by_node,
+            }
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if self.prom_path:
+            self.write_prometheus()
+        return phases
+
+    def _histogram_lines(self, name, labels, histogram):
+        lines = []
+        for bound, count in zip(histogram.buckets, histogram.cumulative()):
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': f'{bound:g}'})} {count}")
+        lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return lines
+
+    def write_prometheus(self):
+        """原子地重写Prometheus textfile，避免收集器读到写了一半的文件"""
+        lines = [
+            f"# HELP {PROM_CYCLES_METRIC} 已完成的上下电循环次数",
+            f"# TYPE {PROM_CYCLES_METRIC} counter",
+            f"{PROM_CYCLES_METRIC}{format_labels(self.labels)} {self.cycles}",
+            f"# HELP {PROM_PHASE_METRIC} 每次循环各阶段的耗时（秒）",
+            f"# TYPE {PROM_PHASE_METRIC} histogram",
+        ]
+        with self._lock:
+            for phase, histogram in self.phases.items():
+                if histogram.count:
+                    lines.extend(self._histogram_lines(PROM_PHASE_METRIC, {**self.labels, 'phase': phase},
+                                                       histogram))
+            lines.append(f"# HELP {PROM_NODE_METRIC} 每次循环各节点下电/上电的耗时（秒），包括重试")
+            lines.append(f"# TYPE {PROM_NODE_METRIC} histogram")
+            for (phase, node), histogram in sorted(self.nodes.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                lines.extend(self._histogram_lines(PROM_NODE_METRIC, {**self.labels, 'phase': phase, 'node': node},
+                                                   histogram))
+        with open(self.prom_path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(self.prom_path + '.tmp', self.prom_path)
+
+    def summary(self):
+        """返回各阶段的统计：[(阶段, 名称, 次数, p50, p95, max), ...]，按节点的阶段名称为'阶段@节点'"""
+        rows = []
+        with self._lock:
+            for phase, histogram in self.phases.items():
+                if histogram.count:
+                    rows.append((phase, PHASES.get(phase, phase), histogram.count, histogram.percentile(50),
+                                 histogram.percentile(95), histogram.max))
+            for (phase, node), histogram in sorted(self.nodes.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                rows.append((f"{phase}@{node}", f"节点 {node} {PHASES.get(phase, phase)}", histogram.count,
+                             histogram.percentile(50), histogram.percentile(95), histogram.max))
+        return rows
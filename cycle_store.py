@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import bisect
+import struct
+from array import array
+
+# 端口状态向量中每个端口的编码
+LINK_CODES = {'Up': 'U', 'Down': 'D'}
+LINK_NAMES = {code: name for name, code in LINK_CODES.items()}
+# 本次循环没有出现的端口
+LINK_MISSING = '-'
+
+# 索引文件中的一项：类型、编号（循环次数或端口布局编号）、数据文件中的字节偏移、时间戳
+INDEX_ENTRY = struct.Struct('<BxxxIQd')
+INDEX_CYCLE = 0
+INDEX_LAYOUT = 1
+
+def port_sort_key(port):
+    """按数字顺序排列'1/10'这样的端口号"""
+    return tuple(int(part) for part in port.split('/'))
+
+class CycleStore:
+    """按循环追加的端口状态记录文件（JSONL）及其索引
+
+    数据文件每行一条JSON记录。端口顺序记录在端口布局行中，每次循环只写一个
+    与布局等长的状态字符串（U为Up，D为Down，-为未出现），端口集合变化时才追加新的布局行。
+    旁边的<数据文件>.idx为定长二进制索引，记录每条循环记录和布局行的字节偏移和时间戳，
+    读取某次循环或某个时间段时先在索引中二分查找，再直接定位到数据文件中的那几行。
+
+    写入先进入缓冲区，每flush_every条记录或flush_interval秒刷新一次，并按需fsync；
+    先刷新数据文件再刷新索引，索引不会指向尚未落盘的数据。打开时会丢弃不完整的最后一行，
+    并为崩溃前已写入数据文件、但还没写入索引的记录补建索引。只读打开时不修改文件，
+    可以在测试运行中读取。
+    """
+
+    def __init__(self, path, flush_every=10, flush_interval=30.0, fsync=True, readonly=False):
+        """
+        Args:
+            path: 数据文件路径，索引文件为path + '.idx'
+            flush_every: 每写入多少条循环记录刷新一次
+            flush_interval: 距上次刷新超过多少秒时刷新
+            fsync: 刷新时是否调用fsync确保写入磁盘
+            readonly: 只读打开，不修复文件，也不能追加记录
+        """
+        self.path = path
+        self.readonly = readonly
+        self.index_path = path + '.idx'
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # 索引内容：循环记录的循环次数、偏移、时间戳，以及布局编号 -> 偏移
+        self.cycles = array('I')
+        self.offsets = array('Q')
+        self.epochs = array('d')
+        self.layout_offsets = {}
+        self.monotonic = True      # 循环次数是否按写入顺序单调不减，是才能二分查找
+        self._layouts = {}         # 已读取的布局编号 -> 端口列表
+        self._current_layout = None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._data = None
+        self._index = None
+        self._recover()
+
+    def _recover(self):
+        """读取索引并与数据文件对齐，只读时只在内存中补全索引"""
+        data_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        entries = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                raw = f.read()
+            usable = len(raw) - len(raw) % INDEX_ENTRY.size
+            entries = [entry for entry in INDEX_ENTRY.iter_unpack(raw[:usable])]
+        # 丢弃指向数据文件末尾之外的索引项
+        while entries and entries[-1][2] >= data_size:
+            entries.pop()
+
+        # 从最后一条已索引的记录开始读数据文件，补建索引并截掉不完整的最后一行
+        start = entries[-1][2] if entries else 0
+        added = []
+        valid_end = start
+        if data_size > start:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                offset = start
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    if offset > start or not entries:
+                        entry = self._entry_for(line, offset)
+                        if entry is not None:
+                            added.append(entry)
+                    offset += len(line)
+                    valid_end = offset
+            if valid_end < data_size and not self.readonly:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_end)
+        entries.extend(added)
+
+        if not self.readonly:
+            with open(self.index_path, 'wb') as f:
+                for entry in entries:
+                    f.write(INDEX_ENTRY.pack(*entry))
+        for kind, number, offset, epoch in entries:
+            self._add_entry(kind, number, offset, epoch)
+        if self.layout_offsets:
+            self._current_layout = max(self.layout_offsets)
+
+    @staticmethod
+    def _entry_for(line, offset):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if 'ports' in record:
+            return (INDEX_LAYOUT, record['layout'], offset, record.get('epoch', 0.0))
+        return (INDEX_CYCLE, record['cycle'], offset, record['epoch'])
+
+    def _add_entry(self, kind, number, offset, epoch):
+        if kind == INDEX_LAYOUT:
+            self.layout_offsets[number] = offset
+        else:
+            if self.cycles and number < self.cycles[-1]:
+                self.monotonic = False
+            self.cycles.append(number)
+            self.offsets.append(offset)
+            self.epochs.append(epoch)
+
+    def _open_for_append(self):
+        if self.readonly:
+            raise ValueError(f"{self.path} 以只读方式打开")
+        if self._data is None:
+            self._data = open(self.path, 'ab')
+            self._index = open(self.index_path, 'ab')
+
+    def _append(self, kind, number, epoch, record):
+        self._open_for_append()
+        offset = self._data.tell()
+        self._data.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n')
+        self._index.write(INDEX_ENTRY.pack(kind, number, offset, epoch))
+        self._add_entry(kind, number, offset, epoch)
+
+    def _layout_for(self, ports, epoch):
+        """返回与端口集合对应的布局编号，端口集合变化时追加新的布局行"""
+        if self._current_layout is not None and self.layout(self._current_layout) == ports:
+            return self._current_layout
+        layout = 0 if self._current_layout is None else self._current_layout + 1
+        self._append(INDEX_LAYOUT, layout, epoch, {'layout': layout, 'epoch': epoch, 'ports': ports})
+        self._layouts[layout] = ports
+        self._current_layout = layout
+        return layout
+
+    def append(self, cycle, links, boot_time=None, epoch=None):
+        """追加一次循环的端口状态
+
+        Args:
+            cycle: 循环次数
+            links: {端口: 'Up'/'Down'}
+            boot_time: 上电到就绪的秒数，超时为None
+            epoch: 记录时间戳，默认为当前时间
+        """
+        epoch = time.time() if epoch is None else epoch
+        if self._current_layout is not None:
+            ports = self.layout(self._current_layout)
+            if set(links) - set(ports):
+                ports = sorted(set(ports) | set(links), key=port_sort_key)
+        else:
+            ports = sorted(links, key=port_sort_key)
+        layout = self._layout_for(ports, epoch)
+        vector = ''.join(LINK_CODES.get(links.get(port), LINK_MISSING) for port in ports)
+        self._append(INDEX_CYCLE, cycle, epoch, {
+            'cycle': cycle,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch)),
+            'epoch': epoch,
+            'boot_time': boot_time,
+            'layout': layout,
+            'links': vector,
+        })
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @property
+    def pending(self):
+        """已追加、但还没有刷新到磁盘的循环记录数"""
+        return self._pending
+    
+    def flush(self):
+        """刷新缓冲区，先数据文件后索引"""
+        if self._data is None:
+            return
+        for f in (self._data, self._index):
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """刷新并关闭文件"""
+        if self._data is not None:
+            self.flush()
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_line(self, offset, f=None):
+        """读取offset处的一条记录，f为已打开的数据文件，为None时临时打开"""
+        if f is None:
+            if self._data is not None:
+                self._data.flush()
+            with open(self.path, 'rb') as f:
+                return self._read_line(offset, f)
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def layout(self, layout):
+        """返回布局编号对应的端口列表"""
+        if layout not in self._layouts:
+            self._layouts[layout] = self._read_line(self.layout_offsets[layout])['ports']
+        return self._layouts[layout]
+
+    def _decode(self, record):
+        ports = self.layout(record['layout'])
+        record['links'] = {port: LINK_NAMES[code] for port, code in zip(ports, record['links'])
+                           if code != LINK_MISSING}
+        return record
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def record_at(self, position):
+        """按写入顺序读取第position条循环记录，端口状态解码为{端口: 'Up'/'Down'}"""
+        return self._decode(self._read_line(self.offsets[position]))
+
+    def _records_at(self, positions):
+        if self._data is not None:
+            self._data.flush()
+        with open(self.path, 'rb') as f:
+            for position in positions:
+                yield self._decode(self._read_line(self.offsets[position], f))
+
+    def find(self, cycle):
+        """读取指定循环次数的记录（同一循环次数有多条时返回最后一条），不存在时返回None"""
+        if self.monotonic:
+            position = bisect.bisect_right(self.cycles, cycle) - 1
+            if position >= 0 and self.cycles[position] == cycle:
+                return self.record_at(position)
+            return None
+        # 循环次数不是单调的（例如多次从头开始的测试写入同一文件）时二分查找可能落到
+        # 较早的一次上，改为从索引末尾逐项查找
+        for position in range(len(self.cycles) - 1, -1, -1):
+            if self.cycles[position] == cycle:
+                return self.record_at(position)
+        return None
+
+    def between(self, since=None, until=None):
+        """按写入顺序生成时间戳在[since, until]内的记录"""
+        low = 0 if since is None else bisect.bisect_left(self.epochs, since)
+        high = len(self.epochs) if until is None else bisect.bisect_right(self.epochs, until)
+        return self._records_at(range(low, high))
+
+    def records(self):
+        """按写入顺序生成全部记录"""
+        return self.between()
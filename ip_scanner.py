@@ -1,13 +1,22 @@
 import ipaddress
+import re
 import subprocess
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import socket
+import struct
+import ctypes
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import sys
 import argparse
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import numpy as np
+import random
+import math
+import bisect
+import queue
+import json
+import csv
+from array import array
 import os
 
 # 定义颜色常量
@@ -78,6 +87,9 @@ class Colors:
             color = color_map.get(color_code, '')
             print(f"{color}{text}{'\033[0m'}")
 
+# ping输出中的往返时间，例如"time=0.045 ms"、"时间=12ms"、"时间<1ms"
+PING_RTT_PATTERN = re.compile(r'(?:time|时间)\s*[=<]\s*([\d.]+)\s*ms', re.IGNORECASE)
+
 # ping测试函数
 def ping_ip(ip, count=1, timeout=500):
     """测试单个IP是否可达
@@ -90,6 +102,19 @@ def ping_ip(ip, count=1, timeout=500):
     Returns:
         bool: IP是否可达
     """
+    return ping_ip_rtt(ip, count=count, timeout=timeout)[0]
+
+def ping_ip_rtt(ip, count=1, timeout=500):
+    """测试单个IP是否可达，并从ping输出中取出往返时间
+    
+    Args:
+        ip: IP地址对象
+        count: ping包数量
+        timeout: 超时时间（毫秒）
+    
+    Returns:
+        tuple: (IP是否可达, 最小往返时间秒数，输出中没有时为None)
+    """
     try:
         # 根据操作系统选择ping命令和参数
         ip_str = str(ip)
@@ -107,7 +132,8 @@ def ping_ip(ip, count=1, timeout=500):
             stderr=subprocess.PIPE,
             text=True,
             shell=False,
-            timeout=timeout/1000 + 1  # 防止命令执行超时
+            # 防止命令执行超时；多个ping包之间还有约1秒的发送间隔
+            timeout=(count - 1) + timeout/1000 + 1
         )
         
         stdout = result.stdout
@@ -124,63 +150,1797 @@ def ping_ip(ip, count=1, timeout=500):
         is_reachable = (has_ttl and not has_unreachable) or \
                       (result.returncode == 0 and has_reply and not has_unreachable)
         
-        return is_reachable
+        # 多个回复时取最小值
+        rtts = [float(value) for value in PING_RTT_PATTERN.findall(stdout)]
+        return is_reachable, (min(rtts) / 1000 if is_reachable and rtts else None)
     except subprocess.TimeoutExpired:
         # 命令执行超时
-        return False
+        return False, None
     except Exception as e:
         # 其他异常
-        return False
+        return False, None
+
+# ICMP报文类型
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# echo请求携带的负载
+ICMP_PAYLOAD = b'ip_scanner'.ljust(32, b'\x00')
+
+# ICMP套接字接收缓冲区大小（字节）
+ICMP_RCVBUF = 4 * 1024 * 1024
+
+# Linux的SO_ATTACH_FILTER套接字选项
+SO_ATTACH_FILTER = 26
+
+def icmp_checksum(data):
+    """计算ICMP校验和（RFC 1071）"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def build_echo_request(ident, seq, version=4, payload=ICMP_PAYLOAD):
+    """构造ICMP/ICMPv6 echo请求报文
+    
+    Args:
+        ident: 标识符
+        seq: 序号
+        version: IP版本（4或6）
+        payload: 报文负载
+    
+    Returns:
+        bytes: 报文内容（ICMPv6的校验和由内核根据伪首部计算）
+    """
+    icmp_type = ICMP_ECHO_REQUEST if version == 4 else ICMPV6_ECHO_REQUEST
+    checksum = 0
+    if version == 4:
+        checksum = icmp_checksum(struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq) + payload)
+    return struct.pack('!BBHHH', icmp_type, 0, checksum, ident, seq) + payload
+
+# 进程内ICMP探测引擎
+class ICMPProber:
+    """基于ICMP echo套接字的异步探测引擎
+    
+    在一个事件循环里同时发送大量echo请求，按序号和源地址匹配回复，
+    不再为每个IP启动一个ping进程。优先使用无特权的SOCK_DGRAM ICMP套接字，
+    不被允许时退回原始套接字（需要root权限）。
+    """
+    
+    def __init__(self):
+        self._loop = None
+        self._sockets = {}  # IP版本 -> (套接字, 是否原始套接字)
+        self._pending = {}  # (IP版本, 序号) -> (目标IP字符串, future)
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = 0
+    
+    @staticmethod
+    def open_socket(version=4):
+        """打开ICMP套接字，返回(套接字, 是否原始套接字)"""
+        if version == 4:
+            family, proto = socket.AF_INET, socket.IPPROTO_ICMP
+        else:
+            family, proto = socket.AF_INET6, socket.IPPROTO_ICMPV6
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            raw = False
+        except OSError:
+            sock = socket.socket(family, socket.SOCK_RAW, proto)
+            raw = True
+        try:
+            # 大量在途请求的回复会集中到达，加大接收缓冲区避免丢包
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RCVBUF)
+        except OSError:
+            pass
+        sock.setblocking(False)
+        return sock, raw
+    
+    @classmethod
+    def available(cls):
+        """检查当前环境能否使用ICMP引擎"""
+        # Windows的Proactor事件循环不支持add_reader，且无SOCK_DGRAM ICMP
+        if sys.platform.startswith('win'):
+            return False
+        try:
+            sock, _ = cls.open_socket(4)
+            sock.close()
+            return True
+        except OSError:
+            return False
+    
+    def open(self, loop):
+        """绑定到事件循环"""
+        self._loop = loop
+    
+    def close(self):
+        """关闭所有套接字并取消未完成的探测"""
+        for sock, _ in self._sockets.values():
+            self._loop.remove_reader(sock)
+            sock.close()
+        self._sockets.clear()
+        for _, future in self._pending.values():
+            if not future.done():
+                future.set_result(None)
+        self._pending.clear()
+    
+    def _attach_ident_filter(self, sock, version):
+        # 原始套接字会收到本机所有ICMP报文，多进程扫描时每个进程都要处理全部回复。
+        # 在内核中用BPF过滤，只保留标识符属于本进程的echo回复（仅Linux）
+        if not sys.platform.startswith('linux'):
+            return
+        reply_type = ICMP_ECHO_REPLY if version == 4 else ICMPV6_ECHO_REPLY
+        # ICMPv6原始套接字收到的数据不含IP首部，IPv4需要先跳过IP首部
+        skip_header = (0xB1, 0, 0, 0) if version == 4 else (0x01, 0, 0, 0)  # ldxb 4*([0]&0xf) / ldx #0
+        program = [
+            skip_header,
+            (0x50, 0, 0, 0),                 # ldb [x+0]  ICMP类型
+            (0x15, 0, 3, reply_type),        # jeq #reply_type，否则丢弃
+            (0x48, 0, 0, 4),                 # ldh [x+4]  标识符
+            (0x15, 0, 1, self._ident),       # jeq #ident，否则丢弃
+            (0x06, 0, 0, 0xFFFF),            # ret #65535 接收
+            (0x06, 0, 0, 0),                 # ret #0     丢弃
+        ]
+        code = b''.join(struct.pack('HBBI', *insn) for insn in program)
+        buffer = ctypes.create_string_buffer(code)
+        fprog = struct.pack('HL', len(program), ctypes.addressof(buffer))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        except OSError:
+            pass
+    
+    def _get_socket(self, version):
+        if version not in self._sockets:
+            sock, raw = self.open_socket(version)
+            if raw:
+                self._attach_ident_filter(sock, version)
+            self._sockets[version] = (sock, raw)
+            self._loop.add_reader(sock, self._on_readable, version)
+        return self._sockets[version]
+    
+    def _next_seq(self, version):
+        # 跳过仍在等待回复的序号
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xFFFF
+            if (version, self._seq) not in self._pending:
+                return self._seq
+        raise RuntimeError("未完成的ICMP请求过多")
+    
+    def _on_readable(self, version):
+        sock, raw = self._sockets[version]
+        reply_type = ICMP_ECHO_REPLY if version == 4 else ICMPV6_ECHO_REPLY
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # 套接字上排队的ICMP错误，忽略后继续读取
+                continue
+            received = time.perf_counter()
+            # IPv4原始套接字收到的数据包含IP首部
+            if raw and version == 4:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack_from('!BBHHH', data)
+            # SOCK_DGRAM套接字的标识符由内核改写，只需校验原始套接字
+            if icmp_type != reply_type or (raw and ident != self._ident):
+                continue
+            entry = self._pending.get((version, seq))
+            if entry is None or entry[0] != addr[0].split('%')[0]:
+                continue
+            if not entry[1].done():
+                entry[1].set_result(received)
+    
+    async def _echo(self, ip, timeout):
+        version = ip.version
+        sock, _ = self._get_socket(version)
+        seq = self._next_seq(version)
+        ip_str = str(ip)
+        future = self._loop.create_future()
+        key = (version, seq)
+        self._pending[key] = (ip_str, future)
+        timer = self._loop.call_later(timeout, lambda: future.done() or future.set_result(None))
+        try:
+            sent = time.perf_counter()
+            await self._loop.sock_sendto(sock, build_echo_request(self._ident, seq, version), (ip_str, 0))
+            received = await future
+            return None if received is None else received - sent
+        except OSError:
+            # 例如网络不可达、广播地址被拒绝
+            return None
+        finally:
+            timer.cancel()
+            self._pending.pop(key, None)
+    
+    async def probe(self, ip, count=1, timeout=500):
+        """探测单个IP
+        
+        Args:
+            ip: IP地址对象
+            count: 最多发送的echo请求数量，收到任一回复即返回
+            timeout: 每个请求的超时时间（毫秒）
+        
+        Returns:
+            float: 往返时间（秒），全部超时返回None
+        """
+        for _ in range(count):
+            rtt = await self._echo(ip, timeout / 1000)
+            if rtt is not None:
+                return rtt
+        return None
+    
+    async def probe_host(self, ip, count=1, timeout=500):
+        """与TCPProber.probe_host接口一致的探测，返回(往返时间或None, None)"""
+        return await self.probe(ip, count=count, timeout=timeout), None
+
+# 进程内TCP连接探测引擎
+class TCPProber:
+    """基于非阻塞TCP连接的异步探测引擎
+    
+    很多网段过滤ICMP，此时改为向指定端口发起连接：收到SYN-ACK（连接成功）
+    或RST（连接被拒绝）都说明主机在线。不需要特殊权限，同一事件循环内
+    可以有数千个连接同时在途。
+    """
+    
+    def __init__(self, ports, early_exit=False):
+        """
+        Args:
+            ports: 要连接的端口序列
+            early_exit: 任一端口响应后是否立即取消该主机其余端口的连接
+        """
+        self.ports = tuple(ports)
+        self.early_exit = early_exit
+        self._loop = None
+        # 关闭时直接发送RST，不在本机留下大量TIME_WAIT连接
+        self._linger = struct.pack('HH' if sys.platform.startswith('win') else 'ii', 1, 0)
+    
+    def open(self, loop):
+        """绑定到事件循环"""
+        self._loop = loop
+    
+    def close(self):
+        """每个连接的套接字在探测结束时已关闭，这里无需处理"""
+    
+    async def _connect(self, ip_str, family, port, timeout):
+        # 返回(端口, 是否开放, 往返时间)，超时或不可达返回None
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, self._linger)
+            sent = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._loop.sock_connect(sock, (ip_str, port)), timeout)
+                is_open = True
+            except ConnectionRefusedError:
+                is_open = False
+            return port, is_open, time.perf_counter() - sent
+        except (asyncio.TimeoutError, OSError):
+            # 例如网络不可达、主机不可达
+            return None
+        finally:
+            sock.close()
+    
+    async def probe_host(self, ip, count=1, timeout=500):
+        """同时连接单个IP的全部端口
+        
+        Args:
+            ip: IP地址对象
+            count: 最多尝试的轮数，任一端口响应即不再重试
+            timeout: 每次连接的超时时间（毫秒）
+        
+        Returns:
+            tuple: (最先响应的往返时间秒数或None, {端口: 是否开放}或None)
+        """
+        ip_str = str(ip)
+        family = socket.AF_INET if ip.version == 4 else socket.AF_INET6
+        answered = {}
+        rtt = None
+        for _ in range(count):
+            tasks = [self._loop.create_task(self._connect(ip_str, family, port, timeout / 1000))
+                     for port in self.ports]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    if result is None:
+                        continue
+                    port, is_open, elapsed = result
+                    answered[port] = is_open
+                    rtt = elapsed if rtt is None else min(rtt, elapsed)
+                    if self.early_exit:
+                        break
+            finally:
+                # 提前结束时取消其余连接，并等待其套接字关闭后再释放并发名额
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if answered:
+                break
+        return rtt, dict(sorted(answered.items())) or None
+
+# 两阶段扫描的重试引擎
+class RetryProber:
+    """对单个主机按退避间隔连续发出多次探测的引擎包装，用于两阶段扫描的第二阶段
+    
+    每次探测都等待完整的超时时间，但下一次不必等上一次超时后才发出：
+    第k次重试在上一次发出gap * backoff ** (k - 2)秒后发出，任一次收到回复即结束。
+    退避间隔按主机单独计算，不会让整个扫描停下来等待；没有回复的主机
+    只需约一个超时时间加上几个间隔，而不是逐次等待超时。
+    """
+    
+    # 前两次重试之间的间隔占超时时间的比例
+    GAP_RATIO = 0.1
+    
+    def __init__(self, prober, attempts, gap, backoff=1.5):
+        """
+        Args:
+            prober: 实际发出探测的引擎（ICMPProber、TCPProber等）
+            attempts: 每个主机的重试次数
+            gap: 前两次重试之间的间隔（秒）
+            backoff: 之后每次间隔相对上一次的倍数
+        """
+        self.prober = prober
+        self.attempts = attempts
+        self.gap = gap
+        self.backoff = backoff
+    
+    def open(self, loop):
+        self.prober.open(loop)
+    
+    def close(self):
+        self.prober.close()
+    
+    async def probe_host(self, ip, count=1, timeout=500):
+        """与被包装引擎的probe_host接口一致，count被忽略，由attempts决定探测次数"""
+        loop = asyncio.get_running_loop()
+        pending = set()
+        try:
+            for attempt in range(self.attempts):
+                pending.add(loop.create_task(self.prober.probe_host(ip, count=1, timeout=timeout)))
+                # 等待到下一次重试的发出时间，最后一次则等待全部探测结束
+                deadline = (loop.time() + self.gap * self.backoff ** attempt
+                            if attempt + 1 < self.attempts else None)
+                while pending:
+                    remaining = None if deadline is None else deadline - loop.time()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        rtt, answered = task.result()
+                        if rtt is not None:
+                            return rtt, answered
+            return None, None
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def scan_ips_async(targets, on_result, controller, count=1, timeout=500, prober=None, known=None):
+    """使用进程内探测引擎在单个事件循环中并发扫描
+    
+    Args:
+        targets: (结果槽位, IP地址对象)的可迭代对象
+        on_result: 结果回调，参数为(槽位, ip, 往返时间秒数或None, 响应端口字典或None)
+        controller: RateController并发与速率控制器
+        count: 每个IP的探测次数
+        timeout: 超时时间（毫秒）
+        prober: ICMPProber或TCPProber，默认为ICMPProber
+        known: 参数为槽位的函数，返回该主机此前是否回复过，None表示都没有回复过
+    """
+    loop = asyncio.get_running_loop()
+    prober = ICMPProber() if prober is None else prober
+    prober.open(loop)
+    tasks = set()
+    
+    async def probe(slot, ip):
+        rtt = None
+        try:
+            rtt, answered = await prober.probe_host(ip, count=count, timeout=timeout)
+            on_result(slot, ip, rtt, answered)
+        finally:
+            controller.release(rtt is not None, rtt, known is not None and known(slot))
+    
+    # 由控制器决定何时放行下一个探测
+    try:
+        for slot, ip in targets:
+            await controller.acquire_async()
+            task = loop.create_task(probe(slot, ip))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        prober.close()
+
+# 选择探测引擎
+def resolve_engine(engine):
+    """根据命令行选项和运行环境确定实际使用的探测引擎
+    
+    Args:
+        engine: 'auto'、'icmp'或'ping'
+    
+    Returns:
+        str: 'icmp'或'ping'
+    """
+    if engine == 'ping':
+        return 'ping'
+    if ICMPProber.available():
+        return 'icmp'
+    if engine == 'icmp':
+        if sys.platform.startswith('win'):
+            Colors.print_color("[警告] 无法创建ICMP套接字，改用系统ping命令", 14)
+        else:
+            print(f"{Colors.YELLOW}[警告] 无法创建ICMP套接字，改用系统ping命令{Colors.RESET}")
+    return 'ping'
+
+# 解析探测方式
+def parse_probe(spec):
+    """解析--probe选项
+    
+    Args:
+        spec: 'icmp'，或'tcp:'加逗号分隔的端口列表（支持22,80,8000-8010这样的范围）
+    
+    Returns:
+        tuple: ('icmp', ())或('tcp', (端口, ...))
+    """
+    kind, _, port_list = spec.partition(':')
+    kind = kind.strip().lower()
+    if kind == 'icmp' and not port_list:
+        return 'icmp', ()
+    if kind == 'tcp':
+        ports = []
+        try:
+            for item in port_list.split(','):
+                first, _, last = item.strip().partition('-')
+                if not first:
+                    continue
+                first = int(first)
+                last = int(last) if last else first
+                if not 1 <= first <= last <= 65535:
+                    raise ValueError(item)
+                ports.extend(range(first, last + 1))
+        except ValueError:
+            ports = []
+        if ports:
+            return 'tcp', tuple(dict.fromkeys(ports))
+    raise argparse.ArgumentTypeError(f"无效的探测方式: {spec}（例如：icmp 或 tcp:22,80,443）")
+
+# 限制TCP探测的并发数
+def tcp_concurrency_limit(threads, port_count, reserve=256):
+    """根据进程可打开的文件数确定TCP探测的在途主机数上限
+    
+    每个在途主机同时占用port_count个套接字。必要时先尝试把软限制提高到硬限制，
+    工作进程会继承调整后的限制。
+    
+    Returns:
+        int: 不超过threads的并发数
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows没有文件描述符数量限制
+        return threads
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = threads * port_count + reserve
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        raised = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (raised, hard))
+            soft = raised
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return threads
+    return max(1, min(threads, (soft - reserve) // port_count))
 
 # 扫描IP函数
-def scan_ip(ip, reachable_list, unreachable_list, lock, progress_callback=None, count=1, timeout=500):
-    """扫描单个IP并更新结果列表
+def scan_ip(slot, ip, results, on_result=None, count=1, timeout=500):
+    """扫描单个IP并写入结果
     
     Args:
+        slot: 该IP在结果中的槽位
         ip: IP地址对象
-        reachable_list: 存储可达IP的列表
-        unreachable_list: 存储不可达IP的列表
-        lock: 线程锁
-        progress_callback: 进度回调函数
+        results: ScanResults扫描结果对象
+        on_result: 结果写入后的回调，参数为(槽位, ip, 是否可达, 往返时间)
         count: ping包数量
         timeout: 超时时间（毫秒）
+    
+    Returns:
+        bool: IP是否可达
+    """
+    is_reachable, rtt = ping_ip_rtt(ip, count=count, timeout=timeout)
+    # 每个工作线程只写自己的槽位，无需加锁
+    results.set(slot, is_reachable, rtt)
+    if on_result:
+        on_result(slot, ip, is_reachable, rtt)
+    return is_reachable
+
+# 执行扫描
+def run_scan(results, engine, controller, on_result=None, count=1, timeout=500, ports=(), early_exit=False,
+             retries=0, backoff=1.5, prober=None, previous=None):
+    """用指定引擎扫描results中的全部目标，结果写入对应槽位
+    
+    retries大于0时分两个阶段扫描：第一阶段对所有主机只探测一次（count被忽略），
+    第二阶段只对没有回复的主机重试retries次。重试在每个主机的探测内部按退避间隔进行
+    （见RetryProber；ping引擎由ping命令按1秒间隔发送），不在两轮之间让整个扫描停下来等待。
+    在线主机只需要一次探测，丢包容忍度却与多次探测相当。
+    找回的主机数累加到results.recovered。
+    
+    Args:
+        results: ScanResults扫描结果对象
+        engine: 'icmp'、'tcp'或'ping'
+        controller: RateController并发与速率控制器
+        on_result: 结果写入后的回调，参数为(槽位, ip, 是否可达, 往返时间)，每个主机只回调一次
+        count: 每个IP的探测次数
+        timeout: 超时时间（毫秒）
+        ports: tcp引擎连接的端口
+        early_exit: tcp引擎在任一端口响应后是否取消其余端口的连接
+        retries: 第二阶段每个主机的重试次数，0表示不分阶段
+        backoff: 同一主机相邻两次重试的间隔相对上一次的倍数；第一阶段最慢的回复
+            已超过超时时间的一半时，也是重试超时时间的放大倍数
+        prober: 自定义的异步探测引擎（例如基准测试使用的模拟引擎），指定时忽略engine
+        previous: 上一轮扫描的状态码（监控模式），上一轮可达的主机超时才计入自适应并发的丢包率
     """
-    is_reachable = ping_ip(ip, count=count, timeout=timeout)
-    with lock:
-        if is_reachable:
-            reachable_list.append(str(ip))
-            if sys.platform.startswith('win'):
-                Colors.print_color(f"[可达] {ip}", 10)  # 10: 绿色背景黑色文字
-            else:
-                print(f"[{Colors.GREEN}可达{Colors.RESET}] {ip}")
+    if not retries:
+        scan_pending(results, engine, controller, on_result, count, timeout, ports, early_exit, prober, previous)
+        return
+    
+    # 没有回复的主机要等重试结束后才有最终结果，先只回调可达的主机
+    slowest = 0.0
+    
+    def report_reachable(slot, ip, is_reachable, rtt):
+        nonlocal slowest
+        if not is_reachable:
+            return
+        if rtt is not None and rtt > slowest:
+            slowest = rtt
+        if on_result:
+            on_result(slot, ip, is_reachable, rtt)
+    
+    scan_pending(results, engine, controller, report_reachable, 1, timeout, ports, early_exit, prober, previous)
+    pending = list(results.slots(STATUS_UNREACHABLE))
+    if not pending:
+        return
+    for slot in pending:
+        results.status[slot] = STATUS_PENDING
+    
+    # 第一阶段的回复都远快于超时时间时沿用原超时时间；最慢的回复已接近超时时间时，
+    # 稍慢的主机可能刚好超时，重试时按backoff放宽
+    retry_timeout = int(timeout * backoff) if slowest * 1000 > timeout / 2 else timeout
+    # 第二阶段全部是第一阶段没有回复的主机，超时率必然很高，不能据此降低并发，
+    # 因此固定使用并发上限
+    concurrency = controller.max_concurrency
+    if prober is not None or engine in ('icmp', 'tcp'):
+        if prober is None:
+            prober = TCPProber(ports, early_exit) if engine == 'tcp' else ICMPProber()
+        if engine == 'tcp':
+            # 每个在途主机同时有retries次连接，保持套接字总数不超过第一阶段
+            concurrency = max(1, concurrency // retries)
+        prober = RetryProber(prober, retries, retry_timeout * RetryProber.GAP_RATIO / 1000, backoff)
+        count = 1
+    else:
+        # ping命令本身按1秒间隔发送多个请求，直接用retries作为包数量
+        count = retries
+    retry_controller = RateController(concurrency, max_pps=controller.max_pps, adaptive=False)
+    reachable_before = results.count(STATUS_REACHABLE)
+    scan_pending(results, engine, retry_controller, on_result, count, retry_timeout, ports, early_exit, prober)
+    results.recovered += results.count(STATUS_REACHABLE) - reachable_before
+
+def scan_pending(results, engine, controller, on_result=None, count=1, timeout=500, ports=(), early_exit=False,
+                 prober=None, previous=None):
+    """对results中尚无结果的主机探测一轮，参数见run_scan"""
+    known = None if previous is None else (lambda slot: previous[slot] == STATUS_REACHABLE)
+    if prober is not None or engine in ('icmp', 'tcp'):
+        def handle(slot, ip, rtt, answered):
+            results.set(slot, rtt is not None, rtt, answered)
+            if on_result:
+                on_result(slot, ip, rtt is not None, rtt)
+        
+        # 单个事件循环内并发探测，由控制器决定在途请求数量
+        if prober is None:
+            prober = TCPProber(ports, early_exit) if engine == 'tcp' else ICMPProber()
+        asyncio.run(scan_ips_async(results.targets(), handle, controller, count=count, timeout=timeout,
+                                   prober=prober, known=known))
+    else:
+        # 使用线程池进行并发扫描，受控提交保证内存不随网段大小增长
+        with ThreadPoolExecutor(max_workers=controller.max_concurrency) as executor:
+            bounded_map(executor, lambda target: scan_ip(*target, results, on_result, count=count, timeout=timeout),
+                        results.targets(), controller, None if known is None else (lambda target: known(target[0])))
+
+# 扫描单个分片（在工作进程中执行）
+def scan_shard(host_range, offsets, engine, options, status=None, rtt=None):
+    """在工作进程中用独立的探测循环扫描一个分片
+    
+    Args:
+        host_range: 合并后的TargetSet（只保存区间，传给工作进程的数据量很小）
+        offsets: 分片内主机的偏移量序列
+        engine: 'icmp'、'tcp'或'ping'
+        options: 扫描参数字典（threads、max_pps、adaptive、count、timeout、ports、early_exit、
+            retries、backoff）
+        status: 预先填入的状态码（例如来自缓存），只探测其中尚无结果的主机
+        rtt: 预先填入的往返时间列
+    
+    Returns:
+        tuple: (状态码字节串, 往返时间字节串或None, 分片内槽位到响应端口的字典, 重试找回的主机数)
+    """
+    shard = ScanResults(host_range, offsets, track_rtt=True)
+    if status is not None:
+        shard.status[:] = status
+    if rtt is not None and shard.rtt is not None:
+        shard.rtt[:] = array('f', rtt)
+    controller = RateController(options['threads'], max_pps=options['max_pps'], adaptive=options['adaptive'])
+    # 工作进程不输出任何内容，结果返回主进程后由ResultReporter统一输出，
+    # 避免多个进程的输出与主进程的结果流（jsonl/csv）交错
+    run_scan(shard, engine, controller, count=options['count'], timeout=options['timeout'],
+             ports=options['ports'], early_exit=options['early_exit'], retries=options['retries'],
+             backoff=options['backoff'])
+    return (bytes(shard.status), (shard.rtt.tobytes() if shard.rtt is not None else None), shard.ports,
+            shard.recovered)
+
+# 划分分片
+def plan_shards(total, processes, min_shard=256):
+    """把total个槽位划分为连续的分片
+    
+    分片数量约为进程数的4倍以便负载均衡，分片大小取2的幂，
+    扫描整个网段时每个分片对应一个子网段。
+    
+    Returns:
+        list: [(起始槽位, 结束槽位), ...]
+    """
+    if processes <= 1 or total <= min_shard:
+        return [(0, total)]
+    size = max(min_shard, -(-total // (processes * 4)))
+    size = 1 << (size - 1).bit_length()
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+# 多进程分片扫描
+def run_sharded_scan(results, engine, processes, options, shard_callback=None):
+    """把目标划分为分片，由多个工作进程各自扫描后合并结果
+    
+    Args:
+        results: ScanResults扫描结果对象
+        engine: 'icmp'、'tcp'或'ping'
+        processes: 工作进程数量
+        options: 扫描参数字典，见scan_shard
+        shard_callback: 每个分片合并后的回调，参数为(起始槽位, 结束槽位)
+    """
+    # 多进程模块只在分片扫描时导入，单进程运行时不增加启动时间
+    from concurrent.futures import ProcessPoolExecutor
+    
+    shards = plan_shards(len(results), processes)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(scan_shard, results.host_range, results.offsets[start:stop], engine, options,
+                            results.status[start:stop],
+                            results.rtt[start:stop].tobytes() if results.rtt is not None else None): (start, stop)
+            for start, stop in shards
+        }
+        for future in as_completed(futures):
+            start, stop = futures[future]
+            status, rtt, ports, recovered = future.result()
+            results.merge(start, status, rtt, ports, recovered)
+            if shard_callback:
+                shard_callback(start, stop)
+
+# 按偏移量访问的主机地址序列
+class AddressSequence:
+    """HostRange和TargetSet的公共部分，子类提供size、__getitem__和hosts()"""
+    
+    size = 0
+    
+    def __bool__(self):
+        return self.size > 0
+    
+    def __iter__(self):
+        return self.hosts()
+    
+    def segments(self):
+        """返回[(整体偏移量起点, HostRange), ...]"""
+        return [(0, self)]
+    
+    def select(self, limit=None, sample='random'):
+        """选择要扫描的主机偏移量，不生成完整的地址列表
+        
+        Args:
+            limit: 最多选择的主机数量，None表示全部
+            sample: 'random'随机抽样，'stride'等间隔抽样，'head'取前limit个
+        
+        Returns:
+            按升序排列的偏移量序列
+        """
+        if limit is None or limit >= self.size:
+            return range(self.size)
+        limit = max(0, limit)
+        if sample == 'head':
+            return range(limit)
+        if sample == 'stride':
+            step = self.size // limit if limit else 1
+            return range(0, step * limit, step)
+        # 随机抽样只占用与limit成正比的内存
+        if self.size <= sys.maxsize:
+            picked = random.sample(range(self.size), limit)
         else:
-            unreachable_list.append(str(ip))
-            if sys.platform.startswith('win'):
-                Colors.print_color(f"[不可达] {ip}", 12)  # 12: 红色背景黑色文字
-            else:
-                print(f"[{Colors.RED}不可达{Colors.RESET}] {ip}")
+            picked = set()
+            while len(picked) < limit:
+                picked.add(random.randrange(self.size))
+        return sorted(picked)
+
+# 网段内主机地址的惰性序列
+class HostRange(AddressSequence):
+    """网段内可用主机地址的惰性序列
+    
+    与ip_network.hosts()返回的地址一致，但只保存起始地址和数量，
+    按偏移量计算地址，内存占用与网段大小无关（IPv6前缀同样适用）。
+    """
+    
+    def __init__(self, network):
+        self.network = ipaddress.ip_network(network, strict=False)
+        self.version = self.network.version
+        first = int(self.network.network_address)
+        size = self.network.num_addresses
+        if size > 2:
+            # IPv4去掉网络地址和广播地址，IPv6去掉子网路由器任播地址
+            first += 1
+            size -= 2 if self.network.version == 4 else 1
+        self.first = first
+        self.size = size
+        self._address = ipaddress.IPv4Address if self.network.version == 4 else ipaddress.IPv6Address
+    
+    @classmethod
+    def from_interval(cls, version, first, last):
+        """由首尾地址（整数，含两端）构造主机序列，用于合并后的任意地址区间
+        
+        这样的序列不一定对应某个网段，此时network为None。
+        """
+        host_range = cls.__new__(cls)
+        host_range.version = version
+        host_range.first = first
+        host_range.size = last - first + 1
+        host_range._address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        host_range.network = None
+        return host_range
+    
+    @property
+    def last(self):
+        """最后一个主机地址（整数）"""
+        return self.first + self.size - 1
+    
+    def __str__(self):
+        if self.network is not None:
+            return str(self.network)
+        if self.size == 1:
+            return str(self._address(self.first))
+        return f"{self._address(self.first)}-{self._address(self.last)}"
+    
+    def __getitem__(self, offset):
+        if not 0 <= offset < self.size:
+            raise IndexError(offset)
+        return self._address(self.first + offset)
+    
+    def index(self, ip):
+        """返回IP地址在网段主机中的偏移量"""
+        offset = int(ipaddress.ip_address(ip)) - self.first
+        if not 0 <= offset < self.size:
+            raise ValueError(f"{ip} 不在 {self} 的主机范围内")
+        return offset
+    
+    def hosts(self, offsets=None):
+        """按偏移量逐个生成IP地址对象
+        
+        Args:
+            offsets: 偏移量可迭代对象，默认为全部主机
+        """
+        if offsets is None:
+            offsets = range(self.size)
+        for offset in offsets:
+            yield self._address(self.first + offset)
+
+# 多个网段拼接成的惰性序列
+class TargetSet(AddressSequence):
+    """多个HostRange首尾相接组成的惰性主机序列
+    
+    偏移量在各网段之间连续编号，接口与HostRange相同，
+    因此扫描结果、抽样和分片都不需要区分单网段还是多网段。
+    """
+    
+    def __init__(self, ranges):
+        self.ranges = [host_range for host_range in ranges if host_range]
+        # 各网段在整体偏移量中的起点
+        self.starts = []
+        self.size = 0
+        for host_range in self.ranges:
+            self.starts.append(self.size)
+            self.size += host_range.size
+        # 合并前的输入网段[(名称, IP版本, 首地址, 末地址), ...]及其地址总数，由parse_networks填入
+        self.inputs = []
+        self.input_total = self.size
+    
+    def segments(self):
+        """返回[(整体偏移量起点, HostRange), ...]"""
+        return list(zip(self.starts, self.ranges))
+    
+    def locate_address(self, version, value):
+        """返回地址（整数）在整体中的偏移量插入位置，即第一个不小于该地址的主机的偏移量"""
+        index = bisect.bisect_left(self.ranges, (version, value), key=lambda r: (r.version, r.last))
+        if index == len(self.ranges):
+            return self.size
+        host_range = self.ranges[index]
+        if host_range.version != version:
+            return self.starts[index]
+        return self.starts[index] + max(0, value - host_range.first)
+    
+    def _locate(self, offset):
+        if not 0 <= offset < self.size:
+            raise IndexError(offset)
+        index = bisect.bisect_right(self.starts, offset) - 1
+        return self.ranges[index], offset - self.starts[index]
+    
+    def __getitem__(self, offset):
+        host_range, local = self._locate(offset)
+        return host_range[local]
+    
+    def hosts(self, offsets=None):
+        """按偏移量逐个生成IP地址对象
         
-        # 调用进度回调函数
-        if progress_callback:
-            progress_callback()
+        Args:
+            offsets: 偏移量可迭代对象，默认为全部主机
+        """
+        if offsets is None:
+            for host_range in self.ranges:
+                yield from host_range.hosts()
+            return
+        for offset in offsets:
+            host_range, local = self._locate(offset)
+            yield host_range[local]
 
 # 解析网段
 def parse_network(network):
-    """解析网段，返回IP地址列表"""
+    """解析网段，返回主机地址的惰性序列"""
     try:
-        ip_net = ipaddress.ip_network(network, strict=False)
-        return list(ip_net.hosts())
+        return HostRange(network)
     except ValueError as e:
         print(f"[错误] 网段格式错误: {e}")
-        return []
+        return None
+
+# 合并地址区间
+def merge_intervals(intervals):
+    """把(IP版本, 起始地址, 结束地址)区间合并为最少的有序不相交区间，相邻区间也会合并"""
+    merged = []
+    for version, first, last in sorted(intervals):
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            if last > merged[-1][2]:
+                merged[-1][2] = last
+        else:
+            merged.append([version, first, last])
+    return [tuple(interval) for interval in merged]
+
+# 从区间中去掉排除的地址
+def subtract_intervals(intervals, excludes):
+    """从有序不相交区间中去掉另一组有序不相交区间，两组各遍历一次"""
+    result = []
+    index = 0
+    for version, first, last in intervals:
+        # 跳过完全位于当前区间之前的排除区间
+        while index < len(excludes) and (excludes[index][0], excludes[index][2]) < (version, first):
+            index += 1
+        scan = index
+        while first <= last and scan < len(excludes) and excludes[scan][:2] <= (version, last):
+            _, ex_first, ex_last = excludes[scan]
+            if ex_first > first:
+                result.append((version, first, ex_first - 1))
+            first = max(first, ex_last + 1)
+            scan += 1
+        if first <= last:
+            result.append((version, first, last))
+    return result
+
+# 读取目标文件
+def read_targets_file(path):
+    """读取目标文件中的网段和IP，每行可写多个（用空格或逗号分隔），#之后为注释"""
+    targets = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            targets.extend(line.split('#', 1)[0].replace(',', ' ').split())
+    return targets
+
+# 解析多个网段
+def parse_networks(networks, excludes=()):
+    """解析多个网段和IP，合并重叠部分并去掉排除的地址
+    
+    每个地址只出现一次，因此只会被探测一次。
+    
+    Args:
+        networks: 网段或IP字符串列表
+        excludes: 要排除的网段或IP字符串列表
+    
+    Returns:
+        TargetSet: 按地址排序的合并结果，inputs属性保存各输入网段的主机区间，
+        用于按输入网段统计结果；任一网段格式错误时返回None
+    """
+    inputs = []
+    for network in dict.fromkeys(networks):
+        host_range = parse_network(network)
+        if host_range is None:
+            return None
+        if host_range:
+            inputs.append((network, host_range.version, host_range.first, host_range.last))
+    excluded = []
+    for network in excludes:
+        try:
+            # 排除整个网段的全部地址，包括网络地址和广播地址
+            network = ipaddress.ip_network(network, strict=False)
+        except ValueError as e:
+            print(f"[错误] 排除网段格式错误: {e}")
+            return None
+        excluded.append((network.version, int(network.network_address), int(network.broadcast_address)))
+    intervals = subtract_intervals(merge_intervals(interval[1:] for interval in inputs), merge_intervals(excluded))
+    target_set = TargetSet(HostRange.from_interval(*interval) for interval in intervals)
+    target_set.inputs = inputs
+    target_set.input_total = sum(last - first + 1 for _, _, first, last in inputs)
+    return target_set
+
+# 一次最多扫描的主机数：每个主机的结果约占6字节（状态、来源和往返时间），上限时约100MB
+MAX_SCAN_HOSTS = 1 << 24
+
+def selection_size(offsets):
+    """返回偏移量序列中的主机数，超大IPv6网段的range长度超过sys.maxsize，不能用len()"""
+    if isinstance(offsets, range):
+        return max(0, -(-(offsets.stop - offsets.start) // offsets.step))
+    return len(offsets)
+
+# 扫描状态码
+STATUS_PENDING = 0
+STATUS_REACHABLE = 1
+STATUS_UNREACHABLE = 2
+
+# 结果来源
+SOURCE_PROBE = 0
+SOURCE_CACHE = 1
+SOURCE_NEIGHBOR = 2
+
+# 结果流输出格式的状态和来源名称
+STATUS_NAMES = {STATUS_PENDING: 'pending', STATUS_REACHABLE: 'reachable', STATUS_UNREACHABLE: 'unreachable'}
+SOURCE_NAMES = {SOURCE_PROBE: 'probe', SOURCE_CACHE: 'cache', SOURCE_NEIGHBOR: 'neighbor'}
+
+# 结果列表的显示方式：ranges合并连续地址段，subnet按子网汇总，full逐个列出
+LIST_MODES = ('ranges', 'subnet', 'full')
+# subnet显示方式中各IP版本的子网前缀长度
+SUBNET_PREFIXES = {4: 24, 6: 64}
+
+# 扫描结果
+class ScanResults:
+    """按主机偏移量索引的紧凑扫描结果
+    
+    每个被扫描的主机占一个字节的状态码和一个字节的结果来源，另有可选的
+    float32往返时间列，/16网段的结果只有一百多KB。TCP探测的响应端口只为在线主机记录，
+    保存在以槽位为键的字典中。各工作线程只写自己的槽位，不需要全局锁；
+    槽位按偏移量升序排列，遍历顺序即为地址顺序，无需再排序。
+    """
+    
+    def __init__(self, host_range, offsets=None, track_rtt=False):
+        """
+        Args:
+            host_range: HostRange或TargetSet主机序列
+            offsets: 被扫描主机的偏移量升序序列，默认为全部主机
+            track_rtt: 是否记录往返时间
+        """
+        self.host_range = host_range
+        self.offsets = range(host_range.size) if offsets is None else offsets
+        count = selection_size(self.offsets)
+        if count > MAX_SCAN_HOSTS:
+            raise ValueError(f"主机数 {count} 超过上限 {MAX_SCAN_HOSTS}")
+        self.status = bytearray(count)
+        self.source = bytearray(count)
+        self.rtt = array('f', [math.nan]) * count if track_rtt else None
+        self.ports = {}  # 槽位 -> {端口: 是否开放}
+        self.recovered = 0  # 两阶段扫描中由重试找回的主机数
+    
+    def __len__(self):
+        return len(self.status)
+    
+    def targets(self):
+        """生成尚无结果的(槽位, IP地址对象)，供扫描引擎使用"""
+        if self.status.count(STATUS_PENDING) == len(self.status):
+            # 没有预先填入的结果（例如缓存），按顺序生成地址更快
+            return enumerate(self.host_range.hosts(self.offsets))
+        return ((slot, self.address(slot)) for slot in self.slots(STATUS_PENDING))
+    
+    def address(self, slot):
+        """返回槽位对应的IP地址对象"""
+        return self.host_range[self.offsets[slot]]
+    
+    def slot_of(self, offset):
+        """返回偏移量对应的槽位，未被选中扫描时返回None"""
+        if isinstance(self.offsets, range):
+            return self.offsets.index(offset) if offset in self.offsets else None
+        slot = bisect.bisect_left(self.offsets, offset)
+        if slot < len(self.offsets) and self.offsets[slot] == offset:
+            return slot
+        return None
+    
+    def set(self, slot, is_reachable, rtt=None, ports=None):
+        """写入单个槽位的结果"""
+        if self.rtt is not None and rtt is not None:
+            self.rtt[slot] = rtt
+        if ports:
+            self.ports[slot] = ports
+        self.status[slot] = STATUS_REACHABLE if is_reachable else STATUS_UNREACHABLE
+    
+    def set_cached(self, slot, status, rtt=None, source=SOURCE_CACHE):
+        """写入不需要探测的结果（来自缓存或邻居表）"""
+        if self.rtt is not None and rtt is not None:
+            self.rtt[slot] = rtt
+        self.status[slot] = status
+        self.source[slot] = source
+    
+    def merge(self, start, status, rtt=None, ports=None, recovered=0):
+        """把分片的结果复制到从start开始的槽位
+        
+        Args:
+            start: 分片第一个槽位
+            status: 分片的状态码字节串
+            rtt: 分片的往返时间列（float32字节串），没有时为None
+            ports: 分片内槽位到响应端口的字典
+            recovered: 分片中由重试找回的主机数
+        """
+        self.status[start:start + len(status)] = status
+        if self.rtt is not None and rtt is not None:
+            self.rtt[start:start + len(status)] = array('f', rtt)
+        for slot, answered in (ports or {}).items():
+            self.ports[start + slot] = answered
+        self.recovered += recovered
+    
+    def count(self, status):
+        """统计指定状态的主机数量"""
+        return self.status.count(status)
+    
+    def breakdown(self):
+        """按合并前的输入网段统计结果
+        
+        Returns:
+            list: [(输入网段, 扫描数, 可达数, 不可达数), ...]，重叠的输入网段各自计数
+        """
+        rows = []
+        for name, version, first, last in getattr(self.host_range, 'inputs', ()):
+            # 输入网段在合并结果中对应一段连续的偏移量，再换算为连续的槽位
+            low = bisect.bisect_left(self.offsets, self.host_range.locate_address(version, first))
+            high = bisect.bisect_left(self.offsets, self.host_range.locate_address(version, last + 1))
+            status = self.status[low:high]
+            rows.append((name, len(status), status.count(STATUS_REACHABLE), status.count(STATUS_UNREACHABLE)))
+        return rows
+    
+    def slots(self, status):
+        """按地址顺序生成指定状态的槽位"""
+        slot = self.status.find(status)
+        while slot != -1:
+            yield slot
+            slot = self.status.find(status, slot + 1)
+    
+    def addresses(self, status):
+        """按地址顺序生成指定状态的IP地址对象"""
+        for slot in self.slots(status):
+            yield self.address(slot)
+    
+    def runs(self, status):
+        """按地址顺序生成指定状态的连续地址段(首槽位, 末槽位)
+        
+        一次线性遍历：相邻槽位状态相同、地址连续且结果来源相同时合并为一段，
+        在网段之间以及抽样跳过的地址处断开。
+        """
+        # 各网段的第一个槽位，与前一个槽位的地址不连续
+        breaks = {bisect.bisect_left(self.offsets, start) for start, _ in self.host_range.segments()}
+        offsets = self.offsets
+        first = previous = None
+        for slot in self.slots(status):
+            if (previous is not None and slot == previous + 1 and slot not in breaks
+                    and offsets[slot] == offsets[previous] + 1 and self.source[slot] == self.source[first]):
+                previous = slot
+                continue
+            if first is not None:
+                yield first, previous
+            first = previous = slot
+        if first is not None:
+            yield first, previous
+    
+    def subnet_counts(self):
+        """按子网（IPv4为/24，IPv6为/64）统计结果
+        
+        Returns:
+            list: [(子网, 扫描数, 可达数, 不可达数), ...]，按地址顺序，只包含有被扫描主机的子网
+        """
+        rows = []
+        for start, host_range in self.host_range.segments():
+            prefix = SUBNET_PREFIXES[host_range.version]
+            block = 1 << ((32 if host_range.version == 4 else 128) - prefix)
+            value = host_range.first
+            while value <= host_range.last:
+                # 子网在该网段中对应一段连续的偏移量，再换算为连续的槽位
+                end = min(host_range.last, value | (block - 1))
+                low = bisect.bisect_left(self.offsets, start + value - host_range.first)
+                high = bisect.bisect_left(self.offsets, start + end - host_range.first + 1)
+                if high > low:
+                    status = self.status[low:high]
+                    subnet = ipaddress.ip_network((value & ~(block - 1), prefix))
+                    rows.append((subnet, len(status), status.count(STATUS_REACHABLE),
+                                 status.count(STATUS_UNREACHABLE)))
+                value = end + 1
+        return rows
+
+# 默认的邻居表来源：优先使用带有邻居状态的ip neigh输出，没有ip命令时读取/proc/net/arp
+DEFAULT_ARP_TABLE = '/proc/net/arp'
+# 视为在线的邻居状态（最近确认过可达，STALE等状态的主机可能已经离线）
+NEIGHBOR_STATES = ('REACHABLE',)
+# /proc/net/arp中的标志位：ATF_COM表示已解析，ATF_PERM表示静态配置
+ATF_COM = 0x2
+ATF_PERM = 0x4
+
+def parse_neighbor_table(text):
+    """解析邻居表，返回在线主机的(IP版本, 地址整数)集合
+    
+    支持两种格式：/proc/net/arp（只有已解析标志，没有可达状态），
+    以及ip neigh的输出（只接受NEIGHBOR_STATES中的状态）。
+    """
+    neighbors = set()
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or fields[0] == 'IP':
+            continue
+        try:
+            ip = ipaddress.ip_address(fields[0].split('%')[0])
+        except ValueError:
+            continue
+        if len(fields) >= 4 and fields[1].startswith('0x'):
+            # /proc/net/arp：IP地址、硬件类型、标志、硬件地址、掩码、设备
+            flags = int(fields[2], 16)
+            if flags & ATF_COM and not flags & ATF_PERM and fields[3] != '00:00:00:00:00:00':
+                neighbors.add((ip.version, int(ip)))
+        elif 'lladdr' in fields and fields[-1] in NEIGHBOR_STATES:
+            neighbors.add((ip.version, int(ip)))
+    return neighbors
+
+def read_neighbor_tables(paths=None):
+    """读取邻居表
+    
+    Args:
+        paths: 邻居表文件列表（/proc/net/arp或ip neigh输出格式），
+            None表示读取本机的IPv4和IPv6邻居表
+    
+    Returns:
+        set: 在线主机的(IP版本, 地址整数)集合
+    """
+    if paths:
+        neighbors = set()
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                neighbors |= parse_neighbor_table(f.read())
+        return neighbors
+    try:
+        result = subprocess.run(['ip', 'neigh', 'show'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, timeout=5)
+        if result.returncode == 0:
+            return parse_neighbor_table(result.stdout)
+    except (OSError, subprocess.SubprocessError):
+        pass
+    try:
+        with open(DEFAULT_ARP_TABLE, encoding='utf-8', errors='replace') as f:
+            return parse_neighbor_table(f.read())
+    except OSError:
+        return set()
+
+def apply_neighbors(results, neighbors):
+    """把邻居表中的在线主机直接标记为可达，不再探测
+    
+    Returns:
+        int: 由邻居表确定的主机数量
+    """
+    host_range = results.host_range
+    used = 0
+    for version, value in neighbors:
+        offset = host_range.locate_address(version, value)
+        if offset >= host_range.size or int(host_range[offset]) != value or host_range[offset].version != version:
+            continue
+        slot = results.slot_of(offset)
+        if slot is not None and results.status[slot] == STATUS_PENDING:
+            results.set_cached(slot, STATUS_REACHABLE, source=SOURCE_NEIGHBOR)
+            used += 1
+    return used
+
+# 默认的扫描状态缓存文件
+DEFAULT_CACHE_PATH = '~/.cache/ip_scanner/scan_cache.sqlite'
+
+# 扫描结果缓存
+class ScanCache:
+    """保存在SQLite中的每个主机最近一次扫描状态，用于增量扫描
+    
+    以(IP版本, 地址)为主键，地址按大端字节存储，
+    因此可以用一个范围查询取出整个网段的记录。
+    """
+    
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 只有增量扫描需要sqlite3，在此导入以加快普通扫描的启动
+        import sqlite3
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hosts (
+                version INTEGER NOT NULL,
+                address BLOB NOT NULL,
+                status INTEGER NOT NULL,
+                rtt REAL,
+                last_probe REAL NOT NULL,
+                changed_at REAL NOT NULL,
+                PRIMARY KEY (version, address)
+            ) WITHOUT ROWID
+        """)
+    
+    def close(self):
+        self.conn.close()
+    
+    @staticmethod
+    def _key(host_range, value):
+        return value.to_bytes(4 if host_range.version == 4 else 16, 'big')
+    
+    def load(self, results, ttl, now=None):
+        """把仍然有效的缓存结果填入results
+        
+        超过ttl秒未探测的主机，以及最近ttl秒内状态发生过变化的主机，
+        都不使用缓存，需要重新探测。
+        
+        Args:
+            results: ScanResults扫描结果对象
+            ttl: 缓存有效期（秒）
+            now: 当前时间戳，默认为time.time()
+        
+        Returns:
+            int: 使用缓存结果的主机数量
+        """
+        now = time.time() if now is None else now
+        used = 0
+        for start, host_range in results.host_range.segments():
+            rows = self.conn.execute(
+                "SELECT address, status, rtt FROM hosts "
+                "WHERE version = ? AND address BETWEEN ? AND ? AND last_probe > ? AND changed_at <= ?",
+                (host_range.version,
+                 self._key(host_range, host_range.first),
+                 self._key(host_range, host_range.first + host_range.size - 1),
+                 now - ttl, now - ttl))
+            for address, status, rtt in rows:
+                slot = results.slot_of(start + int.from_bytes(address, 'big') - host_range.first)
+                # 已由邻居表确定的主机不使用缓存
+                if slot is not None and results.status[slot] == STATUS_PENDING:
+                    results.set_cached(slot, status, rtt)
+                    used += 1
+        return used
+    
+    def save(self, results, now=None):
+        """保存本次实际探测的结果，状态变化时记录变化时间"""
+        now = time.time() if now is None else now
+        
+        def rows():
+            for status in (STATUS_REACHABLE, STATUS_UNREACHABLE):
+                for slot in results.slots(status):
+                    if results.source[slot] != SOURCE_PROBE:
+                        continue
+                    ip = results.address(slot)
+                    rtt = results.rtt[slot] if results.rtt is not None else math.nan
+                    yield (ip.version, ip.packed, status, None if math.isnan(rtt) else rtt, now)
+        
+        # 新记录的changed_at为0，表示尚未观察到状态变化
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO hosts (version, address, status, rtt, last_probe, changed_at)
+                VALUES (?, ?, ?, ?, ?, 0)
+                ON CONFLICT (version, address) DO UPDATE SET
+                    changed_at = CASE WHEN hosts.status != excluded.status
+                                      THEN excluded.last_probe ELSE hosts.changed_at END,
+                    status = excluded.status,
+                    rtt = excluded.rtt,
+                    last_probe = excluded.last_probe
+            """, rows())
+
+# 批量输出扫描结果
+class ResultReporter:
+    """在后台线程中批量输出扫描结果和进度
+    
+    工作线程只把结果放入队列，不再持锁逐行打印；后台线程每次取出一批结果，
+    拼接后一次性写到终端，并可同时以jsonl/csv格式写出结果流，
+    便于下游工具在扫描过程中实时读取。
+    """
+    
+    def __init__(self, total, quiet=False, stream=None, stream_format=None, controller=None,
+                 batch_size=1024, interval=0.2):
+        """
+        Args:
+            total: 需要探测的主机数量（用于显示进度）
+            quiet: 是否只显示进度，不逐个输出主机结果
+            stream: 结果流输出的文件对象，None表示不输出结果流
+            stream_format: 结果流格式，'jsonl'或'csv'
+            controller: RateController，用于在进度中显示并发数和速率
+            batch_size: 每批最多处理的结果数量
+            interval: 等待新结果的最长时间（秒）
+        """
+        self.total = total
+        self.quiet = quiet
+        self.stream = stream
+        self.stream_format = stream_format
+        self.controller = controller
+        self.batch_size = batch_size
+        self.interval = interval
+        self.done = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._csv = None
+        if stream is not None and stream_format == 'csv':
+            self._csv = csv.writer(stream)
+            self._csv.writerow(['ip', 'status', 'rtt_ms', 'source', 'ports'])
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def put(self, ip, is_reachable, rtt=None, source=SOURCE_PROBE, echo=True, ports=None):
+        """提交一个结果，可在任意线程中调用
+        
+        Args:
+            ip: IP地址对象
+            is_reachable: IP是否可达
+            rtt: 往返时间（秒），未知时为None
+            source: 结果来源（SOURCE_PROBE、SOURCE_CACHE或SOURCE_NEIGHBOR）
+            echo: 是否在终端输出该结果并计入进度（缓存结果为False）
+            ports: TCP探测响应的端口字典{端口: 是否开放}
+        """
+        self._queue.put((ip, is_reachable, rtt, source, echo, ports))
+    
+    def close(self):
+        """等待队列中的结果全部输出"""
+        self._queue.put(None)
+        self._thread.join()
+        if self.stream is not None:
+            self.stream.flush()
+    
+    def _run(self):
+        finished = False
+        while not finished:
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                finished = True
+            self._write(batch)
+    
+    def _write(self, batch):
+        lines = []
+        for ip, is_reachable, rtt, source, echo, ports in batch:
+            if self.stream is not None:
+                self._write_record(ip, is_reachable, rtt, source, ports)
+            if not echo:
+                continue
+            if not self.quiet:
+                suffix = f" 端口: {format_ports(ports)}" if ports else ""
+                if sys.platform.startswith('win'):
+                    # Windows控制台颜色需要逐行设置
+                    Colors.print_color(f"[{'可达' if is_reachable else '不可达'}] {ip}{suffix}",
+                                       10 if is_reachable else 12)
+                elif is_reachable:
+                    lines.append(f"[{Colors.GREEN}可达{Colors.RESET}] {ip}{suffix}\n")
+                else:
+                    lines.append(f"[{Colors.RED}不可达{Colors.RESET}] {ip}\n")
+            self.done += 1
+            # 每扫描10%的IP或扫描完成时显示进度
+            if self.done % (self.total // 10 or 1) == 0 or self.done == self.total:
+                lines.append(self._progress_line())
+        if lines:
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        if self.stream is not None:
+            self.stream.flush()
+    
+    def _progress_line(self):
+        progress = self.done / self.total * 100 if self.total else 100.0
+        text = f"[进度] 已扫描 {self.done}/{self.total} 个IP地址 ({progress:.1f}%)"
+        if self.controller is not None:
+            # 同时显示当前并发数和发送速率，便于调整参数
+            text += f" 并发: {self.controller.concurrency}, 速率: {self.controller.pps:.0f} 个/秒"
+        if sys.platform.startswith('win'):
+            Colors.print_color(text, 14)  # 14: 黄色背景黑色文字
+            return ""
+        return f"{Colors.YELLOW}{text}{Colors.RESET}\n"
+    
+    def _write_record(self, ip, is_reachable, rtt, source, ports):
+        status = STATUS_NAMES[STATUS_REACHABLE if is_reachable else STATUS_UNREACHABLE]
+        rtt_ms = None if rtt is None or math.isnan(rtt) else round(rtt * 1000, 3)
+        if self._csv is not None:
+            self._csv.writerow([str(ip), status, '' if rtt_ms is None else rtt_ms, SOURCE_NAMES[source],
+                                format_ports(ports, ';') if ports else ''])
+        else:
+            record = {'ip': str(ip), 'status': status, 'rtt_ms': rtt_ms, 'source': SOURCE_NAMES[source]}
+            if ports:
+                record['ports'] = {str(port): 'open' if is_open else 'closed' for port, is_open in ports.items()}
+            self.stream.write(json.dumps(record) + "\n")
+
+# 往返时间直方图
+class LatencyHistogram:
+    """固定内存的对数分桶往返时间直方图（HDR风格）
+    
+    以10微秒为单位，最小的2*SUB_BUCKETS个桶是线性的，之后每翻一倍分成
+    SUB_BUCKETS个等宽的桶，相对误差不超过1/SUB_BUCKETS。桶的数量只由
+    最大可记录值决定，与记录次数无关，长时间运行内存也不会增长。
+    """
+    
+    UNIT = 1e-5          # 最小分辨率（秒）
+    SUB_BUCKET_BITS = 3  # 每翻一倍分成2**3=8个桶，相对误差约12%
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_RTT = 60.0       # 超过该值的往返时间计入最后一个桶
+    BUCKETS = (int(MAX_RTT / UNIT).bit_length() - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+    
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * self.BUCKETS))
+        self.total = 0
+        self.max = 0.0
+    
+    @classmethod
+    def bucket(cls, rtt):
+        """返回往返时间（秒）所在的桶"""
+        value = int(rtt / cls.UNIT)
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return min(cls.BUCKETS - 1, (shift + 1) * cls.SUB_BUCKETS + (value >> shift) - cls.SUB_BUCKETS)
+    
+    @classmethod
+    def bucket_value(cls, index):
+        """返回桶的代表值（秒），取桶的中点"""
+        if index < 2 * cls.SUB_BUCKETS:
+            return (index + 0.5) * cls.UNIT
+        shift = index // cls.SUB_BUCKETS - 1
+        low = (index % cls.SUB_BUCKETS + cls.SUB_BUCKETS) << shift
+        return (low + (1 << shift) / 2) * cls.UNIT
+    
+    @classmethod
+    def percentile_of(cls, counts, total, quantile):
+        """从一段桶计数中计算百分位数（秒），没有记录时返回None"""
+        if not total:
+            return None
+        rank = max(1, math.ceil(quantile * total))
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return cls.bucket_value(index)
+        return cls.bucket_value(len(counts) - 1)
+    
+    def record(self, rtt):
+        self.counts[self.bucket(rtt)] += 1
+        self.total += 1
+        if rtt > self.max:
+            self.max = rtt
+    
+    def reset(self):
+        self.counts[:] = array('Q', bytes(8 * self.BUCKETS))
+        self.total = 0
+        self.max = 0.0
+    
+    def percentile(self, quantile):
+        """返回百分位数（秒），quantile取0~1"""
+        return self.percentile_of(self.counts, self.total, quantile)
+
+# 每个主机的往返时间直方图
+class HostLatencyHistograms:
+    """所有主机的直方图放在同一个扁平数组中，每个主机占LatencyHistogram.BUCKETS个计数
+    
+    /22网段约一千个主机，共占用不到1MB内存，并同时维护所有主机合计的直方图。
+    """
+    
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.counts = array('I', bytes(4 * LatencyHistogram.BUCKETS * hosts))
+        self.totals = array('I', bytes(4 * hosts))
+        self.overall = LatencyHistogram()
+    
+    def record(self, slot, rtt):
+        """记录主机的一个往返时间（秒）"""
+        self.counts[slot * LatencyHistogram.BUCKETS + LatencyHistogram.bucket(rtt)] += 1
+        self.totals[slot] += 1
+        self.overall.record(rtt)
+    
+    def percentile(self, slot, quantile):
+        """返回主机往返时间的百分位数（秒），没有记录时返回None"""
+        start = slot * LatencyHistogram.BUCKETS
+        return LatencyHistogram.percentile_of(self.counts[start:start + LatencyHistogram.BUCKETS],
+                                              self.totals[slot], quantile)
+
+# 自适应并发与发送速率控制
+class RateController:
+    """AIMD方式的在途探测数量控制器，并可限制每秒探测数
+    
+    从并发上限开始，每完成约一个并发窗口的探测统计一次平均往返时间和已知在线主机的丢包率：
+    往返时间明显变长，或上一轮回复过的主机超时率相对基线突增时并发减半，
+    指标恢复后再增大并发（慢启动阶段翻倍，之后每轮加1）。
+    从未回复过的地址超时不计入丢包率，稀疏网段中大量不在线的地址不会被误判为拥塞。
+    如果减半后丢包率没有改善，说明丢包不是发送过快造成的
+    （例如这些主机已经下线），此时把它接受为新的基线。
+    """
+    
+    # 超时率高出基线多少视为突增
+    LOSS_SPIKE = 0.15
+    # 一个窗口内至少有这么多已知在线主机的结果时才计算丢包率
+    LOSS_MIN_SAMPLES = 8
+    # 平均往返时间超过最小往返时间的倍数，且绝对增加量超过RTT_SLACK秒，视为拥塞
+    RTT_INFLATION = 3.0
+    RTT_SLACK = 0.02
+    
+    def __init__(self, max_concurrency, max_pps=0, adaptive=True, min_concurrency=4):
+        """
+        Args:
+            max_concurrency: 在途探测数量上限，也是初始并发
+            max_pps: 每秒最多发出的探测数，0表示不限制
+            adaptive: 是否自适应调整并发，False时固定为max_concurrency
+            min_concurrency: 自适应时的并发下限
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.adaptive = adaptive
+        self.max_pps = max_pps
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._pps = None
+        self._cond = threading.Condition()
+        self._next_send = 0.0
+        self._ssthresh = float(self.max_concurrency)
+        self._base_loss = None
+        self._backoff_loss = None
+        self._min_rtt = None
+        self._window_done = 0
+        self._window_known = 0
+        self._window_lost = 0
+        self._window_replies = 0
+        self._window_rtt = 0.0
+        self._rate_start = time.monotonic()
+        self._rate_count = 0
+    
+    @property
+    def concurrency(self):
+        """当前允许的在途探测数量"""
+        return int(self.limit)
+    
+    @property
+    def pps(self):
+        """最近约一秒内每秒发出的探测数"""
+        elapsed = time.monotonic() - self._rate_start
+        if self._pps is None or elapsed >= 1:
+            return self._rate_count / elapsed if elapsed > 0 else 0.0
+        return self._pps
+    
+    def _try_acquire(self):
+        # 返回0表示已放行；返回正数表示需要等待的秒数（受速率限制）；返回None表示并发已满
+        if self.in_flight >= int(self.limit):
+            return None
+        now = time.monotonic()
+        if self.max_pps > 0:
+            if now < self._next_send:
+                return self._next_send - now
+            self._next_send = max(self._next_send, now) + 1 / self.max_pps
+        self.in_flight += 1
+        self._rate_count += 1
+        elapsed = now - self._rate_start
+        if elapsed >= 1:
+            self._pps = self._rate_count / elapsed
+            self._rate_start = now
+            self._rate_count = 0
+        return 0
+    
+    def acquire(self):
+        """阻塞直到可以发出下一个探测（线程池引擎使用）"""
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self._cond.wait(wait)
+    
+    async def acquire_async(self):
+        """等待直到可以发出下一个探测（ICMP引擎使用，只有一个调度协程调用）"""
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait if wait is not None else 0.001)
+    
+    def release(self, ok, rtt=None, known=False):
+        """探测完成，释放在途名额并更新统计
+        
+        Args:
+            ok: 是否收到回复
+            rtt: 往返时间（秒），未知时为None
+            known: 该主机此前是否回复过（例如监控模式上一轮可达），只有这些主机的超时计入丢包率
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if self.adaptive:
+                self._observe(ok, rtt, known)
+            self._cond.notify()
+    
+    def _observe(self, ok, rtt, known):
+        self._window_done += 1
+        if known:
+            self._window_known += 1
+            if not ok:
+                self._window_lost += 1
+        if ok and rtt is not None:
+            self._window_replies += 1
+            self._window_rtt += rtt
+            self._min_rtt = rtt if self._min_rtt is None else min(self._min_rtt, rtt)
+        if self._window_done < max(8, int(self.limit)):
+            return
+        
+        # 一个窗口结束，计算本轮已知在线主机的丢包率和平均往返时间
+        loss = self._window_lost / self._window_known if self._window_known >= self.LOSS_MIN_SAMPLES else None
+        avg_rtt = self._window_rtt / self._window_replies if self._window_replies else None
+        self._window_done = self._window_known = self._window_lost = self._window_replies = 0
+        self._window_rtt = 0.0
+        
+        loss_spike = loss is not None and self._base_loss is not None and loss > self._base_loss + self.LOSS_SPIKE
+        rtt_inflated = (avg_rtt is not None and self._min_rtt is not None
+                        and avg_rtt > self._min_rtt * self.RTT_INFLATION
+                        and avg_rtt - self._min_rtt > self.RTT_SLACK)
+        if loss_spike or rtt_inflated:
+            if (not rtt_inflated and self._backoff_loss is not None
+                    and loss >= self._backoff_loss - self.LOSS_SPIKE / 2):
+                # 降速后丢包率没有改善，不是发送过快造成的
+                self._base_loss = loss
+                self._backoff_loss = None
+            else:
+                self._backoff_loss = loss if loss_spike else None
+                self._ssthresh = max(self.min_concurrency, self.limit / 2)
+                self.limit = self._ssthresh
+            return
+        
+        self._backoff_loss = None
+        if loss is not None:
+            self._base_loss = loss if self._base_loss is None else self._base_loss * 0.8 + loss * 0.2
+        if self.limit < self._ssthresh:
+            self.limit = min(self.limit * 2, self._ssthresh)
+        else:
+            self.limit += 1
+        self.limit = min(self.limit, self.max_concurrency)
+
+# 受控提交任务到线程池
+def bounded_map(executor, fn, iterable, controller, known=None):
+    """逐个从iterable取出参数提交到线程池，在途任务数量由控制器决定
+    
+    与executor.map不同，不会一次性把所有任务提交到队列中，
+    内存占用不随目标数量增长。调用方通过退出with语句等待全部任务完成。
+    
+    Args:
+        executor: 线程池
+        fn: 任务函数，返回值为探测是否收到回复
+        iterable: 参数可迭代对象
+        controller: RateController并发与速率控制器
+        known: 参数为item的函数，返回该目标此前是否回复过，None表示都没有回复过
+    """
+    def on_done(item, future):
+        was_known = known is not None and known(item)
+        if future.exception() is not None:
+            print(f"[错误] 扫描任务异常: {future.exception()}")
+            controller.release(False, known=was_known)
+        else:
+            controller.release(bool(future.result()), known=was_known)
+    
+    for item in iterable:
+        controller.acquire()
+        executor.submit(fn, item).add_done_callback(lambda future, item=item: on_done(item, future))
+
+# 按行输出IP列表
+def print_ip_rows(ips, width=16):
+    """按终端宽度把IP地址逐行输出，每行若干个
+    
+    Args:
+        ips: IP地址可迭代对象（按地址顺序）
+        width: 每项的最小字符宽度，项与项之间另有1个空格，超长的项不会与下一项相连
+    """
+    # 根据终端宽度动态调整每行显示的IP数量
+    try:
+        terminal_width = os.get_terminal_size().columns
+        ip_per_row = max(3 if width <= 16 else 1, min(10, terminal_width // (width + 1)))  # 每项之后留1个空格
+    except:
+        ip_per_row = max(1, 85 // (width + 1))  # 默认为5个IP/行
+    
+    row_ips = []
+    for ip in ips:
+        # 格式化输出IP，每个IP占width字符宽度，用空格分隔
+        row_ips.append(f"{str(ip):<{width}}")
+        if len(row_ips) == ip_per_row:
+            print("   " + " ".join(row_ips))
+            row_ips = []
+    if row_ips:
+        print("   " + " ".join(row_ips))
+
+# 结果列表中各来源的标记
+RESULT_SUFFIXES = {SOURCE_CACHE: '*', SOURCE_NEIGHBOR: '+'}
+
+# 生成结果列表中显示的IP文字
+def result_labels(results, status):
+    """按地址顺序生成指定状态的IP字符串，来自缓存的结果后面加*，来自邻居表的加+"""
+    for slot in results.slots(status):
+        suffix = RESULT_SUFFIXES.get(results.source[slot], '')
+        yield f"{results.address(slot)}{suffix}"
+
+# 生成结果列表中显示的地址段文字
+def range_labels(results, status):
+    """把指定状态的连续地址合并为'首地址-末地址 (数量)'，单个地址只显示地址，来源标记同result_labels"""
+    for first, last in results.runs(status):
+        suffix = RESULT_SUFFIXES.get(results.source[first], '')
+        if first == last:
+            yield f"{results.address(first)}{suffix}"
+        else:
+            yield f"{results.address(first)}-{results.address(last)}{suffix} ({last - first + 1})"
+
+# 合并端口响应相同的连续在线主机
+def port_runs(results):
+    """在可达的连续地址段内，把响应端口相同的相邻主机合并，生成(首槽位, 末槽位, 端口字典)"""
+    for first, last in results.runs(STATUS_REACHABLE):
+        start = None
+        for slot in range(first, last + 1):
+            ports = results.ports.get(slot)
+            if start is not None and ports != results.ports[start]:
+                yield start, slot - 1, results.ports[start]
+                start = None
+            if start is None and ports:
+                start = slot
+        if start is not None:
+            yield start, last, results.ports[start]
+
+# 按显示方式输出某个状态的结果列表
+def print_status_list(results, status, list_mode):
+    """ranges方式合并连续地址段后按最长一项对齐输出，full方式逐个输出IP"""
+    if list_mode == 'full':
+        # 结果已按地址顺序存放，逐行输出，无需排序
+        print_ip_rows(result_labels(results, status))
+        return
+    labels = list(range_labels(results, status))
+    print_ip_rows(labels, width=max(16, max(map(len, labels))))
+
+# 显示按子网汇总的结果
+def print_subnet_table(results):
+    """每个子网一行，显示扫描数、可达数和不可达数"""
+    print(f"| {'子网':<22} | {'扫描数':<8} | {'可达数':<8} | {'不可达数':<8} |")
+    print(f"|{'-'*24}|{'-'*10}|{'-'*10}|{'-'*10}|")
+    for subnet, scanned, reachable, unreachable in results.subnet_counts():
+        print(f"| {str(subnet):<22} | {scanned:<8} | {reachable:<8} | {unreachable:<8} |")
+
+# 格式化TCP探测的响应端口
+def format_ports(ports, sep=','):
+    """把{端口: 是否开放}格式化为'22/open,80/closed'"""
+    return sep.join(f"{port}/{'open' if is_open else 'closed'}" for port, is_open in ports.items())
 
 # 显示结果表格
-def show_results_table(reachable, unreachable):
-    """以表格形式显示扫描结果"""
+def show_results_table(results, list_mode='ranges'):
+    """以表格形式显示扫描结果
+    
+    Args:
+        results: ScanResults扫描结果对象
+        list_mode: 结果列表的显示方式，取值见LIST_MODES
+    """
     # 计算统计数据
-    total = len(reachable) + len(unreachable)
-    reachable_count = len(reachable)
-    unreachable_count = len(unreachable)
+    reachable_count = results.count(STATUS_REACHABLE)
+    unreachable_count = results.count(STATUS_UNREACHABLE)
+    total = reachable_count + unreachable_count
     
     if total == 0:
         print("\n[错误] 没有可显示的结果")
@@ -203,278 +1963,643 @@ def show_results_table(reachable, unreachable):
     print(f"| {'总IP数':<15} | {total:<10} | {'100%':<15} |")
     print(f"| {'可达IP数':<15} | {reachable_count:<10} | {reachable_count/total*100:>7.1f}%{'':<7} |")
     print(f"| {'不可达IP数':<15} | {unreachable_count:<10} | {unreachable_count/total*100:>7.1f}%{'':<7} |")
+    cached_count = results.source.count(SOURCE_CACHE)
+    if cached_count:
+        print(f"| {'缓存结果数(*)':<15} | {cached_count:<10} | {cached_count/total*100:>7.1f}%{'':<7} |")
+    neighbor_count = results.source.count(SOURCE_NEIGHBOR)
+    if neighbor_count:
+        print(f"| {'邻居表结果数(+)':<15} | {neighbor_count:<10} | {neighbor_count/total*100:>7.1f}%{'':<7} |")
     
     if sys.platform.startswith('win'):
         Colors.print_color("╚══════════════════════════════════════════════════════╝", 11)
     else:
         print(f"{Colors.CYAN}╚══════════════════════════════════════════════════════╝{Colors.RESET}")
     
-    # 显示可达IP表格
-    if sys.platform.startswith('win'):
-        Colors.print_color(f"\n可达IP列表 ({len(reachable)}个):", 10)
-    else:
-        print(f"\n{Colors.GREEN}可达IP列表 ({len(reachable)}个):{Colors.RESET}")
-    if sys.platform.startswith('win'):
-        Colors.print_color("╟──────────────────────────────────────────────────────╢", 10)
-    else:
-        print(f"{Colors.GREEN}╟──────────────────────────────────────────────────────╢{Colors.RESET}")
-    if reachable:
-        # 根据终端宽度动态调整每行显示的IP数量
-        try:
-            terminal_width = os.get_terminal_size().columns
-            ip_per_row = max(3, min(10, terminal_width // 17))  # 每个IP占16字符+1空格
-        except:
-            ip_per_row = 5  # 默认为5个IP/行
-            
-        rows = (len(reachable) + ip_per_row - 1) // ip_per_row
-        
-        # 对IP列表进行排序
-        sorted_reachable = sorted(reachable, key=lambda x: tuple(map(int, x.split('.'))))
-        
-        for i in range(rows):
-            start = i * ip_per_row
-            end = min((i + 1) * ip_per_row, len(sorted_reachable))
-            row_ips = sorted_reachable[start:end]
-            # 格式化输出IP，每个IP占16字符宽度
-            formatted_ips = [f"{ip:<16}" for ip in row_ips]
-            print("   " + "".join(formatted_ips))
-    else:
-        print("   无可达IP")
-    if sys.platform.startswith('win'):
-        Colors.print_color("╚──────────────────────────────────────────────────────╝", 10)
-    else:
-        print(f"{Colors.GREEN}╚──────────────────────────────────────────────────────╝{Colors.RESET}")
+    # 多个输入网段时按输入网段分别统计（重叠部分在各网段中都计数）
+    breakdown = results.breakdown()
+    if len(breakdown) > 1:
+        if sys.platform.startswith('win'):
+            Colors.print_color("\n各输入网段统计:", 11)
+        else:
+            print(f"\n{Colors.CYAN}各输入网段统计:{Colors.RESET}")
+        print(f"| {'输入网段':<22} | {'扫描数':<8} | {'可达数':<8} | {'不可达数':<8} |")
+        print(f"|{'-'*24}|{'-'*10}|{'-'*10}|{'-'*10}|")
+        for name, scanned, reachable, unreachable in breakdown:
+            print(f"| {name:<22} | {scanned:<8} | {reachable:<8} | {unreachable:<8} |")
     
-    # 显示不可达IP表格
-    if sys.platform.startswith('win'):
-        Colors.print_color(f"\n不可达IP列表 ({len(unreachable)}个):", 12)
-        Colors.print_color("╟──────────────────────────────────────────────────────╢", 12)
-    else:
-        print(f"\n{Colors.RED}不可达IP列表 ({len(unreachable)}个):{Colors.RESET}")
-        print(f"{Colors.RED}╟──────────────────────────────────────────────────────╢{Colors.RESET}")
-    if unreachable:
-        # 根据终端宽度动态调整每行显示的IP数量
-        try:
-            terminal_width = os.get_terminal_size().columns
-            ip_per_row = max(3, min(10, terminal_width // 17))  # 每个IP占16字符+1空格
-        except:
-            ip_per_row = 5  # 默认为5个IP/行
-            
-        rows = (len(unreachable) + ip_per_row - 1) // ip_per_row
-        
-        # 对IP列表进行排序
-        sorted_unreachable = sorted(unreachable, key=lambda x: tuple(map(int, x.split('.'))))
-        
-        for i in range(rows):
-            start = i * ip_per_row
-            end = min((i + 1) * ip_per_row, len(sorted_unreachable))
-            row_ips = sorted_unreachable[start:end]
-            # 格式化输出IP，每个IP占16字符宽度
-            formatted_ips = [f"{ip:<16}" for ip in row_ips]
-            print("   " + "".join(formatted_ips))
-    else:
-        print("   无不可达IP")
-    if sys.platform.startswith('win'):
-        Colors.print_color("╚──────────────────────────────────────────────────────╝", 12)
-    else:
-        print(f"{Colors.RED}╚──────────────────────────────────────────────────────╝{Colors.RESET}")
+    # 超大网段按子网汇总，代替可达和不可达IP列表
+    if list_mode == 'subnet':
+        if sys.platform.startswith('win'):
+            Colors.print_color("\n各子网统计:", 11)
+        else:
+            print(f"\n{Colors.CYAN}各子网统计:{Colors.RESET}")
+        print_subnet_table(results)
+    
+    # 显示可达IP表格（按子网汇总时不显示）
+    if list_mode != 'subnet':
+        if sys.platform.startswith('win'):
+            Colors.print_color(f"\n可达IP列表 ({reachable_count}个):", 10)
+            Colors.print_color("╟──────────────────────────────────────────────────────╢", 10)
+        else:
+            print(f"\n{Colors.GREEN}可达IP列表 ({reachable_count}个):{Colors.RESET}")
+            print(f"{Colors.GREEN}╟──────────────────────────────────────────────────────╢{Colors.RESET}")
+        if reachable_count:
+            print_status_list(results, STATUS_REACHABLE, list_mode)
+        else:
+            print("   无可达IP")
+        if sys.platform.startswith('win'):
+            Colors.print_color("╚──────────────────────────────────────────────────────╝", 10)
+        else:
+            print(f"{Colors.GREEN}╚──────────────────────────────────────────────────────╝{Colors.RESET}")
+    
+    # TCP探测时显示各在线主机响应的端口（open为连接成功，closed为收到RST）
+    if results.ports:
+        if sys.platform.startswith('win'):
+            Colors.print_color(f"\n端口响应列表 ({len(results.ports)}个):", 10)
+            Colors.print_color("╟──────────────────────────────────────────────────────╢", 10)
+        else:
+            print(f"\n{Colors.GREEN}端口响应列表 ({len(results.ports)}个):{Colors.RESET}")
+            print(f"{Colors.GREEN}╟──────────────────────────────────────────────────────╢{Colors.RESET}")
+        if list_mode == 'full':
+            rows = ((slot, slot, results.ports[slot]) for slot in sorted(results.ports))
+        else:
+            rows = port_runs(results)
+        for first, last, ports in rows:
+            if first == last:
+                print(f"   {str(results.address(first)):<16}{format_ports(ports)}")
+            else:
+                label = f"{results.address(first)}-{results.address(last)} ({last - first + 1})"
+                print(f"   {label:<16} {format_ports(ports)}")
+        if sys.platform.startswith('win'):
+            Colors.print_color("╚──────────────────────────────────────────────────────╝", 10)
+        else:
+            print(f"{Colors.GREEN}╚──────────────────────────────────────────────────────╝{Colors.RESET}")
+    
+    # 显示不可达IP表格（按子网汇总时不显示）
+    if list_mode != 'subnet':
+        if sys.platform.startswith('win'):
+            Colors.print_color(f"\n不可达IP列表 ({unreachable_count}个):", 12)
+            Colors.print_color("╟──────────────────────────────────────────────────────╢", 12)
+        else:
+            print(f"\n{Colors.RED}不可达IP列表 ({unreachable_count}个):{Colors.RESET}")
+            print(f"{Colors.RED}╟──────────────────────────────────────────────────────╢{Colors.RESET}")
+        if unreachable_count:
+            print_status_list(results, STATUS_UNREACHABLE, list_mode)
+        else:
+            print("   无不可达IP")
+        if sys.platform.startswith('win'):
+            Colors.print_color("╚──────────────────────────────────────────────────────╝", 12)
+        else:
+            print(f"{Colors.RED}╚──────────────────────────────────────────────────────╝{Colors.RESET}")
+
+# 按需加载的绘图依赖
+_plot_modules = None
+
+def load_plot_modules(headless=False):
+    """导入绘图后端所需的matplotlib和numpy
+    
+    这两个库的导入需要几百毫秒和几十MB内存，因此不在模块加载时导入，
+    只有真正绘图时才调用；--no-graph或只输出表格、结果流时完全不会加载。
+    
+    Args:
+        headless: 是否使用无界面的Agg后端（在导入pyplot之前设置，不会加载GUI库）
+    
+    Returns:
+        tuple: (pyplot, patches, colors, numpy)模块
+    """
+    global _plot_modules
+    import matplotlib
+    if headless:
+        matplotlib.use('Agg')
+    if _plot_modules is None:
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+        import matplotlib.colors as colors
+        import numpy as np
+        _plot_modules = (plt, patches, colors, np)
+    return _plot_modules
+
+# 图形中各状态的颜色：未扫描、可达、不可达、网格填充
+STATUS_COLORS = ['#BDC3C7', '#2ECC71', '#E74C3C', '#FFFFFF']
+# 网格不超过该数量的方块时在方块内标注地址
+PLOT_LABEL_LIMIT = 1024
 
 # 绘制IP可达性图形
-def plot_ip_status(network, reachable, unreachable):
-    """绘制IP可达性状态图形，绿色表示可达，红色表示不可达"""
+def plot_ip_status(network, results, graph_out=None):
+    """绘制IP可达性状态图形，绿色表示可达，红色表示不可达
+    
+    状态数组直接转换成一张图像（imshow），绘制耗时与主机数量基本无关，
+    /16网段也能在一秒内完成；只有网格较小时才逐个标注地址。
+    
+    Args:
+        network: 网段字符串（用于标题）
+        results: ScanResults扫描结果对象
+        graph_out: 图形输出文件（.png/.svg等），指定时不需要显示器，不弹出窗口
+    """
     try:
+        # 写文件时使用无界面后端，可以在没有显示器的服务器上运行
+        plt, patches, colors, np = load_plot_modules(headless=bool(graph_out))
+        
         # 配置matplotlib使用支持中文的字体，解决中文显示异常问题
         plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
         plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
         
-        # 解析网段
-        ip_net = ipaddress.ip_network(network, strict=False)
-        all_ips = list(ip_net.hosts())
-        
-        if not all_ips:
-            print("[错误] 网段中没有可用的主机IP")
+        # 结果槽位按地址顺序排列，直接按槽位绘制
+        total_ips = len(results)
+        if total_ips == 0:
+            print("[错误] 没有可绘制的扫描结果")
             return
+        reachable_count = results.count(STATUS_REACHABLE)
         
-        # 转换为字符串列表以便比较
-        all_ips_str = [str(ip) for ip in all_ips]
-        reachable_set = set(reachable)
-        
-        # 计算网格大小
-        total_ips = len(all_ips_str)
-        grid_cols = min(20, total_ips)  # 每行最多20个IP
+        # 计算网格大小：小网段每行20个，大网段取接近正方形的2的幂列数（/16为每行256个）
+        if total_ips <= 400:
+            grid_cols = min(20, total_ips)
+        else:
+            grid_cols = min(256, 1 << math.ceil(math.log2(math.sqrt(total_ips))))
         grid_rows = (total_ips + grid_cols - 1) // grid_cols
         
+        # 状态码数组补齐为完整网格，多出的格子使用填充色
+        grid = np.full(grid_rows * grid_cols, len(STATUS_COLORS) - 1, dtype=np.uint8)
+        grid[:total_ips] = np.frombuffer(bytes(results.status), dtype=np.uint8)
+        grid = grid.reshape(grid_rows, grid_cols)
+        
         # 创建图形
         fig, ax = plt.subplots(figsize=(12, 8))
         
         # 设置图形标题
-        plt.title(f"IP地址可达性状态 - {network}", fontsize=16, pad=20)
+        ax.set_title(f"IP地址可达性状态 - {network}", fontsize=16, pad=20)
         
-        # 计算每个方块的大小和间距
-        box_size = 0.8
-        spacing = 0.2  # 增加间距，提高可读性
+        # 整个网格作为一张图像绘制
+        cmap = colors.ListedColormap(STATUS_COLORS)
+        ax.imshow(grid, cmap=cmap, vmin=0, vmax=len(STATUS_COLORS) - 1,
+                  interpolation='nearest', aspect='equal')
         
-        # 绘制IP地址方块
-        for idx, ip in enumerate(all_ips_str):
-            row = idx // grid_cols
-            col = idx % grid_cols
-            
-            # 计算位置
-            x = col * (box_size + spacing)
-            y = -row * (box_size + spacing)
-            
-            # 确定颜色：绿色表示可达，红色表示不可达
-            if ip in reachable_set:
-                color = '#2ECC71'  # 亮绿色，更明显
-                status = '可达'
-            else:
-                color = '#E74C3C'  # 亮红色，更明显
-                status = '不可达'
-            
-            # 绘制方块
-            rect = patches.Rectangle(
-                (x, y), box_size, box_size, 
-                linewidth=1, edgecolor='black', facecolor=color
-            )
-            ax.add_patch(rect)
-            
-            # 在方块内添加IP地址（只显示最后一位）
-            ip_last = ip.split('.')[-1]
-            plt.text(
-                x + box_size/2, y + box_size/2, 
-                ip_last, ha='center', va='center', 
-                fontsize=9, color='white'  # 所有彩色方块上都使用白色文字
-            )
+        if total_ips <= PLOT_LABEL_LIMIT:
+            # 网格较小时用白线分隔方块，并在方块内添加IP地址（只显示最后一段）
+            ax.hlines(np.arange(grid_rows + 1) - 0.5, -0.5, grid_cols - 0.5, colors='white', linewidth=2)
+            ax.vlines(np.arange(grid_cols + 1) - 0.5, -0.5, grid_rows - 0.5, colors='white', linewidth=2)
+            fontsize = 9 if grid_cols <= 20 else 6
+            for slot in range(total_ips):
+                ip = str(results.address(slot))
+                ip_last = ip.rsplit('.' if '.' in ip else ':', 1)[-1]
+                ax.text(slot % grid_cols, slot // grid_cols, ip_last, ha='center', va='center',
+                        fontsize=fontsize, color='white')  # 所有彩色方块上都使用白色文字
         
         # 添加图例 - 确保图例颜色与实际方块颜色一致
-        reachable_patch = patches.Patch(color='#2ECC71', label='可达')
-        unreachable_patch = patches.Patch(color='#E74C3C', label='不可达')
-        plt.legend(handles=[reachable_patch, unreachable_patch], loc='lower right', fontsize=12)
-        
-        # 设置坐标轴
-        plt.xlim(-spacing, grid_cols * (box_size + spacing) - spacing)
-        plt.ylim(-grid_rows * (box_size + spacing) + spacing, box_size + spacing)
-        plt.axis('off')  # 隐藏坐标轴
+        reachable_patch = patches.Patch(color=STATUS_COLORS[STATUS_REACHABLE], label='可达')
+        unreachable_patch = patches.Patch(color=STATUS_COLORS[STATUS_UNREACHABLE], label='不可达')
+        ax.legend(handles=[reachable_patch, unreachable_patch], loc='upper left',
+                  bbox_to_anchor=(1.01, 1), fontsize=12)
         
-        # 调整布局
-        plt.tight_layout()
+        ax.axis('off')  # 隐藏坐标轴
         
         # 添加统计信息文本
-        stats_text = f"总IP数: {total_ips}\n可达IP数: {len(reachable_set)}\n不可达IP数: {total_ips - len(reachable_set)}\n可达率: {len(reachable_set)/total_ips*100:.1f}%"
-        plt.text(
-            #0.02, 0.98, stats_text, 
-            0.79, 0.1, stats_text, 
+        stats_text = f"总IP数: {total_ips}\n可达IP数: {reachable_count}\n不可达IP数: {total_ips - reachable_count}\n可达率: {reachable_count/total_ips*100:.1f}%"
+        ax.text(
+            1.01, 0.1, stats_text, 
             transform=ax.transAxes, 
             verticalalignment='top', 
             fontsize=10, 
-            bbox=dict[str, str | float](boxstyle='round', facecolor='wheat', alpha=0.5)
+            bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5)
         )
         
-        # 显示图形
-        plt.show()
+        # 调整布局
+        fig.tight_layout()
         
+        if graph_out:
+            # 保存到文件，格式由扩展名决定
+            fig.savefig(graph_out, dpi=150)
+            plt.close(fig)
+            if sys.platform.startswith('win'):
+                Colors.print_color(f"[信息] 图形已保存到: {graph_out}", 9)
+            else:
+                print(f"{Colors.BLUE}[信息] 图形已保存到: {graph_out}{Colors.RESET}")
+        else:
+            # 显示图形
+            plt.show()
+        
+    except ImportError as e:
+        print(f"[错误] 绘制图形需要matplotlib和numpy（可使用--no-graph跳过绘图）: {e}")
     except ValueError as e:
         print(f"[错误] 绘制图形失败: {e}")
     except Exception as e:
         print(f"[错误] 绘制图形时发生异常: {e}")
 
+# 格式化往返时间百分位
+def format_percentiles(histogram, quantiles=(0.5, 0.95, 0.99)):
+    """把直方图的百分位数格式化为'p50/p95/p99'形式的毫秒数"""
+    values = (histogram.percentile(quantile) for quantile in quantiles)
+    return "/".join('-' if value is None else f"{value * 1000:.2f}" for value in values)
+
+# 持续监控
+def watch_scan(results, engine, controller, interval, rounds=0, reporter=None, count=1, timeout=500,
+               ports=(), early_exit=False, retries=0, backoff=1.5):
+    """按固定间隔重复扫描，只输出状态变化和往返时间百分位汇总
+    
+    每轮复用同一个结果对象和控制器（自适应并发不必每轮重新探索），往返时间
+    记入固定大小的直方图，无论运行多久内存都不会增长。按Ctrl+C停止。
+    
+    Args:
+        results: ScanResults扫描结果对象，结束时保存最后一轮的结果
+        engine: 'icmp'、'tcp'或'ping'
+        controller: RateController并发与速率控制器
+        interval: 两轮扫描开始时间的间隔（秒）
+        rounds: 扫描轮数，0表示一直运行
+        reporter: 输出状态变化到结果流的ResultReporter，None表示不输出结果流
+        count: 每个IP的探测次数
+        timeout: 超时时间（毫秒）
+        ports: tcp引擎连接的端口
+        early_exit: tcp引擎在任一端口响应后是否取消其余端口的连接
+        retries: 每轮两阶段扫描的重试次数，见run_scan
+        backoff: 同一主机相邻两次重试的间隔相对上一次的倍数
+    """
+    histograms = HostLatencyHistograms(len(results))
+    round_histogram = LatencyHistogram()
+    blank_rtt = array('f', [math.nan]) * len(results)
+    previous = None
+    round_no = 0
+    next_start = time.monotonic()
+    try:
+        while not rounds or round_no < rounds:
+            round_no += 1
+            round_start = time.monotonic()
+            results.status[:] = bytes(len(results))
+            results.rtt[:] = blank_rtt
+            results.ports.clear()
+            results.recovered = 0
+            run_scan(results, engine, controller, count=count, timeout=timeout, ports=ports, early_exit=early_exit,
+                     retries=retries, backoff=backoff, previous=previous)
+            elapsed = time.monotonic() - round_start
+            
+            round_histogram.reset()
+            for slot in results.slots(STATUS_REACHABLE):
+                rtt = results.rtt[slot]
+                if not math.isnan(rtt):
+                    histograms.record(slot, rtt)
+                    round_histogram.record(rtt)
+            
+            # 第一轮把全部结果写入结果流作为初始状态，之后只输出状态变化
+            if previous is None:
+                changed = range(len(results)) if reporter is not None else ()
+            elif results.status == previous:
+                changed = ()
+            else:
+                changed = [slot for slot in range(len(results)) if results.status[slot] != previous[slot]]
+            for slot in changed:
+                is_reachable = results.status[slot] == STATUS_REACHABLE
+                rtt = results.rtt[slot]
+                if reporter is not None:
+                    reporter.put(results.address(slot), is_reachable, None if math.isnan(rtt) else rtt,
+                                 echo=False, ports=results.ports.get(slot))
+                if previous is None:
+                    continue
+                text = f"[变化] {results.address(slot)} {'不可达 -> 可达' if is_reachable else '可达 -> 不可达'}"
+                if sys.platform.startswith('win'):
+                    Colors.print_color(text, 10 if is_reachable else 12)
+                else:
+                    print(f"{Colors.GREEN if is_reachable else Colors.RED}{text}{Colors.RESET}")
+            
+            # 计算下一轮的开始时间，本轮超时则立即开始下一轮
+            next_start += interval
+            overrun = next_start < time.monotonic()
+            summary = (f"[第{round_no}轮] {time.strftime('%H:%M:%S')} 可达 {results.count(STATUS_REACHABLE)}/{len(results)}，"
+                       f"变化 {0 if previous is None else len(changed)} 个，"
+                       f"{f'重试找回 {results.recovered} 个，' if retries else ''}用时 {elapsed:.2f} 秒"
+                       f"{'（超过监控间隔）' if overrun else ''}，往返时间p50/p95/p99: "
+                       f"本轮 {format_percentiles(round_histogram)} 毫秒，累计 {format_percentiles(histograms.overall)} 毫秒")
+            if sys.platform.startswith('win'):
+                Colors.print_color(summary, 14)
+            else:
+                print(f"{Colors.YELLOW}{summary}{Colors.RESET}")
+            sys.stdout.flush()
+            previous = bytes(results.status)
+            
+            if rounds and round_no >= rounds:
+                break
+            if overrun:
+                next_start = time.monotonic()
+            else:
+                time.sleep(next_start - time.monotonic())
+    except KeyboardInterrupt:
+        # 中断时丢弃未完成的一轮，保留上一轮的结果用于最后的表格
+        if previous is not None:
+            results.status[:] = previous
+        print("\n[信息] 监控已停止")
+    
+    # 输出往返时间最长的主机
+    slowest = sorted(((histograms.percentile(slot, 0.99), slot) for slot in range(len(results))
+                      if histograms.totals[slot]), reverse=True)[:10]
+    if slowest:
+        if sys.platform.startswith('win'):
+            Colors.print_color(f"\n往返时间最长的主机（共{round_no}轮）:", 11)
+        else:
+            print(f"\n{Colors.CYAN}往返时间最长的主机（共{round_no}轮）:{Colors.RESET}")
+        print(f"| {'IP地址':<20} | {'回复数':<8} | {'p50(毫秒)':<10} | {'p99(毫秒)':<10} |")
+        print(f"|{'-'*22}|{'-'*10}|{'-'*12}|{'-'*12}|")
+        for p99, slot in slowest:
+            p50 = histograms.percentile(slot, 0.5)
+            print(f"| {str(results.address(slot)):<20} | {histograms.totals[slot]:<8} | "
+                  f"{p50 * 1000:<10.2f} | {p99 * 1000:<10.2f} |")
+
 # 主函数
 def main():
-    if sys.platform.startswith('win'):
-        Colors.print_color("╔══════════════════════════════════════════════════════╗", 11)
-        Colors.print_color("║                 IP网段扫描工具                      ║", 11)
-        Colors.print_color("╚══════════════════════════════════════════════════════╝", 11)
-    else:
-        print(f"{Colors.CYAN}╔══════════════════════════════════════════════════════╗{Colors.RESET}")
-        print(f"{Colors.CYAN}║                 IP网段扫描工具                      ║{Colors.RESET}")
-        print(f"{Colors.CYAN}╚══════════════════════════════════════════════════════╝{Colors.RESET}")
-    
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description='IP网段扫描工具')
-    parser.add_argument('-n', '--network', type=str, help='要扫描的IP网段（例如：192.168.1.0/24）')
-    parser.add_argument('-t', '--threads', type=int, default=100, help='并发线程数（默认：100）')
+    parser.add_argument('-n', '--network', type=str, action='append',
+                        help='要扫描的IP网段或IP（例如：192.168.1.0/24），可重复指定，也可用逗号分隔多个')
+    parser.add_argument('--targets-file', type=str, action='append',
+                        help='从文件读取要扫描的网段和IP（每行可写多个，#之后为注释），可重复指定')
+    parser.add_argument('--exclude', type=str, action='append',
+                        help='不扫描的网段或IP，可重复指定，也可用逗号分隔多个')
+    parser.add_argument('-t', '--threads', type=int, default=100, help='并发线程数，即在途探测数量上限（默认：100）')
     parser.add_argument('-p', '--packets', type=int, default=1, help='每个IP的ping包数量（默认：1）')
     parser.add_argument('-w', '--timeout', type=int, default=500, help='ping超时时间（毫秒，默认：500）')
     parser.add_argument('--no-graph', action='store_true', help='不显示图形化结果')
+    parser.add_argument('--graph-out', type=str,
+                        help='把图形保存到文件（按扩展名输出PNG/SVG等），不需要显示器，也不弹出窗口')
+    parser.add_argument('--limit', type=int, help='最多扫描的主机数量，用于超大网段抽样扫描（默认：全部）')
+    parser.add_argument('--sample', choices=['random', 'stride', 'head'], default='random',
+                        help='配合--limit使用的抽样方式：random随机，stride等间隔，head取前N个（默认：random）')
+    parser.add_argument('--max-pps', type=float, default=0, help='每秒最多发出的探测数，0表示不限制（默认：0）')
+    parser.add_argument('--no-adaptive', action='store_true', help='关闭自适应并发控制，固定使用--threads个并发')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='工作进程数量，大于1时把目标划分为分片由多个进程并行扫描，0表示CPU核数（默认：1）')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量扫描：缓存未过期且状态稳定的主机直接使用缓存结果，只探测其余主机')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH,
+                        help=f'扫描状态缓存文件（SQLite），--incremental时读写（默认：{DEFAULT_CACHE_PATH}）')
+    parser.add_argument('--ttl', type=float, default=300,
+                        help='缓存有效期（秒），超过有效期或在有效期内状态变化过的主机会重新探测（默认：300）')
+    parser.add_argument('-q', '--quiet', action='store_true', help='只显示进度，不逐个输出每个IP的结果')
+    parser.add_argument('--list-mode', choices=LIST_MODES, default='ranges',
+                        help='结果列表的显示方式：ranges把连续的同状态地址合并为地址段，subnet按/24子网汇总，'
+                             'full逐个列出每个IP（默认：ranges）')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], dest='stream_format',
+                        help='以jsonl或csv格式实时输出每个IP的结果，便于其他工具读取')
+    parser.add_argument('-o', '--output', type=str,
+                        help='结果流输出文件，默认为标准输出（此时其余提示信息改为输出到标准错误）')
+    parser.add_argument('-e', '--engine', choices=['auto', 'icmp', 'ping'], default='auto',
+                        help='探测引擎：icmp为进程内ICMP套接字，ping为调用系统ping命令，auto优先使用icmp（默认：auto）')
+    parser.add_argument('--probe', type=parse_probe, default='icmp',
+                        help='探测方式：icmp，或tcp:端口列表（例如tcp:22,80,443），'
+                             'TCP连接成功或被拒绝（RST）都视为主机在线，适用于过滤ICMP的网段（默认：icmp）')
+    parser.add_argument('--early-exit', action='store_true',
+                        help='TCP探测时任一端口响应即判定主机在线，取消该主机其余端口的连接')
+    parser.add_argument('--watch', type=float, metavar='INTERVAL',
+                        help='持续监控模式：每隔INTERVAL秒重新扫描一次，只输出状态变化和往返时间百分位，按Ctrl+C停止')
+    parser.add_argument('--rounds', type=int, default=0, help='持续监控的扫描轮数，0表示一直运行（默认：0）')
+    parser.add_argument('--retries', type=int, default=0,
+                        help='两阶段扫描：先对所有主机各探测一次，再对没有回复的主机重试指定次数，'
+                             '启用时忽略-p（默认：0，不分阶段）')
+    parser.add_argument('--retry-backoff', type=float, default=1.5,
+                        help='同一主机相邻两次重试的间隔相对上一次的倍数（默认：1.5）')
+    parser.add_argument('--neighbors', action='store_true',
+                        help='扫描前读取本机邻居表（ARP/NDP），状态为REACHABLE的主机直接判定为可达，不再探测')
+    parser.add_argument('--neighbor-table', type=str, action='append',
+                        help='从文件读取邻居表（/proc/net/arp或ip neigh输出格式）代替本机邻居表，可重复指定')
     
     # 解析命令行参数
     args = parser.parse_args()
+    if args.watch is not None:
+        # 持续监控在同一个进程中反复扫描，不使用缓存和多进程
+        if args.watch <= 0:
+            parser.error("--watch的间隔必须大于0")
+        if args.incremental or args.processes != 1 or args.neighbors:
+            parser.error("--watch不能与--incremental、--processes或--neighbors同时使用")
     
-    # 如果提供了命令行参数，则使用参数值；否则，获取用户输入的网段
-    if args.network:
-        network = args.network
+    # 结果流写到标准输出时，其余提示信息改写到标准错误，避免混在结果流中
+    stream = None
+    if args.stream_format:
+        if args.output and args.output != '-':
+            stream = open(args.output, 'w', encoding='utf-8', newline='')
+        else:
+            stream = sys.stdout
+            sys.stdout = sys.stderr
+    
+    if sys.platform.startswith('win'):
+        Colors.print_color("╔══════════════════════════════════════════════════════╗", 11)
+        Colors.print_color("║                 IP网段扫描工具                      ║", 11)
+        Colors.print_color("╚══════════════════════════════════════════════════════╝", 11)
     else:
-        network = input("请输入IP网段（例如：192.168.1.0/24）: ")
+        print(f"{Colors.CYAN}╔══════════════════════════════════════════════════════╗{Colors.RESET}")
+        print(f"{Colors.CYAN}║                 IP网段扫描工具                      ║{Colors.RESET}")
+        print(f"{Colors.CYAN}╚══════════════════════════════════════════════════════╝{Colors.RESET}")
+    
+    # 如果提供了命令行参数，则使用参数值；否则，获取用户输入的网段
+    networks = [item for value in args.network or [] for item in value.replace(',', ' ').split()]
+    for path in args.targets_file or []:
+        try:
+            networks.extend(read_targets_file(path))
+        except OSError as e:
+            print(f"[错误] 无法读取目标文件: {e}")
+            return
+    if not networks:
+        networks = input("请输入IP网段（例如：192.168.1.0/24，多个网段用空格或逗号分隔）: ").replace(',', ' ').split()
+    excludes = [item for value in args.exclude or [] for item in value.replace(',', ' ').split()]
+    # 输入网段很多时只显示前几个
+    network = ", ".join(networks[:5]) + (f" 等{len(networks)}个网段" if len(networks) > 5 else "")
+    
+    # 解析网段，合并重叠部分并去掉排除的地址，每个地址只探测一次
+    host_range = parse_networks(networks, excludes)
+    if not host_range:
+        if host_range is not None:
+            print("[错误] 去掉排除的地址后没有需要扫描的主机")
+        return
+    duplicate_count = host_range.input_total - host_range.size
+    processes = args.processes if args.processes > 0 else (os.cpu_count() or 1)
     
-    # 解析网段
-    ips = parse_network(network)
-    if not ips:
+    # 选择要扫描的主机，结果按偏移量存放，按需逐个生成IP地址
+    offsets = host_range.select(args.limit, args.sample)
+    total_ips = selection_size(offsets)
+    if total_ips > MAX_SCAN_HOSTS:
+        print(f"[错误] 需要扫描 {total_ips} 个主机，超过上限 {MAX_SCAN_HOSTS}，"
+              f"请用 --limit 指定扫描数量（可配合 --sample 选择抽样方式）")
         return
+    probe, ports = args.probe
+    engine = 'tcp' if probe == 'tcp' else resolve_engine(args.engine)
+    threads = args.threads
+    if engine == 'tcp':
+        # 每个在途主机同时占用len(ports)个套接字，不能超过可打开的文件数
+        threads = tcp_concurrency_limit(args.threads, len(ports))
+        if threads < args.threads:
+            if sys.platform.startswith('win'):
+                Colors.print_color(f"[警告] 可打开的文件数不足，并发线程数降为 {threads}", 14)
+            else:
+                print(f"{Colors.YELLOW}[警告] 可打开的文件数不足，并发线程数降为 {threads}{Colors.RESET}")
+    
+    # 初始化结果存储，记录往返时间
+    results = ScanResults(host_range, offsets, track_rtt=True)
+    
+    # 邻居表中最近确认可达的主机不需要探测
+    neighbor_count = 0
+    if args.neighbors or args.neighbor_table:
+        try:
+            neighbor_count = apply_neighbors(results, read_neighbor_tables(args.neighbor_table))
+        except OSError as e:
+            print(f"[错误] 无法读取邻居表: {e}")
+            return
+    
+    # 增量扫描时先填入仍然有效的缓存结果
+    cache = None
+    cached_count = 0
+    if args.incremental:
+        cache = ScanCache(args.cache)
+        cached_count = cache.load(results, args.ttl)
+    probe_total = total_ips - cached_count - neighbor_count
     
-    total_ips = len(ips)
     if sys.platform.startswith('win'):
         Colors.print_color(f"\n[信息] 开始扫描网段: {network}", 9)  # 9: 蓝色背景黑色文字
+        if len(host_range.inputs) > 1 or excludes:
+            Colors.print_color(f"[信息] 输入 {len(host_range.inputs)} 个网段，合并为 {len(host_range.ranges)} 个地址区间，"
+                               f"去掉重复或排除的地址 {duplicate_count} 个", 9)
+        if total_ips < host_range.size:
+            Colors.print_color(f"[信息] 网段共有 {host_range.size} 个主机地址，按{args.sample}方式抽样", 9)
         Colors.print_color(f"[信息] 总共有 {total_ips} 个IP地址需要扫描", 9)
-        Colors.print_color(f"[信息] 并发线程数: {args.threads}", 9)
+        if args.incremental:
+            Colors.print_color(f"[信息] 使用缓存结果 {cached_count} 个，需要探测 {probe_total} 个", 9)
+        if args.neighbors or args.neighbor_table:
+            Colors.print_color(f"[信息] 由邻居表确定可达 {neighbor_count} 个，需要探测 {probe_total} 个", 9)
+        Colors.print_color(f"[信息] 并发线程数: {threads}{'' if args.no_adaptive else '（自适应上限）'}", 9)
+        if args.max_pps > 0:
+            Colors.print_color(f"[信息] 速率上限: {args.max_pps:g} 个/秒", 9)
         Colors.print_color(f"[信息] 每个IP的ping包数量: {args.packets}", 9)
         Colors.print_color(f"[信息] ping超时时间: {args.timeout} 毫秒", 9)
+        Colors.print_color(f"[信息] 探测引擎: {engine}", 9)
+        if engine == 'tcp':
+            Colors.print_color(f"[信息] TCP端口: {','.join(map(str, ports))}"
+                               f"{'（任一端口响应即结束）' if args.early_exit else ''}", 9)
+        if processes > 1:
+            Colors.print_color(f"[信息] 工作进程数: {processes}", 9)
+        if args.watch:
+            Colors.print_color(f"[信息] 持续监控，间隔: {args.watch:g} 秒", 9)
+        if args.retries:
+            Colors.print_color(f"[信息] 两阶段扫描，没有回复的主机重试 {args.retries} 次，"
+                               f"重试间隔每次乘以 {args.retry_backoff:g}", 9)
         print("\n" + "╔══════════════════════════════════════════════════════╗")
     else:
         print(f"\n{Colors.BLUE}[信息] 开始扫描网段: {network}{Colors.RESET}")
+        if len(host_range.inputs) > 1 or excludes:
+            print(f"{Colors.BLUE}[信息] 输入 {len(host_range.inputs)} 个网段，合并为 {len(host_range.ranges)} 个地址区间，"
+                  f"去掉重复或排除的地址 {duplicate_count} 个{Colors.RESET}")
+        if total_ips < host_range.size:
+            print(f"{Colors.BLUE}[信息] 网段共有 {host_range.size} 个主机地址，按{args.sample}方式抽样{Colors.RESET}")
         print(f"{Colors.BLUE}[信息] 总共有 {total_ips} 个IP地址需要扫描{Colors.RESET}")
-        print(f"{Colors.BLUE}[信息] 并发线程数: {args.threads}{Colors.RESET}")
+        if args.incremental:
+            print(f"{Colors.BLUE}[信息] 使用缓存结果 {cached_count} 个，需要探测 {probe_total} 个{Colors.RESET}")
+        if args.neighbors or args.neighbor_table:
+            print(f"{Colors.BLUE}[信息] 由邻居表确定可达 {neighbor_count} 个，需要探测 {probe_total} 个{Colors.RESET}")
+        print(f"{Colors.BLUE}[信息] 并发线程数: {threads}{'' if args.no_adaptive else '（自适应上限）'}{Colors.RESET}")
+        if args.max_pps > 0:
+            print(f"{Colors.BLUE}[信息] 速率上限: {args.max_pps:g} 个/秒{Colors.RESET}")
         print(f"{Colors.BLUE}[信息] 每个IP的ping包数量: {args.packets}{Colors.RESET}")
         print(f"{Colors.BLUE}[信息] ping超时时间: {args.timeout} 毫秒{Colors.RESET}")
+        print(f"{Colors.BLUE}[信息] 探测引擎: {engine}{Colors.RESET}")
+        if engine == 'tcp':
+            print(f"{Colors.BLUE}[信息] TCP端口: {','.join(map(str, ports))}"
+                  f"{'（任一端口响应即结束）' if args.early_exit else ''}{Colors.RESET}")
+        if processes > 1:
+            print(f"{Colors.BLUE}[信息] 工作进程数: {processes}{Colors.RESET}")
+        if args.watch:
+            print(f"{Colors.BLUE}[信息] 持续监控，间隔: {args.watch:g} 秒{Colors.RESET}")
+        if args.retries:
+            print(f"{Colors.BLUE}[信息] 两阶段扫描，没有回复的主机重试 {args.retries} 次，"
+                  f"重试间隔每次乘以 {args.retry_backoff:g}{Colors.RESET}")
         print(f"\n{Colors.CYAN}╔══════════════════════════════════════════════════════╗{Colors.RESET}")
     
-    # 初始化结果列表
-    reachable_ips = []
-    unreachable_ips = []
-    lock = threading.Lock()
-    
-    # 初始化进度计数器
-    scanned_count = 0
-    progress_lock = threading.Lock()
-    
-    # 进度回调函数
-    def update_progress():
-        nonlocal scanned_count
-        with progress_lock:
-            scanned_count += 1
-            progress = scanned_count / total_ips * 100
-            # 每扫描10%的IP或扫描完成时显示进度
-            if scanned_count % (total_ips // 10 or 1) == 0 or scanned_count == total_ips:
-                if sys.platform.startswith('win'):
-                    Colors.print_color(f"[进度] 已扫描 {scanned_count}/{total_ips} 个IP地址 ({progress:.1f}%)", 14)  # 14: 黄色背景黑色文字
-                else:
-                    print(f"{Colors.YELLOW}[进度] 已扫描 {scanned_count}/{total_ips} 个IP地址 ({progress:.1f}%){Colors.RESET}")
+    controller = RateController(threads, max_pps=args.max_pps, adaptive=not args.no_adaptive)
+    
+    if args.watch:
+        reporter = None
+        if stream is not None:
+            reporter = ResultReporter(0, quiet=True, stream=stream, stream_format=args.stream_format).start()
+        watch_scan(results, engine, controller, args.watch, rounds=args.rounds, reporter=reporter,
+                   count=args.packets, timeout=args.timeout, ports=ports, early_exit=args.early_exit,
+                   retries=args.retries, backoff=args.retry_backoff)
+        if reporter is not None:
+            reporter.close()
+        show_results_table(results, args.list_mode)
+        if not args.no_graph:
+            plot_ip_status(network, results, graph_out=args.graph_out)
+        if stream is not None and stream is not sys.__stdout__:
+            stream.close()
+        return
+    
+    reporter = ResultReporter(probe_total, quiet=args.quiet, stream=stream, stream_format=args.stream_format,
+                              controller=controller if processes == 1 else None).start()
+    
+    # 缓存和邻居表的结果先写入结果流
+    if stream is not None:
+        for slot in results.slots(STATUS_REACHABLE):
+            rtt = results.rtt[slot] if results.rtt is not None else math.nan
+            reporter.put(results.address(slot), True, None if math.isnan(rtt) else rtt,
+                         results.source[slot], echo=False)
+        for slot in results.slots(STATUS_UNREACHABLE):
+            reporter.put(results.address(slot), False, source=results.source[slot], echo=False)
     
     start_time = time.time()
     
-    # 使用线程池进行并发扫描
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
-        # 使用lambda函数传递额外参数
-        list(executor.map(lambda ip: scan_ip(ip, reachable_ips, unreachable_ips, lock, update_progress, 
-                                            count=args.packets, timeout=args.timeout), ips))
+    # 全部命中缓存时不需要探测
+    if probe_total and processes > 1:
+        # 每个工作进程有自己的探测循环，速率上限在进程间平均分配
+        options = {
+            'threads': threads,
+            'max_pps': args.max_pps / processes,
+            'adaptive': not args.no_adaptive,
+            'count': args.packets,
+            'timeout': args.timeout,
+            'ports': ports,
+            'early_exit': args.early_exit,
+            'retries': args.retries,
+            'backoff': args.retry_backoff,
+        }
+        
+        # 工作进程只返回结果，每个分片合并后在这里输出主机结果、进度和结果流
+        def shard_done(start, stop):
+            for slot in range(start, stop):
+                if results.source[slot] == SOURCE_PROBE:
+                    rtt = results.rtt[slot] if results.rtt is not None else None
+                    reporter.put(results.address(slot), results.status[slot] == STATUS_REACHABLE, rtt,
+                                 ports=results.ports.get(slot))
+        
+        run_sharded_scan(results, engine, processes, options, shard_done)
+    elif probe_total:
+        run_scan(results, engine, controller,
+                 lambda slot, ip, is_reachable, rtt: reporter.put(ip, is_reachable, rtt,
+                                                                  ports=results.ports.get(slot)),
+                 count=args.packets, timeout=args.timeout, ports=ports, early_exit=args.early_exit,
+                 retries=args.retries, backoff=args.retry_backoff)
+    reporter.close()
     
     end_time = time.time()
-    scan_time = end_time - start_time
+    scan_time = max(end_time - start_time, 1e-6)
+    
+    # 保存本次探测的结果
+    if cache is not None:
+        cache.save(results)
+        cache.close()
     
     if sys.platform.startswith('win'):
         print("\n" + "╚══════════════════════════════════════════════════════╝")
         Colors.print_color(f"[完成] 扫描完成！耗时: {scan_time:.2f} 秒", 10)
-        Colors.print_color(f"[完成] 平均扫描速度: {total_ips/scan_time:.2f} 个IP/秒", 10)
+        Colors.print_color(f"[完成] 平均扫描速度: {probe_total/scan_time:.2f} 个IP/秒", 10)
+        if args.retries:
+            Colors.print_color(f"[完成] 第二阶段重试找回 {results.recovered} 个主机", 10)
     else:
         print(f"\n{Colors.CYAN}╚══════════════════════════════════════════════════════╝{Colors.RESET}")
         print(f"{Colors.GREEN}[完成] 扫描完成！耗时: {scan_time:.2f} 秒{Colors.RESET}")
-        print(f"{Colors.GREEN}[完成] 平均扫描速度: {total_ips/scan_time:.2f} 个IP/秒{Colors.RESET}")
+        print(f"{Colors.GREEN}[完成] 平均扫描速度: {probe_total/scan_time:.2f} 个IP/秒{Colors.RESET}")
+        if args.retries:
+            print(f"{Colors.GREEN}[完成] 第二阶段重试找回 {results.recovered} 个主机{Colors.RESET}")
     
     # 显示结果表格
-    show_results_table(reachable_ips, unreachable_ips)
+    show_results_table(results, args.list_mode)
     
     # 绘制图形化结果（如果没有指定--no-graph参数）
     if not args.no_graph:
-        plot_ip_status(network, reachable_ips, unreachable_ips)
+        plot_ip_status(network, results, graph_out=args.graph_out)
+    
+    if stream is not None and stream is not sys.__stdout__:
+        stream.close()
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,30 @@
 import os
 import re
 import argparse
+from datetime import datetime
+from cycle_store import CycleStore
+
+def count_port_status(all_records, target_ports):
+    """
+    统计每个端口Up、Down和未找到的次数
+    :param all_records: 端口状态记录列表
+    :param target_ports: 要查询的端口列表
+    :return: 统计信息
+    """
+    port_stats = {}
+    for port in target_ports:
+        port_stats[port] = {'up': 0, 'down': 0, 'not_found': 0}
+    
+    for record in all_records:
+        for port in target_ports:
+            status = record['port_status'].get(port, 'not_found')
+            if status.lower() == 'up':
+                port_stats[port]['up'] += 1
+            elif status.lower() == 'down':
+                port_stats[port]['down'] += 1
+            else:
+                port_stats[port]['not_found'] += 1
+    return port_stats
 
 def parse_all_port_status(log_file, target_ports):
     """
@@ -24,11 +48,6 @@ def parse_all_port_status(log_file, target_ports):
     # 每个记录包含"循环次数:"、"执行时间:"、"Dev/Port:"和"Link:"行
     all_records = []
     
-    # 初始化统计信息
-    port_stats = {}
-    for port in target_ports:
-        port_stats[port] = {'up': 0, 'down': 0, 'not_found': 0}
-    
     for match in re.finditer(r'循环次数: (\d+)\n执行时间: (.*?)\nDev/Port: (.*?)\nLink: (.*?)\n', content, re.DOTALL):
         # 解析端口和状态
         ports = match.group(3).strip().split()
@@ -46,26 +65,59 @@ def parse_all_port_status(log_file, target_ports):
             'time': match.group(2),
             'port_status': port_status
         })
-        
-        # 更新统计信息
-        for port in target_ports:
-            status = port_status.get(port, 'not_found')
-            if status.lower() == 'up':
-                port_stats[port]['up'] += 1
-            elif status.lower() == 'down':
-                port_stats[port]['down'] += 1
-            else:
-                port_stats[port]['not_found'] += 1
     
     if not all_records:
         print("错误：未找到端口状态记录")
         return None, None
     
-    return all_records, port_stats
+    return all_records, count_port_status(all_records, target_ports)
+
+def read_store_port_status(store_file, target_ports, cycles=None, since=None, until=None):
+    """
+    从结构化记录文件中读取端口状态记录，通过索引直接定位，不扫描整个文件
+    :param store_file: 记录文件路径（power_cycle_test.py --store）
+    :param target_ports: 要查询的端口列表
+    :param cycles: 只读取这些循环次数的记录，为None时读取全部
+    :param since: 只读取此时间（含）之后的记录，datetime或None
+    :param until: 只读取此时间（含）之前的记录，datetime或None
+    :return: 所有记录的端口状态列表和统计信息
+    """
+    if not os.path.exists(store_file):
+        print(f"错误：文件 {store_file} 不存在")
+        return None, None
+    
+    store = CycleStore(store_file, readonly=True)
+    if cycles is not None:
+        records = [record for record in map(store.find, cycles) if record is not None]
+    else:
+        records = store.between(since and since.timestamp(), until and until.timestamp())
+    
+    all_records = []
+    for record in records:
+        all_records.append({
+            'cycle': record['cycle'],
+            'time': record['time'],
+            'port_status': {port: status for port, status in record['links'].items() if port in target_ports}
+        })
+    
+    if not all_records:
+        print("错误：未找到端口状态记录")
+        return None, None
+    
+    return all_records, count_port_status(all_records, target_ports)
+
+def parse_time(text):
+    """解析命令行中的时间，格式为YYYY-MM-DD或YYYY-MM-DD HH:MM:SS"""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"无法解析的时间: {text}")
 
 def main():
     # 创建命令行参数解析器
-    parser = argparse.ArgumentParser(description='解析test.log文件中的端口link状态')
+    parser = argparse.ArgumentParser(description='解析test.log文件或结构化记录文件中的端口link状态')
     
     # 添加端口参数，允许用户指定要查询的端口
     parser.add_argument('-p', '--ports', nargs='+', default=['0/24', '0/25'],
@@ -75,8 +127,22 @@ def main():
     parser.add_argument('-f', '--file', default=os.path.join(os.getcwd(), 'test.log'),
                        help='日志文件路径，默认使用当前目录下的test.log')
     
+    # 添加结构化记录文件参数，指定后不再读取日志文件
+    parser.add_argument('-s', '--store',
+                       help='power_cycle_test.py --store写入的记录文件，指定后从该文件读取，不再解析日志文件')
+    parser.add_argument('--cycle', nargs='+', type=int,
+                       help='只查看这些循环次数的记录，需要与--store一起使用')
+    parser.add_argument('--since', type=parse_time,
+                       help='只查看此时间之后的记录，格式为YYYY-MM-DD或"YYYY-MM-DD HH:MM:SS"，需要与--store一起使用')
+    parser.add_argument('--until', type=parse_time,
+                       help='只查看此时间之前的记录，格式同--since，需要与--store一起使用')
+    
     # 解析参数
     args = parser.parse_args()
+    if not args.store and (args.cycle or args.since or args.until):
+        parser.error("--cycle、--since和--until需要与--store一起使用")
+    if args.cycle and (args.since or args.until):
+        parser.error("--cycle不能与--since、--until同时使用")
     
     # 目标端口
     target_ports = args.ports
@@ -85,7 +151,11 @@ def main():
     log_file = args.file
     
     # 解析所有端口状态记录和统计信息
-    all_records, port_stats = parse_all_port_status(log_file, target_ports)
+    if args.store:
+        all_records, port_stats = read_store_port_status(args.store, target_ports, args.cycle,
+                                                         args.since, args.until)
+    else:
+        all_records, port_stats = parse_all_port_status(log_file, target_ports)
     
     if all_records and port_stats:
         print("端口状态解析结果（所有记录）：")
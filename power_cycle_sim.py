@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import tty
+import random
+import select
+import argparse
+
+# 模拟环境的默认状态目录，伪mgmt_tool和伪串口通过其中的文件共享节点电源状态
+DEFAULT_STATE_DIR = '/tmp/power_cycle_sim'
+
+# 与被测交换机CLI一致的提示符和分页提示
+PROMPT = "Console#"
+PAGER_PROMPT = "Type <CR> to continue, Q<CR> to stop:"
+
+def read_power(state_dir, node):
+    """读取节点电源状态，返回('on'/'off', 最近一次变化的时间戳)，没有记录时视为早已上电"""
+    try:
+        with open(os.path.join(state_dir, f"power.{node}")) as f:
+            state, changed = f.read().split()
+            return state, float(changed)
+    except (OSError, ValueError):
+        return 'on', 0.0
+
+def write_power(state_dir, node, state):
+    """原子地写入节点电源状态"""
+    path = os.path.join(state_dir, f"power.{node}")
+    with open(path + '.tmp', 'w') as f:
+        f.write(f"{state} {time.time()}\n")
+    os.replace(path + '.tmp', path)
+
+def power_states(state_dir):
+    """返回状态目录中所有节点的{节点: (状态, 时间戳)}"""
+    states = {}
+    for name in os.listdir(state_dir):
+        if name.startswith('power.') and not name.endswith('.tmp'):
+            node = name.split('.', 1)[1]
+            states[node] = read_power(state_dir, node)
+    return states
+
+def run_mgmt(args):
+    """伪mgmt_tool：node power get|off|on -n N"""
+    words = args.words
+    if len(words) != 5 or words[:2] != ['node', 'power'] or words[3] != '-n' or words[2] not in ('get', 'off', 'on'):
+        print("用法: mgmt_tool node power get|off|on -n N", file=sys.stderr)
+        return 2
+    action, node = words[2], words[4]
+    time.sleep(args.delay)
+    if action == 'get':
+        state, _ = read_power(args.state, node)
+        print(f"node {node} power {state}")
+        return 0
+    if random.random() < args.fail_rate:
+        print(f"node {node} busy", file=sys.stderr)
+        return 1
+    write_power(args.state, node, action)
+    print(f"node {node} power {action} ok")
+    return 0
+
+class FakeSwitch:
+    """伪交换机串口CLI，运行在pty主设备一侧
+
+    所有节点上电并经过boot_delay秒之后才响应串口输入；每次上电都视为一次重启，
+    CLI的分页设置恢复为开启。端口链路状态在每次启动时按down_rate随机决定。
+    """
+
+    def __init__(self, state_dir, ports=48, boot_delay=15.0, page_lines=20, down_rate=0.02, baud=115200):
+        self.state_dir = state_dir
+        self.ports = ports
+        self.boot_delay = boot_delay
+        self.page_lines = page_lines
+        self.down_rate = down_rate
+        self.baud = baud
+        self.boot_id = None   # 当前这次启动的标识（最后一次上电的时间戳）
+        self.paging = True
+        self.pending = []     # 分页时尚未输出的行
+        self.line = b''
+        self.master = None
+
+    def booted(self):
+        """设备已上电并完成启动时返回启动标识，否则返回None"""
+        states = power_states(self.state_dir).values()
+        if any(state == 'off' for state, _ in states):
+            return None
+        boot_id = max((changed for _, changed in states), default=0.0)
+        if time.time() < boot_id + self.boot_delay:
+            return None
+        return boot_id
+
+    def write(self, text):
+        """按波特率限速写出，每个字节按10位计算"""
+        data = text.encode()
+        if self.baud:
+            time.sleep(len(data) * 10 / self.baud)
+        os.write(self.master, data)
+
+    def interface_lines(self):
+        """生成show interfaces status all的输出行，链路状态在同一次启动中保持不变"""
+        rng = random.Random(self.boot_id)
+        lines = [f"{'Port':<8}{'Type':<8}{'Link':<6}{'Speed':<8}{'Mode':<10}", '-' * 40]
+        for port in range(1, self.ports + 1):
+            link = 'Down' if rng.random() < self.down_rate else 'Up'
+            lines.append(f"{f'1/{port}':<8}{'10GBase':<8}{link:<6}{'10G':<8}{'Full':<10}")
+        return lines
+
+    def show_page(self):
+        """输出一页分页内容，输出完毕时显示提示符"""
+        page, self.pending = self.pending[:self.page_lines], self.pending[self.page_lines:]
+        self.write("".join(f"{line}\r\n" for line in page))
+        self.write(PAGER_PROMPT if self.pending else PROMPT)
+
+    def handle_line(self, line):
+        """处理一行输入"""
+        if self.pending:
+            # 分页中：Q停止输出，其他输入显示下一页
+            if line.strip().lower() == 'q':
+                self.pending = []
+                self.write(f"\r\n{PROMPT}")
+            else:
+                self.write("\r\n")
+                self.show_page()
+            return
+        command = ' '.join(line.split())
+        self.write("\r\n")
+        if not command:
+            self.write(PROMPT)
+        elif command == 'terminal length 0':
+            self.paging = False
+            self.write(PROMPT)
+        elif command == 'show interfaces status all':
+            lines = self.interface_lines()
+            if self.paging:
+                self.pending = lines
+                self.show_page()
+            else:
+                self.write("".join(f"{line}\r\n" for line in lines) + PROMPT)
+        else:
+            self.write(f"% Invalid input detected.\r\n{PROMPT}")
+
+    def serve(self, link=None):
+        """创建pty并一直处理串口输入，link不为空时创建指向pty从设备的符号链接"""
+        self.master, slave = os.openpty()
+        # 从设备保持原始模式且不关闭，测试脚本断开重连时主设备一侧不会收到挂断
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        if link:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(name, link)
+        print(f"伪串口: {link or name} -> {name}", flush=True)
+        try:
+            while True:
+                readable, _, _ = select.select([self.master], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(self.master, 1024)
+                boot_id = self.booted()
+                if boot_id is None:
+                    # 设备未上电或正在启动，丢弃输入
+                    self.line = b''
+                    self.pending = []
+                    continue
+                if boot_id != self.boot_id:
+                    # 重新启动后分页设置恢复默认
+                    self.boot_id = boot_id
+                    self.paging = True
+                    self.pending = []
+                for byte in data:
+                    char = bytes([byte])
+                    if char in (b'\r', b'\n'):
+                        line, self.line = self.line, b''
+                        self.handle_line(line.decode(errors='replace'))
+                    else:
+                        # 回显输入的字符
+                        self.line += char
+                        os.write(self.master, char)
+        finally:
+            if link and os.path.islink(link):
+                os.remove(link)
+
+def main():
+    parser = argparse.ArgumentParser(description='power_cycle_test.py的模拟环境：伪交换机串口和伪mgmt_tool')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    console = subparsers.add_parser('console', help='在pty上运行伪交换机CLI')
+    console.add_argument('--state', default=DEFAULT_STATE_DIR, help=f'状态目录，默认为{DEFAULT_STATE_DIR}')
+    console.add_argument('--link', help='创建指向pty从设备的符号链接，作为--console-device使用')
+    console.add_argument('--ports', type=int, default=48, help='端口数量，默认为48')
+    console.add_argument('--boot-delay', type=float, default=15, help='上电后到出现提示符的秒数，默认为15')
+    console.add_argument('--page-lines', type=int, default=20, help='开启分页时每页的行数，默认为20')
+    console.add_argument('--down-rate', type=float, default=0.02, help='每次启动时每个端口链路为Down的概率，默认为0.02')
+    console.add_argument('--baud', type=int, default=115200, help='模拟的串口波特率，0表示不限速，默认为115200')
+
+    mgmt = subparsers.add_parser('mgmt', help='伪mgmt_tool，用法与mgmt_tool相同')
+    mgmt.add_argument('--state', default=DEFAULT_STATE_DIR, help=f'状态目录，默认为{DEFAULT_STATE_DIR}')
+    mgmt.add_argument('--delay', type=float, default=1.0, help='每次调用的耗时（秒），默认为1')
+    mgmt.add_argument('--fail-rate', type=float, default=0.0, help='下电/上电命令失败的概率，默认为0')
+    mgmt.add_argument('words', nargs=argparse.REMAINDER, help='node power get|off|on -n N')
+
+    args = parser.parse_args()
+    os.makedirs(args.state, exist_ok=True)
+    if args.command == 'mgmt':
+        return run_mgmt(args)
+    switch = FakeSwitch(args.state, args.ports, args.boot_delay, args.page_lines, args.down_rate, args.baud)
+    try:
+        switch.serve(args.link)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,11 +3,22 @@
 import subprocess
 import time
 import pexpect
+import pexpect.fdpexpect
 import re
 from datetime import datetime
 import sys
 import logging
 import argparse
+import shlex
+import json
+import threading
+import tty
+import termios
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from cycle_store import CycleStore, port_sort_key
+from cycle_metrics import CycleMetrics
 
 # 配置日志输出
 logging.basicConfig(
@@ -21,6 +32,705 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class DutLogFilter(logging.Filter):
+    """多个DUT同时运行时，在日志前加上DUT名称
+    
+    DUT线程命名为dut:<名称>，其中创建的线程名称以所在线程的名称开头，据此找到DUT名称。
+    """
+    
+    def filter(self, record):
+        thread_name = threading.current_thread().name
+        if thread_name.startswith('dut:'):
+            record.msg = f"[{thread_name.split(':')[1]}] {record.msg}"
+        return True
+
+logger.addFilter(DutLogFilter())
+
+# 电源操作的名称
+POWER_ACTIONS = {'off': '下电', 'on': '上电'}
+
+# 单个节点电源操作的结果
+POWER_DONE = 'done'        # 命令执行成功
+POWER_SKIPPED = 'skipped'  # 节点已处于目标状态
+POWER_FAILED = 'failed'    # 重试后仍然失败
+
+# 批量查询输出中每个节点结果之前的标记行：标记、节点编号、返回码
+BATCH_MARK = '@@mgmt_tool'
+
+def parse_power_state(text):
+    """从mgmt_tool的输出中取出电源状态，返回'on'、'off'或None"""
+    if "power off" in text:
+        return 'off'
+    if "power on" in text:
+        return 'on'
+    return None
+
+class MgmtLimiter:
+    """管理控制器限流，多个DUT的NodeControl共用
+    
+    限制同时执行的mgmt_tool调用数，以及每秒发起的调用数。
+    批量查询中的每个节点都计为一次调用。
+    """
+    
+    def __init__(self, concurrency=0, rate=0):
+        """
+        Args:
+            concurrency: 同时执行的调用数上限，0表示不限制
+            rate: 每秒发起的调用数上限，0表示不限制
+        """
+        self.capacity = concurrency
+        self.interval = 1 / rate if rate > 0 else 0
+        self._available = concurrency
+        self._next_start = 0.0
+        self._cond = threading.Condition()
+    
+    def acquire(self, count=1):
+        """等待到可以发起count次调用，返回实际占用的调用数（不超过同时调用数上限）"""
+        with self._cond:
+            if self.capacity:
+                count = min(count, self.capacity)
+                while self._available < count:
+                    self._cond.wait()
+                self._available -= count
+            # 按速率上限为本次调用安排发起时间
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval * count
+        if start > now:
+            time.sleep(start - now)
+        return count
+    
+    def release(self, count=1):
+        """调用结束后归还acquire()返回的调用数"""
+        if self.capacity:
+            with self._cond:
+                self._available += count
+                self._cond.notify_all()
+
+class NodeControl:
+    """节点电源控制，封装mgmt_tool调用并缓存各节点的电源状态
+    
+    缓存由查询结果和执行成功的下电/上电命令更新，命令失败时清除该节点的缓存，
+    下次使用前重新查询。多个节点的状态查询合并为一个sh子进程，
+    在其中并发调用mgmt_tool，避免每个节点各启动一次子进程。
+    可以在多个线程中同时使用。
+    """
+    
+    def __init__(self, mgmt_tool, limiter=None):
+        """
+        Args:
+            mgmt_tool: 管理命令，可以带参数
+            limiter: MgmtLimiter管理控制器限流，默认不限制
+        """
+        self.mgmt_tool = mgmt_tool
+        self.limiter = limiter or MgmtLimiter()
+        self.states = {}     # 节点 -> 'on'/'off'
+        self.launches = 0    # 启动的子进程数
+        self.queries = 0     # 批量查询次数
+        self._lock = threading.Lock()
+    
+    def _launched(self, queries=0):
+        with self._lock:
+            self.launches += 1
+            self.queries += queries
+    
+    def state(self, node):
+        """返回缓存的节点电源状态，未知时为None"""
+        return self.states.get(node)
+    
+    def run(self, action, node):
+        """执行一次mgmt_tool node power命令，根据结果更新缓存
+        
+        Args:
+            action: 'get'、'off'或'on'
+            node: 节点编号
+        
+        Returns:
+            subprocess.CompletedProcess
+        """
+        command = shlex.split(self.mgmt_tool) + ['node', 'power', action, '-n', str(node)]
+        held = self.limiter.acquire()
+        try:
+            self._launched()
+            result = subprocess.run(command, check=False, capture_output=True, text=True)
+        finally:
+            self.limiter.release(held)
+        if result.returncode != 0:
+            self.states.pop(node, None)
+        elif action == 'get':
+            self.states[node] = parse_power_state(result.stdout)
+        else:
+            self.states[node] = action
+        return result
+    
+    def query(self, nodes):
+        """用一个子进程查询多个节点的电源状态并更新缓存
+        
+        Returns:
+            dict: {节点: (返回码, 输出)}，输出中合并了标准错误
+        """
+        nodes = list(nodes)
+        results = {}
+        # 有同时调用数上限时分批查询，每批不超过上限
+        batch = self.limiter.capacity or len(nodes) or 1
+        for index in range(0, len(nodes), batch):
+            results.update(self._query_batch(nodes[index:index + batch]))
+        for node in nodes:
+            code, output = results.get(node, (None, "没有输出"))
+            if code == 0:
+                self.states[node] = parse_power_state(output)
+            else:
+                self.states.pop(node, None)
+                logger.warning("获取节点 %d 状态失败: %s", node, output)
+        return results
+    
+    def _query_batch(self, nodes):
+        tool = " ".join(shlex.quote(word) for word in shlex.split(self.mgmt_tool))
+        # 每个节点在后台子shell中查询，输出先保存到变量，再连同标记一次写出，避免各节点的输出交错
+        script = "".join(f"(out=$({tool} node power get -n {int(node)} 2>&1); rc=$?; "
+                         f"printf '{BATCH_MARK} %s %s\\n%s\\n' {int(node)} $rc \"$out\") &\n"
+                         for node in nodes) + "wait\n"
+        held = self.limiter.acquire(len(nodes))
+        try:
+            self._launched(queries=1)
+            completed = subprocess.run(['sh', '-c', script], check=False, capture_output=True, text=True)
+        finally:
+            self.limiter.release(held)
+        
+        results = {}
+        node = None
+        for line in completed.stdout.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == BATCH_MARK:
+                node = int(fields[1])
+                results[node] = (int(fields[2]), [])
+            elif node is not None:
+                results[node][1].append(line)
+        return {node: (code, "\n".join(lines).strip()) for node, (code, lines) in results.items()}
+
+def power_node(node, action, control, max_retries=3):
+    """对单个节点执行下电或上电，节点已处于目标状态时跳过，失败时重试
+    
+    Args:
+        node: 节点编号
+        action: 'off'或'on'
+        control: NodeControl节点电源控制
+        max_retries: 最多尝试次数
+    
+    Returns:
+        dict: 节点、操作、结果、尝试次数、耗时（秒）和最后一次输出
+    """
+    name = POWER_ACTIONS[action]
+    start = time.monotonic()
+    result = {'node': node, 'action': action, 'status': POWER_FAILED, 'attempts': 0, 'elapsed': 0.0, 'message': ''}
+    
+    # 先检查节点当前状态，优先使用缓存，缓存中没有时才查询
+    if control.state(node) is None:
+        try:
+            status_result = control.run('get', node)
+            if status_result.returncode != 0:
+                logger.warning("获取节点 %d 状态失败: %s", node, status_result.stderr.strip())
+        except Exception as e:
+            logger.error("获取节点 %d 状态时发生异常: %s", node, e)
+    state = control.state(node)
+    if state is not None:
+        logger.info("节点 %d 当前状态: power %s", node, state)
+        if state == action:
+            logger.info("节点 %d 已处于%s状态，跳过%s操作", node, name, name)
+            result.update(status=POWER_SKIPPED, message=f"power {state}", elapsed=time.monotonic() - start)
+            return result
+    
+    logger.info("节点 %d 执行命令: %s node power %s -n %d", node, control.mgmt_tool, action, node)
+    
+    # 添加重试机制
+    retry_count = 0
+    while retry_count < max_retries:
+        result['attempts'] += 1
+        try:
+            command_result = control.run(action, node)
+            if command_result.returncode == 0:
+                logger.info("节点 %d SUCCEED: %s", node, command_result.stdout.strip())
+                result.update(status=POWER_DONE, message=command_result.stdout.strip())
+                break
+            logger.warning("节点 %d FAILED: 命令返回状态码 %d", node, command_result.returncode)
+            logger.warning("节点 %d 错误输出: %s", node, command_result.stderr.strip())
+            result['message'] = command_result.stderr.strip()
+            retry_count += 1
+            
+            if retry_count < max_retries:
+                # 下电第二次失败时，先再发一次下电命令，等待后再重试
+                if action == 'off' and retry_count == 2:
+                    logger.info("尝试下电节点 %d 后再下电...", node)
+                    reset_result = control.run('off', node)
+                    logger.info("节点 %d 下电命令结果: %s", node, reset_result.stdout.strip())
+                    time.sleep(5)
+                
+                logger.info("节点 %d 等待3秒后重试 (%d/%d)...", node, retry_count, max_retries)
+                time.sleep(3)
+        except Exception as e:
+            logger.error("节点 %d 执行命令时发生异常: %s", node, e)
+            result['message'] = str(e)
+            retry_count += 1
+            if retry_count < max_retries:
+                logger.info("节点 %d 等待3秒后重试 (%d/%d)...", node, retry_count, max_retries)
+                time.sleep(3)
+    
+    if result['status'] == POWER_FAILED:
+        # 不抛出异常，其他节点照常处理
+        logger.warning("警告: 节点 %d %s失败", node, name)
+    result['elapsed'] = time.monotonic() - start
+    return result
+
+def run_power_phase(nodes, action, control, parallel=0):
+    """对所有节点并发执行下电或上电，整个阶段的耗时约等于最慢节点的耗时
+    
+    Args:
+        nodes: 节点列表
+        action: 'off'或'on'
+        control: NodeControl节点电源控制
+        parallel: 同时操作的节点数上限，0表示所有节点同时操作
+    
+    Returns:
+        list: 按nodes顺序排列的各节点结果，格式见power_node()
+    """
+    if not nodes:
+        return []
+    start = time.monotonic()
+    workers = len(nodes) if parallel <= 0 else min(parallel, len(nodes))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{threading.current_thread().name}:power-{action}") as executor:
+        results = list(executor.map(lambda node: power_node(node, action, control), nodes))
+    
+    counts = Counter(result['status'] for result in results)
+    logger.info("%s阶段完成: 成功 %d 个, 跳过 %d 个, 失败 %d 个, 耗时 %.1f 秒", POWER_ACTIONS[action],
+                counts[POWER_DONE], counts[POWER_SKIPPED], counts[POWER_FAILED], time.monotonic() - start)
+    for result in results:
+        if result['status'] == POWER_FAILED:
+            logger.warning("节点 %d %s失败（尝试 %d 次，耗时 %.1f 秒）: %s", result['node'], POWER_ACTIONS[action],
+                           result['attempts'], result['elapsed'], result['message'])
+    return results
+
+# 串口终端的命令提示符和分页提示
+CONSOLE_PROMPT = "Console#"
+PAGER_PROMPT = "Type <CR> to continue, Q<CR> to stop:"
+# 关闭CLI分页的命令，每次设备重启后执行一次
+PAGING_COMMAND = "terminal length 0"
+
+class ConsoleSession:
+    """长期保持的串口终端会话
+    
+    直接用termios把串口设置为原始模式，交给pexpect.fdpexpect读写，
+    不再每次循环启动和强制结束picocom。读写出错（例如串口被拔出或模拟器重启）时关闭串口，
+    下一次使用时自动重新打开。设备重启后CLI的分页设置会恢复默认，
+    因此上电后调用device_rebooted()，下一条命令执行前再关闭一次分页。
+    """
+    
+    def __init__(self, device, baudrate=115200, prompt=CONSOLE_PROMPT, paging_command=PAGING_COMMAND):
+        """
+        Args:
+            device: 串口设备路径
+            baudrate: 波特率
+            prompt: 命令提示符
+            paging_command: 关闭分页的命令，为空时不发送（遇到分页提示时仍会逐页继续）
+        """
+        self.device = device
+        self.baudrate = baudrate
+        self.prompt = prompt
+        self.paging_command = paging_command
+        self.child = None
+        self.paging_disabled = False
+        self.opens = 0
+    
+    def open(self):
+        """打开串口并设置为原始模式和指定波特率"""
+        fd = os.open(self.device, os.O_RDWR | os.O_NOCTTY)
+        try:
+            tty.setraw(fd)
+            attrs = termios.tcgetattr(fd)
+            attrs[2] |= termios.CLOCAL | termios.CREAD
+            attrs[4] = attrs[5] = getattr(termios, f"B{self.baudrate}")
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except Exception:
+            os.close(fd)
+            raise
+        self.child = pexpect.fdpexpect.fdspawn(fd, timeout=30)
+        self.opens += 1
+        if self.opens > 1:
+            logger.info("已重新打开串口 %s（第 %d 次）", self.device, self.opens)
+        # 重新打开后无法确认设备端的分页设置，重新关闭一次
+        self.paging_disabled = False
+    
+    def close(self):
+        """关闭串口，下一次使用时重新打开"""
+        if self.child is not None:
+            try:
+                self.child.close()
+            except OSError:
+                pass
+            self.child = None
+    
+    def device_rebooted(self):
+        """设备重启后调用，下一条命令执行前重新关闭分页"""
+        self.paging_disabled = False
+    
+    def probe(self, timeout=3):
+        """发送回车，timeout秒内出现提示符时返回True
+        
+        串口打开失败或读写出错时返回False，下一次调用时重新打开。
+        """
+        try:
+            if self.child is None:
+                self.open()
+            self._drain()
+            self.child.sendline("")
+            self.child.expect_exact(self.prompt, timeout=timeout)
+            return True
+        except pexpect.TIMEOUT:
+            return False
+        except (pexpect.EOF, OSError) as e:
+            logger.debug("串口 %s 不可用: %s", self.device, e)
+            self.close()
+            return False
+    
+    def run(self, command, timeout=30, sink=None):
+        """执行一条命令，返回提示符之前的全部输出（包含命令回显）
+        
+        Args:
+            command: 命令
+            timeout: 等待提示符和每一页输出的超时时间（秒）
+            sink: 有write()方法的对象，串口每收到一段命令输出就立即写入，用于边接收边解析
+        
+        Raises:
+            pexpect.TIMEOUT: timeout秒内没有出现提示符
+            pexpect.EOF: 串口读写出错
+        """
+        if not self.probe(timeout):
+            if self.child is None:
+                raise pexpect.EOF(f"无法打开串口 {self.device}")
+            raise pexpect.TIMEOUT(f"串口终端没有出现提示符 {self.prompt}")
+        if not self.paging_disabled and self.paging_command:
+            self._execute(self.paging_command, timeout)
+            self.paging_disabled = True
+            logger.info("已关闭CLI分页: %s", self.paging_command)
+        return self._execute(command, timeout, sink)
+    
+    def _drain(self):
+        """丢弃之前残留的输出（例如启动信息和多余的提示符）"""
+        self.child.expect([pexpect.TIMEOUT], timeout=0.1)
+    
+    def _execute(self, command, timeout, sink=None):
+        self._drain()
+        # pexpect每次从串口读到数据都会写入logfile_read
+        self.child.logfile_read = sink
+        chunks = []
+        try:
+            self.child.sendline(command)
+            while True:
+                try:
+                    index = self.child.expect_exact([PAGER_PROMPT, self.prompt], timeout=timeout)
+                except pexpect.TIMEOUT:
+                    logger.warning("命令执行超时: %s", command)
+                    break
+                chunks.append(self.child.before)
+                if index == 1:
+                    break
+                # 分页没有关闭（例如设备重启后分页设置恢复默认），按回车继续，下一条命令前重新关闭分页
+                self.paging_disabled = False
+                self.child.sendline("")
+        finally:
+            self.child.logfile_read = None
+        return b"".join(chunks).decode(errors='replace')
+
+# 端口状态行：Dev/Port、类型、Link状态，之后还有其他列
+PORT_LINE_PATTERN = re.compile(rb'^(\d+/\d+)\s+\S+\s+(Up|Down)\s+')
+# 基线文件中的端口状态行：Dev/Port和Link状态
+BASELINE_LINE_PATTERN = re.compile(r'^(\d+/\d+)\s+(Up|Down)\b')
+
+class PortStatusParser:
+    """增量解析show interfaces status的输出
+    
+    作为ConsoleSession.run()的sink使用，串口每收到一段数据就解析其中完整的行，
+    不需要先拼接出全部输出。每解析出一个端口就与上一次循环和基线比较，
+    由Up变为Down的端口立即记录警告。
+    """
+    
+    def __init__(self, previous=None, baseline=None):
+        """
+        Args:
+            previous: 上一次循环的{端口: 'Up'/'Down'}
+            baseline: 基线的{端口: 'Up'/'Down'}
+        """
+        self.links = {}
+        self.previous = previous or {}
+        self.references = [(name, reference) for name, reference in (("上一次循环", previous), ("基线", baseline))
+                           if reference]
+        self.regressions = []  # [(端口, 比较对象, 原状态, 现状态), ...]
+        self.elapsed = 0.0     # 解析累计耗时（秒），不包括等待串口输出的时间
+        self._partial = b''
+    
+    def write(self, data):
+        start = time.monotonic()
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+        self.elapsed += time.monotonic() - start
+    
+    def flush(self):
+        pass
+    
+    def _parse_line(self, line):
+        match = PORT_LINE_PATTERN.match(line.strip())
+        if not match:
+            return
+        port, link = match.group(1).decode(), match.group(2).decode()
+        self.links[port] = link
+        if link == 'Down':
+            names = [name for name, reference in self.references if reference.get(port) == 'Up']
+            if names:
+                self.regressions.extend((port, name, 'Up', link) for name in names)
+                logger.warning("端口 %s 由Up变为Down（与%s相比）", port, "、".join(names))
+        elif self.previous.get(port) == 'Down':
+            logger.info("端口 %s 由Down恢复为Up", port)
+    
+    def close(self):
+        """输出结束后调用：解析最后一行，并检查比较对象中为Up、本次却没有出现的端口"""
+        start = time.monotonic()
+        try:
+            self._check_missing()
+        finally:
+            self.elapsed += time.monotonic() - start
+    
+    def _check_missing(self):
+        if self._partial:
+            self._parse_line(self._partial)
+            self._partial = b''
+        if not self.links:
+            return
+        for name, reference in self.references:
+            for port, before in reference.items():
+                if before == 'Up' and port not in self.links:
+                    self.regressions.append((port, name, before, None))
+                    logger.warning("端口 %s 没有出现在输出中（%s中为Up）", port, name)
+
+def load_baseline(path):
+    """读取基线文件，每行为'端口 状态'（例如'1/1 Up'），#之后为注释
+    
+    Returns:
+        dict: {端口: 'Up'/'Down'}
+    """
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            match = BASELINE_LINE_PATTERN.match(line.split('#', 1)[0].strip())
+            if match:
+                baseline[match.group(1)] = match.group(2)
+    logger.info("从 %s 读取了 %d 个端口的基线状态", path, len(baseline))
+    return baseline
+
+# 就绪检查的轮询间隔（秒）：从初始间隔开始按倍数增大，不超过最大间隔
+READY_POLL_INITIAL = 1.0
+READY_POLL_MAX = 5.0
+READY_POLL_BACKOFF = 1.5
+
+def check_power_on(nodes, control):
+    """所有节点的电源状态都为上电时返回True，各节点的状态在一个子进程中查询"""
+    try:
+        control.query(nodes)
+    except Exception as e:
+        logger.debug("查询节点状态时发生异常: %s", e)
+        return False
+    return all(control.state(node) == 'on' for node in nodes)
+
+def check_pingable(hosts):
+    """所有主机都能ping通时返回True"""
+    for host in hosts:
+        result = subprocess.run(['ping', '-c', '1', '-W', '1', host], check=False,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return False
+    return True
+
+# 可选的就绪检查及其说明
+READY_CHECKS = {'power': "电源状态", 'console': "串口提示符", 'ping': "主机ping通"}
+
+def build_ready_checks(args, nodes, console, control):
+    """按命令行参数生成[(说明, 检查函数), ...]"""
+    checks = []
+    for name in dict.fromkeys(args.ready_check):
+        if name == 'power':
+            check = lambda: check_power_on(nodes, control)
+        elif name == 'console':
+            check = lambda: console.probe(timeout=1)
+        else:
+            check = lambda: check_pingable(args.ready_host)
+        checks.append((READY_CHECKS[name], check))
+    return checks
+
+def wait_until_ready(checks, timeout, progress=True):
+    """轮询就绪检查直到全部满足，轮询间隔逐渐增大
+    
+    已经满足的检查不再重复执行。等待过程在同一行显示已等待时间和尚未满足的检查。
+    
+    Args:
+        checks: [(说明, 检查函数), ...]，检查函数返回是否就绪
+        timeout: 最长等待时间（秒）
+        progress: 是否在终端显示等待状态（多个DUT同时运行时关闭，避免输出互相覆盖）
+    
+    Returns:
+        float: 从开始等待到全部就绪的秒数，超时返回None
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = list(checks)
+    interval = READY_POLL_INITIAL
+    shown = False
+    try:
+        while True:
+            pending = [(label, check) for label, check in pending if not check()]
+            elapsed = time.monotonic() - start
+            if not pending:
+                if shown:
+                    print()
+                return elapsed
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if shown:
+                    print()
+                logger.warning("未就绪的检查: %s", ", ".join(label for label, _ in pending))
+                return None
+            if progress:
+                # 使用回车符清除当前行并显示等待状态，不换行
+                print(f"\r等待就绪: {', '.join(label for label, _ in pending)} ({elapsed:.0f}/{timeout}秒)",
+                      end="", flush=True)
+                shown = True
+            time.sleep(min(interval, remaining))
+            interval = min(interval * READY_POLL_BACKOFF, READY_POLL_MAX)
+    except KeyboardInterrupt:
+        if shown:
+            print()  # 先换行，确保错误信息显示在新行
+        logger.info("用户中断了等待过程")
+        raise
+
+def save_checkpoint(path, state):
+    """原子地写入检查点：先写入临时文件并同步到磁盘，再替换原文件
+    
+    Args:
+        path: 检查点文件路径
+        state: 可序列化为JSON的检查点内容
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    # 同步目录，确保替换本身也已写入磁盘
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def load_checkpoint(path, nodes, store):
+    """读取检查点，并补上已写入记录文件、但在检查点更新之前中断的那次循环
+    
+    Args:
+        path: 检查点文件路径
+        nodes: 本次要操作的节点列表，必须与检查点中的一致
+        store: CycleStore循环记录
+    
+    Returns:
+        dict: 检查点内容，文件不存在时返回None
+    
+    Raises:
+        ValueError: 检查点格式错误或节点列表不一致
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    try:
+        if state['nodes'] != list(nodes):
+            raise ValueError(f"检查点中的节点 {state['nodes']} 与本次的节点 {list(nodes)} 不一致")
+        state['unrecorded'] = list(state['unrecorded'])
+        # 检查点之后写入记录文件的记录中，紧接着已完成循环的那些循环也已完成
+        for position in range(state['store_records'], len(store)):
+            record = store.record_at(position)
+            if record['cycle'] != state['completed'] + 1:
+                break
+            state['completed'] = record['cycle']
+            state['previous_links'] = record['links'] or state['previous_links']
+            state['baseline_links'] = state['baseline_links'] or record['links'] or None
+            state['store_records'] = position + 1
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"检查点格式错误: {e}")
+    return state
+
+# 只能在活动配置顶层设置、不能按DUT设置的参数
+CAMPAIGN_GLOBAL_KEYS = {'mgmt_concurrency', 'mgmt_rate'}
+# 每个DUT各自写入的文件，DUT配置中没有设置时在文件名中加上DUT名称，例如test.log -> test.dut1.log
+CAMPAIGN_PER_DUT_FILES = ('output', 'store', 'checkpoint', 'metrics_jsonl', 'metrics_prom')
+
+def apply_overrides(args, overrides, where):
+    """用配置中的设置覆盖参数，返回新的参数对象，配置项名称与命令行参数相同（-可写为_）"""
+    values = dict(vars(args))
+    for key, value in overrides.items():
+        dest = key.replace('-', '_')
+        if dest not in values or dest == 'campaign':
+            raise ValueError(f"{where}中有未知的配置项: {key}")
+        values[dest] = value
+    return argparse.Namespace(**values)
+
+def load_campaign(path, args):
+    """读取活动配置（JSON）
+    
+    顶层的duts为DUT列表，每个DUT可设置name、nodes、console_device、output、store等参数；
+    顶层其余配置项作为所有DUT的默认值。未在配置中出现的参数使用命令行参数。
+    DUT配置中没有设置的输出、记录、检查点和耗时文件在文件名中加上DUT名称，各DUT分别写入。
+    
+    Returns:
+        list: [(名称, 参数), ...]
+    
+    Raises:
+        ValueError: 配置格式错误，或多个DUT使用了同一个串口或同一个输出、记录、检查点、耗时文件
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or not config.get('duts'):
+        raise ValueError(f"{path} 中没有duts列表")
+    defaults = {key: value for key, value in config.items() if key != 'duts'}
+    base = apply_overrides(args, defaults, "活动配置")
+    
+    duts = []
+    for index, dut in enumerate(config['duts'], 1):
+        dut = dict(dut)
+        name = str(dut.pop('name', f"dut{index}"))
+        where = f"DUT {name} 的配置"
+        for key in dut:
+            if key.replace('-', '_') in CAMPAIGN_GLOBAL_KEYS:
+                raise ValueError(f"{where}中不能设置{key}，只能在活动配置顶层设置")
+        dut_args = apply_overrides(base, dut, where)
+        configured = {key.replace('-', '_') for key in dut}
+        for key in CAMPAIGN_PER_DUT_FILES:
+            value = getattr(dut_args, key)
+            if value and key not in configured:
+                root, ext = os.path.splitext(value)
+                setattr(dut_args, key, f"{root}.{name}{ext}")
+        if not hasattr(termios, f"B{dut_args.baudrate}"):
+            raise ValueError(f"{where}中不支持的波特率: {dut_args.baudrate}")
+        duts.append((name, dut_args))
+    
+    for key, label in (('console_device', "串口"), ('output', "输出文件"), ('store', "记录文件"),
+                       ('checkpoint', "检查点文件"), ('metrics_jsonl', "耗时记录文件"),
+                       ('metrics_prom', "Prometheus指标文件")):
+        seen = Counter(getattr(dut_args, key) for _, dut_args in duts if getattr(dut_args, key) is not None)
+        shared = [value for value, count in seen.items() if count > 1]
+        if shared:
+            raise ValueError(f"多个DUT使用了同一个{label}: {', '.join(map(str, shared))}")
+    names = Counter(name for name, _ in duts)
+    if any(count > 1 for count in names.values()):
+        raise ValueError("DUT名称重复")
+    return duts
+
 def parse_arguments():
     """
     解析命令行参数
@@ -39,341 +749,431 @@ def parse_arguments():
     parser.add_argument('--single-cycle', action='store_true',
                        help='只执行一次循环')
     
-    return parser.parse_args()
-
-def main():
-    # 解析命令行参数
-    args = parse_arguments()
+    # 添加并发参数
+    parser.add_argument('--parallel', type=int, default=0,
+                       help='下电/上电时同时操作的节点数上限，0表示所有节点同时操作，默认为0')
     
-    # 确定循环次数
-    cycles = 1 if args.single_cycle else args.cycles
+    # 添加管理工具参数，便于替换为测试用的模拟程序
+    parser.add_argument('--mgmt-tool', default='mgmt_tool',
+                       help='节点电源管理命令，默认为PATH中的mgmt_tool')
     
-    # 获取要操作的节点列表
-    target_nodes = args.nodes
+    # 添加串口参数
+    parser.add_argument('--console-device', default='/dev/ttyS6',
+                       help='交换机串口设备，默认为/dev/ttyS6')
+    parser.add_argument('--baudrate', type=int, default=115200,
+                       help='串口波特率，默认为115200')
+    parser.add_argument('--paging-command', default=PAGING_COMMAND,
+                       help=f'关闭CLI分页的命令，设备每次重启后执行一次，为空时逐页读取，默认为"{PAGING_COMMAND}"')
+    
+    # 添加端口状态比较参数
+    parser.add_argument('--baseline',
+                       help='端口状态基线文件，每行为"端口 状态"（例如"1/1 Up"），默认以第一次循环的结果为基线')
+    parser.add_argument('--on-regression', choices=['log', 'retry', 'abort'], default='log',
+                       help='端口由Up变为Down时的处理：log只记录，retry等待后重新读取端口状态，'
+                            'abort保存本次结果后停止测试，默认为log')
+    parser.add_argument('--regression-retries', type=int, default=2,
+                       help='retry时最多重新读取的次数，默认为2')
+    parser.add_argument('--regression-wait', type=int, default=5,
+                       help='retry时每次重新读取前等待的秒数，默认为5')
+    
+    # 添加输出文件参数
+    parser.add_argument('--store', default='/share/cycles.jsonl',
+                       help='结构化的循环记录文件（JSONL，另有同名.idx索引文件），可用parse_port_status.py --store读取，'
+                            '默认为/share/cycles.jsonl')
+    parser.add_argument('--store-flush', type=int, default=10,
+                       help='每记录多少次循环将记录文件刷新并同步到磁盘，检查点随之更新，异常中断时最多需要重做这么多次循环'
+                            '（正常结束或按Ctrl+C时会先刷新），默认为10')
+    parser.add_argument('--output', default='/share/test.log',
+                       help='文本格式的端口状态记录文件（兼容旧版），默认为/share/test.log')
+    parser.add_argument('--no-legacy-log', action='store_true',
+                       help='不写入文本格式的端口状态记录文件，只写入--store')
     
-    # 循环执行指定次数
-    for cycle in range(1, cycles + 1):
-        logger.info("=== 开始第 %d 次循环 ===", cycle)
+    # 添加断点续测参数
+    parser.add_argument('--checkpoint',
+                       help='检查点文件，记录文件刷新后记录已完成的循环、端口状态和各节点的失败次数，'
+                            '默认为--store加.checkpoint后缀')
+    parser.add_argument('--resume', action='store_true',
+                       help='从检查点中最后完成的循环之后继续测试，循环次数接着检查点编号，没有检查点时从第1次开始')
+    
+    # 添加耗时统计参数
+    parser.add_argument('--metrics-jsonl', default='/share/cycle_metrics.jsonl',
+                       help='每次循环各阶段和各节点耗时的记录文件（JSONL），为空时不写入，默认为/share/cycle_metrics.jsonl')
+    parser.add_argument('--metrics-prom',
+                       help='Prometheus textfile路径（例如node_exporter textfile目录下的power_cycle.prom），'
+                            '每次循环后更新各阶段耗时的直方图，默认不写入')
+    
+    # 添加多DUT活动参数
+    parser.add_argument('--campaign',
+                       help='活动配置文件（JSON），duts中列出多个DUT及各自的nodes、console_device、output、store等参数，'
+                            '各DUT同时独立执行')
+    parser.add_argument('--mgmt-concurrency', type=int, default=0,
+                       help='所有DUT合计同时执行的mgmt_tool调用数上限，0表示不限制，默认为0')
+    parser.add_argument('--mgmt-rate', type=float, default=0,
+                       help='所有DUT合计每秒发起的mgmt_tool调用数上限，0表示不限制，默认为0')
+    
+    # 添加启动就绪检查参数
+    parser.add_argument('--ready-check', action='append', choices=list(READY_CHECKS),
+                       help='上电后判断系统就绪的信号，可重复指定，全部满足才继续：'
+                            'power为所有节点电源状态为上电，console为串口出现Console#提示符，'
+                            'ping为--ready-host中的主机都能ping通，默认为console')
+    parser.add_argument('--ready-host', action='append', default=[],
+                       help='ping就绪检查的主机地址，可重复指定')
+    parser.add_argument('--boot-timeout', type=int, default=120,
+                       help='等待系统就绪的最长时间（秒），默认为120秒')
+    
+    args = parser.parse_args()
+    if args.ready_check is None:
+        args.ready_check = ['console']
+    if not hasattr(termios, f"B{args.baudrate}"):
+        parser.error(f"不支持的波特率: {args.baudrate}")
+    if 'ping' in args.ready_check and not args.ready_host:
+        parser.error("--ready-check ping 需要用 --ready-host 指定主机")
+    if args.store_flush < 1:
+        parser.error("--store-flush 必须大于0")
+    return args
+
+def write_legacy_record(path, cycle, interfaces):
+    """以旧版文本格式追加一次循环的端口状态，格式与旧版完全相同（启动时间只记录在--store中）
+    
+    Args:
+        path: 文本记录文件路径
+        cycle: 循环次数
+        interfaces: [(端口, 状态), ...]
+    """
+    with open(path, "a") as f:
+        # 写入循环次数和执行时间
+        f.write(f"循环次数: {cycle}\n")
+        f.write(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         
-        # 1. 执行电源下电操作
-        logger.info("执行电源下电操作...")
-        for node in target_nodes:
-            # 先检查节点当前状态
-            status_cmd = f"mgmt_tool node power get -n {node}"
-            try:
-                status_result = subprocess.run(status_cmd, shell=True, check=False, capture_output=True, text=True)
-                if status_result.returncode == 0:
-                    logger.info("节点 %d 当前状态: %s", node, status_result.stdout.strip())
-                    if "power off" in status_result.stdout:
-                        logger.info("节点 %d 已处于下电状态，跳过下电操作", node)
-                        continue
-                else:
-                    logger.warning("获取节点 %d 状态失败: %s", node, status_result.stderr.strip())
-            except Exception as e:
-                logger.error("获取节点 %d 状态时发生异常: %s", node, e)
-            
-            # 尝试下电
-            off_cmd = f"mgmt_tool node power off -n {node}"
-            logger.info("执行命令: %s", off_cmd)
-            
-            # 添加重试机制
-            retry_count = 0
-            max_retries = 3
-            success = False
-            
-            while retry_count < max_retries and not success:
-                try:
-                    result = subprocess.run(off_cmd, shell=True, check=False, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        logger.info("SUCCEED: %s", result.stdout.strip())
-                        success = True
-                    else:
-                        logger.warning("FAILED: 命令返回状态码 %d", result.returncode)
-                        logger.warning("错误输出: %s", result.stderr.strip())
-                        retry_count += 1
-                        
-                        if retry_count < max_retries:
-                            # 尝试先重置节点，再下电
-                            if retry_count == 2:
-                                logger.info("尝试下电节点 %d 后再下电...", node)
-                                reset_cmd = f"mgmt_tool node power off -n {node}"
-                                reset_result = subprocess.run(reset_cmd, shell=True, check=False, capture_output=True, text=True)
-                                logger.info("下电命令结果: %s", reset_result.stdout.strip())
-                                time.sleep(5)
-                            
-                            logger.info("等待3秒后重试 (%d/%d)...", retry_count, max_retries)
-                            time.sleep(3)
-                except Exception as e:
-                    logger.error("执行命令时发生异常: %s", e)
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        logger.info("等待3秒后重试 (%d/%d)...", retry_count, max_retries)
-                        time.sleep(3)
-            
-            if not success:
-                logger.warning("警告: 节点 %d 下电失败，尝试继续下一个节点...", node)
-                # 不抛出异常，继续处理其他节点
-                continue
+        # 写入端口状态（横向排布，按数字顺序）
+        sorted_interfaces = sorted(interfaces, key=lambda interface: port_sort_key(interface[0]))
         
-        # 等待2秒确保下电完成
-        time.sleep(2)
+        # 使用固定宽度格式化，使Dev/Port和Link列对齐
+        # 动态计算端口号的最大宽度
+        max_port_width = max((len(port) for port, link in sorted_interfaces), default=0)
+        # 状态宽度固定为3（Up和Down都是3个字符）
+        status_width = 3
         
-        # 2. 执行电源上电操作
-        logger.info("执行电源上电操作...")
-        for node in target_nodes:
-            # 先检查节点当前状态
-            status_cmd = f"mgmt_tool node power get -n {node}"
-            try:
-                status_result = subprocess.run(status_cmd, shell=True, check=False, capture_output=True, text=True)
-                if status_result.returncode == 0:
-                    logger.info("节点 %d 当前状态: %s", node, status_result.stdout.strip())
-                    if "power on" in status_result.stdout:
-                        logger.info("节点 %d 已处于上电状态，跳过上电操作", node)
-                        continue
-                else:
-                    logger.warning("获取节点 %d 状态失败: %s", node, status_result.stderr.strip())
-            except Exception as e:
-                logger.error("获取节点 %d 状态时发生异常: %s", node, e)
-            
-            # 尝试上电
-            on_cmd = f"mgmt_tool node power on -n {node}"
-            logger.info("执行命令: %s", on_cmd)
-            
-            # 添加重试机制
-            retry_count = 0
-            max_retries = 3
-            success = False
-            
-            while retry_count < max_retries and not success:
-                try:
-                    result = subprocess.run(on_cmd, shell=True, check=False, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        logger.info("SUCCEED: %s", result.stdout.strip())
-                        success = True
-                    else:
-                        logger.warning("FAILED: 命令返回状态码 %d", result.returncode)
-                        logger.warning("错误输出: %s", result.stderr.strip())
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            logger.info("等待3秒后重试 (%d/%d)...", retry_count, max_retries)
-                            time.sleep(3)
-                except Exception as e:
-                    logger.error("执行命令时发生异常: %s", e)
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        logger.info("等待3秒后重试 (%d/%d)...", retry_count, max_retries)
-                        time.sleep(3)
-            
-            if not success:
-                logger.warning("警告: 节点 %d 上电失败，尝试继续下一个节点...", node)
-                # 不抛出异常，继续处理其他节点
-                continue
+        # 构建格式化的端口和状态字符串，项目之间用空格分隔
+        ports_str = " ".join(f"{port:<{max_port_width}}" for port, link in sorted_interfaces)
+        links_str = " ".join(f"{link:<{status_width}}" for port, link in sorted_interfaces)
         
-        # 等待40秒确保系统完全启动
-        wait_time = 40
-        logger.info("等待%d秒让系统完全启动...", wait_time)
+        f.write(f"Dev/Port: {ports_str}\n")
+        f.write(f"Link:     {links_str}\n")
         
-        # 优化的进度条实现 - 同一行更新，避免产生多行输出
+        f.write("\n")
+
+def log_metrics_summary(metrics):
+    """测试结束时输出各阶段和各节点耗时的p50/p95/max"""
+    rows = metrics.summary()
+    if not rows:
+        return
+    logger.info("各阶段耗时统计（%d 次循环，单位为秒）:", metrics.cycles)
+    logger.info("%-24s%8s%10s%10s%10s", "阶段", "次数", "p50", "p95", "max")
+    for phase, _, count, p50, p95, peak in rows:
+        logger.info("%-24s%8d%10.2f%10.2f%10.2f", phase, count, p50, p95, peak)
+
+def run_dut(args, limiter):
+    """执行一个DUT的全部循环：上下电、等待启动、串口采集和解析
+    
+    Args:
+        args: 该DUT的参数（命令行参数，活动配置中的设置已覆盖）
+        limiter: MgmtLimiter管理控制器限流，多个DUT共用
+    """
+    # 确定循环次数
+    cycles = 1 if args.single_cycle else args.cycles
+    
+    # 获取要操作的节点列表
+    target_nodes = args.nodes
+    
+    # 各节点下电/上电失败的累计次数
+    power_failures = Counter()
+    
+    # 节点电源控制和串口终端会话，所有循环共用
+    control = NodeControl(args.mgmt_tool, limiter)
+    console = ConsoleSession(args.console_device, args.baudrate, paging_command=args.paging_command)
+    
+    # 结构化的循环记录，打开时修复上次中断留下的不完整记录和索引
+    try:
+        store = CycleStore(args.store, flush_every=args.store_flush)
+    except (OSError, ValueError) as e:
+        logger.error("打开记录文件%s失败: %s", args.store, e)
+        return
+    
+    # 续测时从检查点恢复循环编号、端口状态和各节点的失败次数
+    checkpoint = args.checkpoint or args.store + '.checkpoint'
+    resume = None
+    if args.resume:
         try:
-            for i in range(wait_time):
-                # 计算进度百分比
-                progress = (i + 1) / wait_time
-                percent = int(progress * 100)
-                
-                # 创建图形化进度条（20个字符宽度）
-                bar_width = 60
-                filled_length = int(bar_width * progress)
-                bar = '=' * filled_length + '-' * (bar_width - filled_length)
-                
-                # 使用回车符清除当前行并显示进度条，不换行
-                print(f"\r[{bar}] {percent}% ({i + 1}/{wait_time}秒)", end="", flush=True)
-                
-                # 仅在最后记录一次完整的日志，避免干扰进度条显示
-                if (i + 1) == wait_time:
-                    print()
-                    logger.info("已等待 %d 秒完成", i + 1)
-                
-                time.sleep(1)
-        except KeyboardInterrupt:
-            print()  # 先换行，确保错误信息显示在新行
-            logger.info("用户中断了等待过程")
-            raise
-        
-        # 完成后换行
-        print()
-        logger.info("系统启动等待完成")
-        
-        # 3. 通过指令进入串口终端并执行命令
-        logger.info("进入串口终端并执行命令...")
-        
-        # 打开串口终端
-        child = pexpect.spawn("picocom -b 115200 /dev/ttyS6")
-        
+            resume = load_checkpoint(checkpoint, target_nodes, store)
+        except (OSError, ValueError) as e:
+            logger.error("读取检查点%s失败: %s", checkpoint, e)
+            store.close()
+            return
+        if resume is None:
+            logger.info("没有找到检查点%s，从第 1 次循环开始", checkpoint)
+        else:
+            logger.info("从检查点%s恢复，已完成 %d 次循环（更新于 %s）", checkpoint, resume['completed'],
+                        resume['updated'])
+            if resume['unrecorded']:
+                logger.warning("其中 %d 次循环没有端口状态记录: %s", len(resume['unrecorded']),
+                               ", ".join(map(str, resume['unrecorded'])))
+            power_failures.update({(node, action): count for node, action, count in resume['power_failures']})
+    elif os.path.exists(checkpoint):
+        logger.info("将覆盖已有的检查点%s，使用--resume可以接着其中的进度继续", checkpoint)
+
+    # 各阶段耗时，多个DUT同时运行时以DUT名称区分
+    metrics = CycleMetrics(args.metrics_jsonl or None, args.metrics_prom, {'dut': args.dut} if args.dut else None)
+    
+    try:
+        run_cycles(args, cycles, target_nodes, power_failures, console, control, store, checkpoint, metrics,
+                   resume)
+    finally:
+        store.close()
+        console.close()
+        log_metrics_summary(metrics)
+        for (node, action), count in sorted(power_failures.items()):
+            logger.warning("节点 %d 在 %d 次循环中%s失败", node, count, POWER_ACTIONS[action])
+
+def run_campaign(duts, limiter):
+    """每个DUT在单独的线程中独立执行，互不等待，只共用管理控制器限流
+    
+    Args:
+        duts: [(名称, 参数), ...]
+        limiter: MgmtLimiter管理控制器限流
+    """
+    def worker(name, dut_args):
         try:
-            # 等待终端初始化，然后发送回车以获取提示符
-            time.sleep(2)  # 等待2秒让终端初始化
-            
-            # 发送回车
-            child.sendline("")
-            
-            # 等待终端提示符出现
-            child.expect("Console#", timeout=60)
-            logger.info("成功进入串口终端")
-            
-            # 执行show interfaces status all命令
-            child.sendline("show interfaces status all")
+            run_dut(dut_args, limiter)
+        except Exception as e:
+            logger.exception("DUT执行过程中发生错误: %s", e)
+        logger.info("DUT %s 的测试结束", name)
+    
+    threads = [threading.Thread(target=worker, args=(name, dut_args), name=f"dut:{name}", daemon=True)
+               for name, dut_args in duts]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            # 分段等待，主线程可以及时响应Ctrl+C
+            while thread.is_alive():
+                thread.join(1.0)
+    except KeyboardInterrupt:
+        logger.info("用户中断了测试")
+        raise
+    logger.info("全部 %d 个DUT的测试结束，总耗时 %.1f 秒", len(duts), time.monotonic() - start)
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    
+    if args.campaign:
+        try:
+            duts = load_campaign(args.campaign, args)
+        except (OSError, ValueError) as e:
+            logger.error("读取活动配置失败: %s", e)
+            sys.exit(1)
+    else:
+        duts = [(None, args)]
+    
+    for name, dut_args in duts:
+        dut_args.dut = name
+    
+    limiter = MgmtLimiter(args.mgmt_concurrency, args.mgmt_rate)
+    if len(duts) == 1:
+        duts[0][1].progress = True
+        run_dut(duts[0][1], limiter)
+        return
+    for _, dut_args in duts:
+        dut_args.progress = False
+    run_campaign(duts, limiter)
+
+def run_cycles(args, cycles, target_nodes, power_failures, console, control, store, checkpoint, metrics,
+               resume=None):
+    """循环执行上下电和端口状态采集
+    
+    Args:
+        args: 命令行参数
+        cycles: 循环次数
+        target_nodes: 要操作的节点列表
+        power_failures: 以(节点, 'off'/'on')为键的失败次数计数器
+        console: ConsoleSession串口终端会话
+        control: NodeControl节点电源控制
+        store: CycleStore循环记录
+        checkpoint: 检查点文件路径
+        metrics: CycleMetrics各阶段耗时
+        resume: 续测时为load_checkpoint()读取的检查点内容
+    """
+    # 上一次循环的端口状态和基线（端口 -> 'Up'/'Down'），未指定基线文件时以第一次循环为基线
+    previous_links = None
+    baseline_links = load_baseline(args.baseline) if args.baseline else None
+    # 已经执行过、但串口读取或保存失败而没有写入记录文件的循环
+    unrecorded = []
+    first_cycle = 1
+    if resume is not None:
+        first_cycle = resume['completed'] + 1
+        unrecorded = resume['unrecorded']
+        previous_links = resume['previous_links']
+        baseline_links = baseline_links or resume['baseline_links']
+        if first_cycle > cycles:
+            logger.info("检查点中已完成全部 %d 次循环", cycles)
+            return
+    
+    # 最近一次循环结束时的检查点内容，还没有写入检查点文件时不为None
+    latest = None
+    
+    def save(cycle):
+        # 记录文件按--store-flush批量刷新，检查点只在记录文件中没有未刷新的记录时写入，
+        # 检查点中已完成的循环除unrecorded中的以外，在记录文件中都已写入磁盘
+        nonlocal latest
+        latest = {
+            'cycles': cycles,
+            'completed': cycle,
+            'unrecorded': list(unrecorded),
+            'nodes': list(target_nodes),
+            'power_failures': [[node, action, count] for (node, action), count in sorted(power_failures.items())],
+            'previous_links': previous_links,
+            'baseline_links': baseline_links,
+            'store_records': len(store),
+            'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if not store.pending:
+            save_checkpoint(checkpoint, latest)
+            latest = None
+    
+    try:
+        # 循环执行指定次数，续测时循环次数接着检查点编号
+        for cycle in range(first_cycle, cycles + 1):
+            logger.info("=== 开始第 %d 次循环 ===", cycle)
+            launches = control.launches
+            cycle_start = time.monotonic()
+            stop = False
+            recorded = False
             
-            # 收集输出，处理分页
-            output = ""
-            while True:
-                try:
-                    index = child.expect(["Type <CR> to continue, Q<CR> to stop:", "Console#"], timeout=30)
-                    if index == 0:
-                        # 处理分页提示，按回车继续
-                        output += child.before.decode()
-                        child.sendline("")
-                    else:
-                        # 命令执行完成，获取剩余输出
-                        output += child.before.decode()
-                        break
-                except pexpect.TIMEOUT:
-                    logger.warning("命令执行超时")
-                    break
+            # 每次循环开始时用一个子进程刷新所有节点的电源状态，本次循环中的跳过判断都使用缓存
+            control.query(target_nodes)
             
-            logger.info("成功获取命令输出")
+            # 1. 执行电源下电操作，各节点并发执行
+            logger.info("执行电源下电操作...")
+            with metrics.timer('power_off'):
+                results = run_power_phase(target_nodes, 'off', control, args.parallel)
+            for result in results:
+                metrics.record('power_off', result['elapsed'], node=result['node'])
+                if result['status'] == POWER_FAILED:
+                    power_failures[(result['node'], 'off')] += 1
             
-            # 4. 解析数据
-            logger.info("解析端口状态数据...")
+            # 等待2秒确保下电完成
+            time.sleep(2)
             
-            # 解析Dev/Port和Link状态
-            interfaces = []
-            # 使用正则表达式匹配端口信息行
-            pattern = r'^(\d+/\d+)\s+\S+\s+(Up|Down)\s+'
-            lines = output.split('\n')
+            # 2. 执行电源上电操作，各节点并发执行
+            logger.info("执行电源上电操作...")
+            with metrics.timer('power_on'):
+                results = run_power_phase(target_nodes, 'on', control, args.parallel)
+            for result in results:
+                metrics.record('power_on', result['elapsed'], node=result['node'])
+                if result['status'] == POWER_FAILED:
+                    power_failures[(result['node'], 'on')] += 1
+            # 设备重启后CLI的分页设置恢复默认
+            console.device_rebooted()
             
-            for line in lines:
-                match = re.match(pattern, line.strip())
-                if match:
-                    port = match.group(1)
-                    link = match.group(2)
-                    interfaces.append((port, link))
+            # 轮询就绪信号，设备就绪后立即继续，不再固定等待
+            checks = build_ready_checks(args, target_nodes, console, control)
+            logger.info("等待系统启动（检查: %s，最多 %d 秒）...", ", ".join(name for name, _ in checks),
+                        args.boot_timeout)
+            with metrics.timer('boot'):
+                boot_time = wait_until_ready(checks, args.boot_timeout, progress=args.progress)
+            if boot_time is None:
+                logger.warning("系统启动等待超时（%d 秒），继续执行后续步骤", args.boot_timeout)
+            else:
+                logger.info("系统启动完成，上电后 %.1f 秒就绪", boot_time)
             
-            logger.info("成功解析 %d 个端口状态", len(interfaces))
+            # 3. 通过串口终端会话执行命令（会话在各次循环之间保持打开）
+            logger.info("通过串口终端执行命令...")
             
-            # 5. 保存到test.log文件
-            logger.info("保存数据到test.log文件...")
-            with open("/share/test.log", "a") as f:
-                # 写入循环次数和执行时间
-                f.write(f"循环次数: {cycle}\n")
-                f.write(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                
-                # 写入端口状态（横向排布，按数字顺序）
-                # 自定义排序函数：按端口号数字排序
-                def sort_key(interface):
-                    port, link = interface
-                    dev, port_num = map(int, port.split('/'))
-                    return (dev, port_num)
-                
-                sorted_interfaces = sorted(interfaces, key=sort_key)
+            try:
+                # 4. 执行show interfaces status all命令，输出边接收边解析，
+                # 与上一次循环和基线相比由Up变为Down的端口立即记录
+                attempts = args.regression_retries + 1 if args.on_regression == 'retry' else 1
+                for attempt in range(1, attempts + 1):
+                    port_parser = PortStatusParser(previous_links, baseline_links)
+                    # 解析在接收输出的过程中进行，串口命令的耗时扣除解析耗时，两者分别统计
+                    command_start = time.monotonic()
+                    try:
+                        console.run("show interfaces status all", timeout=30, sink=port_parser)
+                        port_parser.close()
+                    finally:
+                        metrics.record('console', time.monotonic() - command_start - port_parser.elapsed)
+                        metrics.record('parse', port_parser.elapsed)
+                    if not port_parser.regressions or attempt == attempts:
+                        break
+                    logger.info("端口状态回退，等待%d秒后重新读取 (%d/%d)...", args.regression_wait, attempt,
+                                attempts - 1)
+                    time.sleep(args.regression_wait)
                 
-                # 使用固定宽度格式化，使Dev/Port和Link列对齐
-                # 动态计算端口号的最大宽度
-                max_port_width = max(len(port) for port, link in sorted_interfaces)
-                # 状态宽度固定为3（Up和Down都是3个字符）
-                status_width = 3
+                interfaces = list(port_parser.links.items())
+                logger.info("成功解析 %d 个端口状态", len(interfaces))
+                if interfaces:
+                    previous_links = port_parser.links
+                    if baseline_links is None:
+                        baseline_links = port_parser.links
+                        logger.info("使用第 %d 次循环的端口状态作为基线", cycle)
                 
-                # 构建格式化的端口和状态字符串
-                formatted_ports = []
-                formatted_links = []
-                for port, link in sorted_interfaces:
-                    # 端口号使用固定宽度左对齐
-                    formatted_port = f"{port:<{max_port_width}}"
-                    # 状态使用固定宽度左对齐
-                    formatted_link = f"{link:<{status_width}}"
-                    formatted_ports.append(formatted_port)
-                    formatted_links.append(formatted_link)
+                # 5. 保存到记录文件，按需同时写入文本格式的test.log
+                logger.info("保存数据到%s...", args.store)
+                with metrics.timer('persist'):
+                    store.append(cycle, port_parser.links, boot_time)
+                    recorded = True
+                    if not args.no_legacy_log:
+                        write_legacy_record(args.output, cycle, interfaces)
                 
-                # 合并为字符串，项目之间用空格分隔
-                ports_str = " ".join(formatted_ports)
-                links_str = " ".join(formatted_links)
+                logger.info("数据保存完成")
                 
-                f.write(f"Dev/Port: {ports_str}\n")
-                f.write(f"Link:     {links_str}\n")
+                if port_parser.regressions and args.on_regression == 'abort':
+                    logger.error("第 %d 次循环出现 %d 处端口状态回退，停止测试", cycle, len(port_parser.regressions))
+                    stop = True
                 
-                f.write("\n")
+            except pexpect.EOF:
+                # 下一次使用会话时自动重新打开串口
+                logger.warning("串口终端意外关闭")
+                console.close()
+            except pexpect.TIMEOUT:
+                logger.warning("串口终端没有出现提示符")
+            except Exception as e:
+                logger.error("串口操作过程中发生错误: %s", e)
             
-            logger.info("数据保存完成")
+            if not recorded:
+                unrecorded.append(cycle)
+                logger.warning("第 %d 次循环没有写入端口状态记录，检查点中单独记录", cycle)
             
-        except pexpect.EOF:
-            logger.warning("串口终端意外关闭")
-        except pexpect.TIMEOUT:
-            logger.warning("进入串口终端超时")
-        except Exception as e:
-            logger.error("串口操作过程中发生错误: %s", e)
-        finally:
-            # 5. 退出串口终端（Ctrl+A+Q）
-            logger.info("退出串口终端...")
+            # 更新检查点，中断后从下一次循环继续
             try:
-                # 检查child对象是否存在且有效
-                if 'child' in locals() and child is not None:
-                    # 首先尝试标准退出序列
-                    try:
-                        # 尝试多种退出序列
-                        logger.info("尝试退出序列: Ctrl+A+Q...")
-                        child.send('\x01q')  # 发送 Ctrl+A+Q 组合序列
-                        time.sleep(0.5)
-                        
-                        if child.isalive():
-                            logger.info("尝试退出序列: Ctrl+A+X...")
-                            child.send('\x01x')  # 发送 Ctrl+A+X 组合序列
-                            time.sleep(0.5)
-                    except Exception as send_e:
-                        logger.warning("发送退出序列失败: %s", send_e)
-                    
-                    # 检查进程是否仍在运行
-                    if child.isalive():
-                        logger.warning("串口终端仍在运行，正在终止...")
-                        try:
-                            # 先尝试优雅终止
-                            child.terminate()
-                            time.sleep(1)
-                            
-                            # 检查是否终止成功
-                            if child.isalive():
-                                logger.warning("优雅终止失败，尝试强制终止...")
-                                child.kill()
-                                time.sleep(0.5)
-                        except Exception as terminate_e:
-                            logger.error("终止串口终端时发生错误: %s", terminate_e)
-                        
-                        # 最终检查
-                        if child.isalive():
-                            logger.warning("警告: 无法通过编程方式终止picocom，可能需要手动干预！")
-                        else:
-                            logger.info("串口终端已成功终止")
-                    else:
-                        logger.info("串口终端已正常退出")
-                        
-                    # 最后再次检查
-                    if not child.isalive():
-                        logger.info("串口终端已终止")
-                    else:
-                        logger.warning("警告：无法终止串口终端进程")
-                else:
-                    logger.info("没有检测到有效的串口终端对象")
-                    
-            except KeyboardInterrupt:
-                logger.info("检测到用户中断，正在清理资源...")
-                if 'child' in locals() and child is not None:
-                    try:
-                        child.kill()
-                        logger.info("强制终止串口终端")
-                    except:
-                        pass
-            except Exception as finally_e:
-                logger.error("退出串口终端时发生错误: %s", finally_e)
-        
-        logger.info("=== 第 %d 次循环完成 ===", cycle)
+                with metrics.timer('persist'):
+                    save(cycle)
+            except OSError as e:
+                logger.error("写入检查点%s失败: %s", checkpoint, e)
+            
+            logger.info("本次循环启动mgmt_tool子进程 %d 个（累计 %d 个，其中批量查询 %d 次）",
+                        control.launches - launches, control.launches, control.queries)
+            
+            # 记录本次循环各阶段的耗时
+            metrics.record('cycle', time.monotonic() - cycle_start)
+            try:
+                phases = metrics.end_cycle(cycle)
+                logger.info("本次循环耗时: %s", ", ".join(f"{phase} {seconds:.2f}秒" for phase, seconds in phases.items()))
+            except OSError as e:
+                logger.error("写入耗时统计失败: %s", e)
+            logger.info("=== 第 %d 次循环完成 ===", cycle)
+            if stop:
+                return
+    finally:
+        if latest is not None:
+            # 测试结束或中断时刷新剩余的记录，检查点更新到最后完成的循环
+            try:
+                store.flush()
+                save_checkpoint(checkpoint, latest)
+            except OSError as e:
+                logger.error("写入检查点%s失败: %s", checkpoint, e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cycle_store import CycleStore
+
+class CycleStoreFindTest(unittest.TestCase):
+    """CycleStore.find按循环次数查找记录"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cycle_store_test_')
+        self.path = os.path.join(self.directory, 'cycles.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def append_cycles(self, cycles):
+        with CycleStore(self.path, fsync=False) as store:
+            for position, cycle in enumerate(cycles):
+                store.append(cycle, {'0/24': 'Up', '0/25': 'Down'}, epoch=1000.0 + position)
+
+    def test_find_monotonic(self):
+        self.append_cycles([1, 2, 3, 4])
+        store = CycleStore(self.path, readonly=True)
+        self.assertTrue(store.monotonic)
+        self.assertEqual(store.find(3)['epoch'], 1002.0)
+        self.assertIsNone(store.find(5))
+
+    def test_find_returns_last_of_repeated_runs(self):
+        # 第二次从循环1开始的测试写入同一文件
+        self.append_cycles([1, 2, 3, 4, 1, 2])
+        for readonly in (False, True):
+            store = CycleStore(self.path, readonly=readonly)
+            self.assertFalse(store.monotonic)
+            self.assertEqual(store.find(2)['epoch'], 1005.0)
+            self.assertEqual(store.find(1)['epoch'], 1004.0)
+            self.assertEqual(store.find(4)['epoch'], 1003.0)
+            self.assertIsNone(store.find(5))
+            store.close()
+
+if __name__ == "__main__":
+    unittest.main()